@@ -0,0 +1,419 @@
+"""Микробенчмарки бота.
+
+    python bench.py                 - все бенчмарки
+    python bench.py user_context    - только выбранные
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+# database при импорте открывает bot_data.json в текущей папке,
+# поэтому работаем во временной, чтобы не трогать рабочую базу
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="p2ebot-bench-")
+os.chdir(WORKDIR)
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    BENCHMARKS[func.__name__[len("bench_"):]] = func
+    return func
+
+
+def measure(func, number: int, repeat: int = 3) -> float:
+    """Лучшее время одного вызова func, секунд"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def make_shop(path: str, users: int = 10000, keys_per_seller: int = 1000):
+    """Пишет синтетическую базу магазина"""
+    data = {
+        "users": {
+            str(100000 + i): {
+                "username": f"user{i}",
+                "language": "en" if i % 2 else "ru",
+                "joined": "2026-01-01T00:00:00",
+                "purchases": []
+            }
+            for i in range(users)
+        },
+        "sellers": {
+            f"seller_{n}": {
+                "name": f"Seller {n}",
+                "price": float(n),
+                "keys": [f"{'ABCDEFGHIJ'}:{i:08d}" for i in range(keys_per_seller)]
+            }
+            for n in range(1, 4)
+        },
+        "reviews": [],
+        "tickets": {},
+        "pending_payments": {}
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+@benchmark
+def bench_user_context():
+    """Накладные расходы на локализацию одного апдейта: до и после middleware"""
+    from database import Database
+    from i18n import TEXTS
+    from middlewares import UserContextMiddleware
+    from sqlite_db import SQLiteDatabase, migrate_from_json
+
+    make_shop("shop.json")
+    migrate_from_json("shop.json", "shop.sqlite3")
+    user_id = 100001
+    # Столько строк и клавиатур рендерит типичный хэндлер (show_sellers)
+    keys = ["select_seller", "price", "for", "piece", "keys_available"] * 3 + ["back"]
+    number = 20000
+
+    print(f"user_context: {len(keys)} строк на апдейт")
+    for name, db in (("json", Database("shop.json", persist="snapshot")), ("sqlite", SQLiteDatabase("shop.sqlite3"))):
+        async def handler_before(event, data):
+            # Как было: язык ищется в базе на каждую строку
+            for key in keys:
+                lang = db.get_user_language(user_id)
+                TEXTS.get(lang, TEXTS["ru"]).get(key, key)
+
+        async def handler_after(event, data):
+            t = data["t"]
+            for key in keys:
+                t(key)
+
+        middleware = UserContextMiddleware(db)
+
+        async def run(with_middleware: bool) -> float:
+            data = {"event_from_user": type("U", (), {"id": user_id})()}
+            start = time.perf_counter()
+            for _ in range(number):
+                if with_middleware:
+                    await middleware(handler_after, None, dict(data))
+                else:
+                    await handler_before(None, dict(data))
+            return (time.perf_counter() - start) / number
+
+        before = min(asyncio.run(run(False)) for _ in range(3))
+        after = min(asyncio.run(run(True)) for _ in range(3))
+        print(f"  {name:6} до: {before * 1e6:8.2f} мкс/апдейт, после: {after * 1e6:8.2f} мкс/апдейт ({before / after:.1f}x)")
+        db.close()
+
+
+@benchmark
+def bench_fsm_storage():
+    """Чтение и запись состояния диалога: MemoryStorage против SQLiteStorage"""
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from fsm_storage import SQLiteStorage
+
+    users = 10000
+    keys = [StorageKey(bot_id=1, chat_id=100000 + i, user_id=100000 + i) for i in range(users)]
+    for name, storage in (("memory", MemoryStorage()), ("sqlite", SQLiteStorage("fsm.sqlite3", ttl=86400))):
+        async def run():
+            # Треть пользователей посреди сценария, остальные без состояния
+            start = time.perf_counter()
+            for key in keys[::3]:
+                await storage.set_state(key, "AdminState:add_seller_name")
+                await storage.set_data(key, {"seller_id": "seller_9"})
+            write = (time.perf_counter() - start) / (2 * len(keys[::3]))
+            start = time.perf_counter()
+            for _ in range(5):
+                for key in keys:
+                    await storage.get_state(key)
+            read = (time.perf_counter() - start) / (5 * users)
+            await storage.close()
+            return read, write
+
+        read, write = asyncio.run(run())
+        print(f"  {name:6} get_state: {read * 1e6:6.2f} мкс, set_state/set_data: {write * 1e6:6.2f} мкс")
+
+
+@benchmark
+def bench_keygen():
+    """Генерация ключей: по одному через random.choices против пачки из os.urandom"""
+    import random
+    import string
+    from database import Database
+    from sqlite_db import SQLiteDatabase
+
+    def old_key():
+        part1 = ''.join(random.choices(string.ascii_uppercase, k=10))
+        part2 = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
+        return f"{part1}:{part2}"
+
+    count = 100000
+    start = time.perf_counter()
+    for _ in range(count):
+        old_key()
+    print(f"  random.choices по одному: {count / (time.perf_counter() - start):10,.0f} ключей/с (без проверки повторов)")
+
+    make_shop("keys.json", users=1000, keys_per_seller=100000)
+    for name, db in (("json", Database("keys.json", persist="snapshot")), ("sqlite", SQLiteDatabase("keys.sqlite3"))):
+        db.generate_keys("seller_1", 1)  # реестр выпущенных ключей строится при первой генерации
+        start = time.perf_counter()
+        keys = db.generate_keys("seller_2", count * 3)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:6} generate_keys({len(keys)}): {len(keys) / elapsed:10,.0f} ключей/с "
+              f"(с проверкой уникальности и записью)")
+        db.close()
+
+
+@benchmark
+def bench_key_lookup():
+    """Поиск ключа: перебор складов против реестра ключей, от 100 тыс. до 3 млн ключей"""
+    import random
+    from database import Database
+    from sqlite_db import SQLiteDatabase
+
+    for total in (100000, 1000000, 3000000):
+        make_shop(f"lookup{total}.json", users=1000, keys_per_seller=0)
+        for name, db in (("json", Database(f"lookup{total}.json", persist="journal")),
+                         ("sqlite", SQLiteDatabase(f"lookup{total}.sqlite3"))):
+            keys = []
+            for seller_id in ("seller_1", "seller_2", "seller_3"):
+                keys += db.generate_keys(seller_id, total // 3)
+            # Половина выборки продана: такие ключи ищутся в журнале покупок
+            sold = db.take_keys("seller_1", 500)
+            db.add_purchase(100000, "seller_1", sold, 1.0)
+            sample = random.sample(keys[500:], 500) + sold
+            db.get_key_info(sample[0])  # первое обращение строит индекс
+
+            def scan(key):
+                # Как было: перебор всех складов
+                for seller_id in db.get_sellers():
+                    if name == "json" and key in db.data["sellers"][seller_id]["keys"].to_list():
+                        return seller_id
+                    if name == "sqlite" and db.conn.execute(
+                            "SELECT 1 FROM keys WHERE seller_id = ? AND key = ?", (seller_id, key)).fetchone():
+                        return seller_id
+
+            start = time.perf_counter()
+            for key in sample[:10]:
+                scan(key)
+            before = (time.perf_counter() - start) / 10
+            start = time.perf_counter()
+            for key in sample:
+                db.get_key_info(key)
+            after = (time.perf_counter() - start) / len(sample)
+            print(f"  {name:6} перебор: {before * 1e6:10.1f} мкс, get_key_info: {after * 1e6:6.2f} мкс "
+                  f"({len(keys)} ключей)")
+            db.close()
+
+
+@benchmark
+def bench_inventory_memory():
+    """Память склада на 1 млн ключей: список строк против KeyInventory"""
+    import subprocess
+
+    # Каждый вариант в отдельном процессе: прирост RSS после построения склада
+    code = """
+import sys
+from keygen import generate_key_batch
+from inventory import KeyInventory
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4096
+
+batches = [generate_key_batch(10000) for _ in range(100)]
+blob = ["\\n".join(batch).encode() for batch in batches]
+del batches
+before = rss()
+stock = [] if sys.argv[1] == "list" else KeyInventory()
+for chunk in blob:
+    stock.extend(chunk.decode().split("\\n"))
+print(rss() - before)
+"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    sizes = {}
+    for kind in ("list", "inventory"):
+        out = subprocess.run([sys.executable, "-c", code, kind], cwd=root, capture_output=True, text=True, check=True)
+        sizes[kind] = int(out.stdout)
+    print(f"  список строк: {sizes['list'] / 2**20:6.1f} МБ, KeyInventory: {sizes['inventory'] / 2**20:6.1f} МБ "
+          f"({sizes['list'] / sizes['inventory']:.1f}x, 1 млн ключей)")
+
+    from inventory import KeyInventory
+    from keygen import generate_key_batch
+    keys = generate_key_batch(1000000)
+    inventory = KeyInventory(keys)
+    print(f"  to_list (запись снимка): {measure(inventory.to_list, 1) * 1e3:6.1f} мс, "
+          f"take(2): {measure(lambda: inventory.take(2), 1000) * 1e6:5.2f} мкс")
+
+
+@benchmark
+def bench_key_index_memory():
+    """Память реестра ключей в Database: словарь ключ -> запись против индекса хэшей, 1 млн ключей"""
+    import subprocess
+
+    from database import Database
+
+    make_shop("registry.json", users=1000, keys_per_seller=0)
+    db = Database("registry.json", persist="journal")
+    for seller_id in ("seller_1", "seller_2", "seller_3"):
+        db.generate_keys(seller_id, 1000000 // 3)
+    # Десятая часть ключей продана: они живут только в журнале покупок
+    for user_id in range(1000):
+        db.add_purchase(100000 + user_id, "seller_1", db.take_keys("seller_1", 100), 1.0)
+    db.close()
+
+    code = """
+import sys
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4096
+
+from database import Database
+db = Database("registry.json", "journal")
+db.get_keys_count("seller_1")  # склады прочитаны
+before = rss()
+if sys.argv[1] == "dict":
+    # Как было: каждый ключ отдельной строкой в словаре
+    index = {}
+    for record in db.ledger.iter_records():
+        for key in record["keys"]:
+            index[key] = (record["seller_id"], record["user_id"], record["date"])
+    for seller_id, seller in db.data["sellers"].items():
+        for key in seller["keys"]:
+            index[key] = (seller_id, None, None)
+else:
+    db.get_key_info("nope")
+print(before, rss() - before)
+"""
+    sizes = {}
+    for kind in ("dict", "digests"):
+        out = subprocess.run([sys.executable, "-c", code, kind], capture_output=True, text=True, check=True,
+                             env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__))))
+        sizes[kind] = [int(x) for x in out.stdout.split()]
+    print(f"  база со складами: {sizes['dict'][0] / 2**20:6.1f} МБ, реестр: словарь +{sizes['dict'][1] / 2**20:6.1f} МБ, "
+          f"хэши +{sizes['digests'][1] / 2**20:6.1f} МБ (1 млн ключей, 100 тыс. продано)")
+
+
+@benchmark
+def bench_startup():
+    """Запуск на большой базе: снимок старого формата (разбор целиком) против разделов по требованию"""
+    import subprocess
+
+    from database import Database
+    from snapshot import load_snapshot
+
+    make_shop("startup.json", users=200000, keys_per_seller=300000)
+    # Первый запуск переводит снимок в формат с разделами
+    Database("startup.json", "snapshot").close()
+    data = load_snapshot("startup.json")
+    with open("legacy.json", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    del data
+    # Запасные поколения не нужны: запуск не должен писать снимок вовсе
+    for name in os.listdir("."):
+        if name.startswith(("startup.json.", "legacy.json.")) and name[-1].isdigit():
+            os.remove(name)
+
+    code = """
+import os, sys, time
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * 4096
+
+from database import Database
+before = rss()
+start = time.perf_counter()
+db = Database(sys.argv[1], "snapshot")
+ready = time.perf_counter() - start
+db.get_user(100000)
+print(ready, time.perf_counter() - start, rss() - before)
+"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=root)
+    for path, title in (("legacy.json", "старый формат"), ("startup.json", "разделы")):
+        mtime = os.stat(path).st_mtime_ns
+        best = None
+        for _ in range(3):
+            out = subprocess.run([sys.executable, "-c", code, path], capture_output=True, text=True, check=True, env=env)
+            result = [float(x) for x in out.stdout.split()]
+            best = result if best is None or result[0] < best[0] else best
+        written = "записан" if os.stat(path).st_mtime_ns != mtime else "не менялся"
+        print(f"  {title:13}: запуск {best[0] * 1e3:7.1f} мс, с первым пользователем {best[1] * 1e3:7.1f} мс, "
+              f"RSS +{best[2] / 2**20:6.1f} МБ, снимок {written} "
+              f"({os.path.getsize(path) / 2**20:.0f} МБ)")
+
+
+@benchmark
+def bench_snapshot_codecs():
+    """Кодеки снимка на магазине из 100 тыс. пользователей: запись, чтение, размер"""
+    from database import Database
+    from snapshot import CODECS, build, open_snapshot, seal
+
+    make_shop("codecs.json", users=100000, keys_per_seller=100000)
+    db = Database("codecs.json", "snapshot")
+    for name in db.data.unloaded():
+        db.data[name]
+    for name, codec in CODECS.items():
+        def encode():
+            sections = [(section, codec.encode(value, db._encode)) for section, value in db.data.items()]
+            return seal(build(sections, codec))
+
+        blob = encode()
+        path = f"codec-{name}.snapshot"
+        with open(path, "wb") as f:
+            f.write(blob)
+
+        def decode():
+            snapshot = open_snapshot(path)
+            data = {section: snapshot.load(section) for section in snapshot.names()}
+            snapshot.close()
+            return data
+
+        assert decode()["users"] == db.data["users"]
+        print(f"  {name:8}: запись {measure(encode, 1) * 1e3:6.1f} мс, чтение {measure(decode, 1) * 1e3:6.1f} мс, "
+              f"размер {len(blob) / 2**20:5.1f} МБ")
+    db.close()
+
+
+@benchmark
+def bench_flush_stall():
+    """Работа event loop на одну отложенную запись: весь снимок против изменённых элементов"""
+    from config import cfg
+    from database import Database
+
+    make_shop("flush.json", users=200000, keys_per_seller=100000)
+    db = Database("flush.json", "snapshot")
+    for name in db.data.unloaded():
+        db.data[name]
+    uid = iter(range(10 ** 6))
+
+    def full():
+        db._reset_encoded()
+        return db._dump()
+
+    def incremental():
+        db.add_user(next(uid))
+        return db._dump()
+
+    # В режиме "snapshot" каждая мутация пишет файл - здесь нужно только кодирование
+    db._save = lambda: None
+    print(f"  весь снимок: {measure(full, 1) * 1e3:7.1f} мс, после add_user: {measure(incremental, 5) * 1e3:6.1f} мс "
+          f"(200 тыс. пользователей, кодек {cfg.SNAPSHOT_CODEC})")
+    db.close()
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            sys.exit(f"Неизвестный бенчмарк: {name}. Доступны: {', '.join(BENCHMARKS)}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
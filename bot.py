@@ -1,339 +1,56 @@
 import asyncio
 import logging
+import os
 import re
+import tempfile
+from functools import lru_cache
 from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
 
+from broadcast import Broadcaster
 from config import cfg
 from database import db
+from fsm_storage import SQLiteStorage
+from i18n import Translator, get_translator
+from key_import import import_file
+from middlewares import UserContextMiddleware
+from outbox import Outbox
+from ratelimit import TokenBucket
+from webhook import run_webhook
 
 logging.basicConfig(level=logging.INFO)
 
-bot = Bot(token=cfg.BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
-
-# === ЛОКАЛИЗАЦИЯ ===
-# === ЛОКАЛИЗАЦИЯ ===
-TEXTS = {
-    "ru": {
-        # === Главное меню ===
-        "welcome": "👋 Добро пожаловать в P2E Keys Shop!\n\n🔑 Здесь вы можете купить ключи для Play-to-Earn игр\n💰 Оплата принимается в USDT (TRC20)\n\nВыберите действие:",
-        "choose_language": "🌍 Выберите язык / Choose language:",
-        "language_set": "✅ Язык установлен: Русский",
-        "main_menu": "Главное меню:",
-        
-        # Кнопки (с эмодзи)
-        "sellers": "🛒 Продавцы",
-        "reviews": "⭐ Отзывы",
-        "support": "🆘 ТехПоддержка",
-        "settings": "⚙️ Настройки",
-        "admin_panel": "🔐 Админ панель",
-        "back": "🔙 Назад",
-        "cancel": "🔙 Отмена",
-        "i_paid": "✅ Я оплатил",
-        
-        # === Продавцы ===
-        "select_seller": "Выберите продавца:\n\n",
-        "no_sellers": "Нет доступных продавцов!",
-        "price": "Цена",
-        "keys_available": "Ключей в наличии",
-        "keys": "ключей",
-        "how_many": "Сколько ключей хотите купить?",
-        "available": "Доступно",
-        "order": "Заказ",
-        "quantity": "Количество",
-        "total": "Сумма к оплате",
-        "payment_details": "Реквизиты для оплаты USDT (TRC20):",
-        "payment_id": "ID платежа",
-        "after_payment": "После оплаты нажмите кнопку ниже.\nАдминистратор проверит платеж и вышлет ключи.",
-        
-        # === Платежи ===
-        "payment_not_found": "Платеж не найден!",
-        "new_payment": "Новая оплата!",
-        "user": "Пользователь",
-        "seller": "Продавец",
-        "amount": "Сумма",
-        "waiting_confirm": "Ожидаем подтверждения администратора...",
-        "admin_notified": "Администратор уведомлен!",
-        "payment_confirmed": "Оплата подтверждена!",
-        "your_keys": "Ваши ключи ({count} шт.):",
-        "save_keys": "Сохраните их! Покажите это сообщение при входе в игру.",
-        "pending_payments": "Ожидают подтверждения:",
-        "no_pending": "Нет ожидающих платежей.",
-        "confirm_usage": "Для подтверждения отправьте:\n/confirm [PAYMENT_ID]",
-        "already_paid": "Платеж не найден или уже подтвержден!",
-        "not_enough_keys": "Недостаточно ключей! Нужно {need}, есть {have}",
-        "key_error": "Ошибка при выдаче ключей!",
-        
-        # === Отзывы ===
-        "no_reviews": "Пока нет отзывов. Будьте первым!",
-        "latest_reviews": "Последние отзывы:",
-        "edited": "(изменено)",
-        
-        # === Поддержка ===
-        "support_title": "Техническая поддержка",
-        "support_desc": "Опишите вашу проблему или вопрос одним сообщением.\nМы ответим вам как можно скорее!",
-        "ticket_created": "Ваше обращение #{ticket_id} принято!\nМы ответим вам в ближайшее время.",
-        "new_ticket": "Новый тикет #{ticket_id}",
-        "from_user": "От",
-        "message": "Сообщение",
-        "reply_cmd": "Для ответа",
-        "close_cmd": "Для закрытия",
-        "reply_support": "Ответ поддержки по тикету #{ticket_id}:",
-        "no_tickets": "Нет открытых тикетов.",
-        "open_tickets": "Открытые тикеты:",
-        "ticket_not_found": "Тикет не найден!",
-        "ticket_closed": "Тикет #{ticket_id} закрыт",
-        "reply_sent": "Ответ отправлен пользователю {user_id}",
-        "error_sending": "Ошибка отправки",
-        
-        # === Настройки ===
-        "settings_title": "Ваши настройки",
-        "your_id": "ID",
-        "username": "Username",
-        "purchases": "Покупок",
-        "wallet": "Кошелек для выплат",
-        "not_set": "Не установлен",
-        
-        # === Ошибки и валидация ===
-        "invalid_seller": "Некорректный ID продавца!",
-        "seller_not_found": "Продавец не найден!",
-        "out_of_stock": "Ключи закончились!",
-        "invalid_price": "Цена должна быть больше 0!",
-        "enter_number": "Введите число!",
-        "invalid_range": "Введите число от 1 до 100!",
-        "id_empty": "ID не может быть пустым! Используйте только латинские буквы и цифры.",
-        "id_short": "ID слишком короткий (минимум 3 символа)!",
-        "id_exists": "Такой ID уже существует! Введите другой:",
-        
-        # === Успешные действия ===
-        "seller_added": "Продавец добавлен!",
-        "seller_deleted": "Продавец удален!",
-        "review_added": "Отзыв #{review_id} добавлен!",
-        "review_updated": "Отзыв #{review_id} обновлен!",
-        "review_deleted": "Отзыв #{review_id} удален!",
-        "keys_generated": "Сгенерировано {count} ключей!",
-        "keys_sent": "Ключи отправлены пользователю {user_id}",
-        
-        # === Админ панель ===
-        "admin_panel_title": "Административная панель",
-        "reviews_management": "Управление отзывами",
-        "choose_action": "Выберите действие:",
-        
-        # Кнопки админки
-        "stats_btn": "📊 Статистика",
-        "add_seller_btn": "➕ Добавить продавца",
-        "delete_seller_btn": "➖ Удалить продавца",
-        "reviews_btn": "📝 Управление отзывами",
-        "tickets_btn": "📩 Тикеты поддержки",
-        "gen_keys_btn": "🔑 Генерировать ключи",
-        "confirm_btn": "✅ Подтвердить оплату",
-        "add_review": "➕ Добавить отзыв",
-        "edit_review": "✏️ Редактировать отзыв",
-        "delete_review": "🗑️ Удалить отзыв",
-        "back_to_admin": "🔙 Назад в админку",
-        
-        # === Формы ===
-        "enter_seller_id": "Шаг 1/3: Введите ID продавца (только латинские буквы, цифры и _)\nНапример: seller_vip, super_keys, megashop",
-        "enter_seller_name": "Шаг 2/3: Введите название продавца (с эмодзи):",
-        "enter_price": "Шаг 3/3: Введите цену за ключ (число, например 2.5):",
-        "enter_review_user": "Шаг 1/2: Введите ID пользователя (или @username):",
-        "enter_review_text": "Шаг 2/2: Введите текст отзыва:",
-        "select_review_edit": "Выберите отзыв для редактирования:",
-        "select_review_delete": "Выберите отзыв для удаления:",
-        "enter_new_text": "Введите новый текст:",
-        "current_text": "Текущий текст",
-        "how_many_keys": "Сколько ключей сгенерировать? (введите число от 1 до 100):",
-        "select_seller_gen": "Выберите продавца для генерации ключей:",
-        "select_seller_delete": "Выберите продавца для удаления:",
-        
-        # === Статистика ===
-        "stats": "Статистика бота",
-        "users_count": "Пользователей",
-        "total_keys": "Всего ключей",
-        
-        # === Прочее ===
-        "no_sellers_delete": "Нет продавцов для удаления!",
-        "no_reviews_edit": "Нет отзывов для редактирования!",
-        "no_reviews_delete": "Нет отзывов для удаления!",
-        "review_not_found": "Отзыв не найден!",
-        "update_error": "Ошибка при обновлении!",
-        "first_three": "Первые 3",
-        "name": "Название",
-        "piece": "шт.",
-        "for": "за",
-        "pcs": "шт.",
-        "confirm_usage_cmd": "Использование: /confirm [PAYMENT_ID]",
-        "reply_usage": "Использование: /reply [TICKET_ID] [текст]",
-        "close_usage": "Использование: /close [TICKET_ID]"
-    },
-    "en": {
-        # === Main Menu ===
-        "welcome": "👋 Welcome to P2E Keys Shop!\n\n🔑 Here you can buy keys for Play-to-Earn games\n💰 Payment accepted in USDT (TRC20)\n\nChoose an action:",
-        "choose_language": "🌍 Choose language / Выберите язык:",
-        "language_set": "✅ Language set: English",
-        "main_menu": "Main menu:",
-        
-        # Buttons (with emoji)
-        "sellers": "🛒 Sellers",
-        "reviews": "⭐ Reviews",
-        "support": "🆘 Support",
-        "settings": "⚙️ Settings",
-        "admin_panel": "🔐 Admin Panel",
-        "back": "🔙 Back",
-        "cancel": "🔙 Cancel",
-        "i_paid": "✅ I paid",
-        
-        # === Sellers ===
-        "select_seller": "Select a seller:\n\n",
-        "no_sellers": "No sellers available!",
-        "price": "Price",
-        "keys_available": "Keys available",
-        "keys": "keys",
-        "how_many": "How many keys do you want to buy?",
-        "available": "Available",
-        "order": "Order",
-        "quantity": "Quantity",
-        "total": "Total to pay",
-        "payment_details": "Payment details for USDT (TRC20):",
-        "payment_id": "Payment ID",
-        "after_payment": "After payment, click the button below.\nAdministrator will verify and send the keys.",
-        
-        # === Payments ===
-        "payment_not_found": "Payment not found!",
-        "new_payment": "New payment!",
-        "user": "User",
-        "seller": "Seller",
-        "amount": "Amount",
-        "waiting_confirm": "Waiting for administrator confirmation...",
-        "admin_notified": "Administrator notified!",
-        "payment_confirmed": "Payment confirmed!",
-        "your_keys": "Your keys ({count} pcs.):",
-        "save_keys": "Save them! Show this message when entering the game.",
-        "pending_payments": "Pending confirmation:",
-        "no_pending": "No pending payments.",
-        "confirm_usage": "To confirm send:\n/confirm [PAYMENT_ID]",
-        "already_paid": "Payment not found or already confirmed!",
-        "not_enough_keys": "Not enough keys! Need {need}, have {have}",
-        "key_error": "Error issuing keys!",
-        
-        # === Reviews ===
-        "no_reviews": "No reviews yet. Be the first!",
-        "latest_reviews": "Latest reviews:",
-        "edited": "(edited)",
-        
-        # === Support ===
-        "support_title": "Technical Support",
-        "support_desc": "Describe your problem or question in one message.\nWe will reply as soon as possible!",
-        "ticket_created": "Your ticket #{ticket_id} has been received!\nWe will reply soon.",
-        "new_ticket": "New ticket #{ticket_id}",
-        "from_user": "From",
-        "message": "Message",
-        "reply_cmd": "To reply",
-        "close_cmd": "To close",
-        "reply_support": "Support reply for ticket #{ticket_id}:",
-        "no_tickets": "No open tickets.",
-        "open_tickets": "Open tickets:",
-        "ticket_not_found": "Ticket not found!",
-        "ticket_closed": "Ticket #{ticket_id} closed",
-        "reply_sent": "Reply sent to user {user_id}",
-        "error_sending": "Error sending",
-        
-        # === Settings ===
-        "settings_title": "Your Settings",
-        "your_id": "ID",
-        "username": "Username",
-        "purchases": "Purchases",
-        "wallet": "Payout wallet",
-        "not_set": "Not set",
-        
-        # === Errors & Validation ===
-        "invalid_seller": "Invalid seller ID!",
-        "seller_not_found": "Seller not found!",
-        "out_of_stock": "Out of stock!",
-        "invalid_price": "Price must be greater than 0!",
-        "enter_number": "Please enter a number!",
-        "invalid_range": "Enter a number from 1 to 100!",
-        "id_empty": "ID cannot be empty! Use latin letters and numbers only.",
-        "id_short": "ID too short (minimum 3 characters)!",
-        "id_exists": "This ID already exists! Enter another:",
-        
-        # === Success Actions ===
-        "seller_added": "Seller added!",
-        "seller_deleted": "Seller deleted!",
-        "review_added": "Review #{review_id} added!",
-        "review_updated": "Review #{review_id} updated!",
-        "review_deleted": "Review #{review_id} deleted!",
-        "keys_generated": "Generated {count} keys!",
-        "keys_sent": "Keys sent to user {user_id}",
-        
-        # === Admin Panel ===
-        "admin_panel_title": "Administrative Panel",
-        "reviews_management": "Reviews Management",
-        "choose_action": "Choose action:",
-        
-        # Admin buttons
-        "stats_btn": "📊 Statistics",
-        "add_seller_btn": "➕ Add Seller",
-        "delete_seller_btn": "➖ Delete Seller",
-        "reviews_btn": "📝 Reviews",
-        "tickets_btn": "📩 Support Tickets",
-        "gen_keys_btn": "🔑 Generate Keys",
-        "confirm_btn": "✅ Confirm Payment",
-        "add_review": "➕ Add Review",
-        "edit_review": "✏️ Edit Review",
-        "delete_review": "🗑️ Delete Review",
-        "back_to_admin": "🔙 Back to Admin",
-        
-        # === Forms ===
-        "enter_seller_id": "Step 1/3: Enter seller ID (latin letters, numbers and _ only)\nExample: seller_vip, super_keys, megashop",
-        "enter_seller_name": "Step 2/3: Enter seller name (with emoji):",
-        "enter_price": "Step 3/3: Enter price per key (number, e.g. 2.5):",
-        "enter_review_user": "Step 1/2: Enter user ID (or @username):",
-        "enter_review_text": "Step 2/2: Enter review text:",
-        "select_review_edit": "Select review to edit:",
-        "select_review_delete": "Select review to delete:",
-        "enter_new_text": "Enter new text:",
-        "current_text": "Current text",
-        "how_many_keys": "How many keys to generate? (enter number from 1 to 100):",
-        "select_seller_gen": "Select seller to generate keys for:",
-        "select_seller_delete": "Select seller to delete:",
-        
-        # === Statistics ===
-        "stats": "Bot Statistics",
-        "users_count": "Users",
-        "total_keys": "Total keys",
-        
-        # === Other ===
-        "no_sellers_delete": "No sellers to delete!",
-        "no_reviews_edit": "No reviews to edit!",
-        "no_reviews_delete": "No reviews to delete!",
-        "review_not_found": "Review not found!",
-        "update_error": "Error updating!",
-        "first_three": "First 3",
-        "name": "Name",
-        "piece": "pc.",
-        "for": "for",
-        "pcs": "pcs.",
-        "confirm_usage_cmd": "Usage: /confirm [PAYMENT_ID]",
-        "reply_usage": "Usage: /reply [TICKET_ID] [text]",
-        "close_usage": "Usage: /close [TICKET_ID]"
-    }
-}
-
-def get_text(user_id: int, key: str, **kwargs) -> str:
-    """Получить текст на языке пользователя"""
-    lang = db.get_user_language(user_id)
-    text = TEXTS.get(lang, TEXTS["ru"]).get(key, key)
-    if kwargs:
-        text = text.format(**kwargs)
-    return text
+session = None
+if cfg.TELEGRAM_API_URL:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(cfg.TELEGRAM_API_URL))
+bot = Bot(token=cfg.BOT_TOKEN, session=session)
+storage = SQLiteStorage(cfg.FSM_FILE, cfg.FSM_TTL, cache=cfg.WORKERS == 1) if cfg.FSM_STORAGE == "sqlite" else MemoryStorage()
+dp = Dispatcher(storage=storage)
+dp.message.middleware(UserContextMiddleware(db))
+dp.callback_query.middleware(UserContextMiddleware(db))
+# Одна корзина на все исходящие сообщения бота
+send_limiter = TokenBucket(cfg.SEND_RATE)
+outbox = Outbox(bot, db, cfg.OUTBOX_WORKERS, cfg.OUTBOX_RETRIES, cfg.OUTBOX_BACKOFF, send_limiter)
+broadcaster = Broadcaster(
+    bot, db, send_limiter, cfg.BROADCAST_RATE, cfg.BROADCAST_CHAT_INTERVAL, cfg.BROADCAST_CHUNK,
+    cfg.BROADCAST_RETRIES
+)
+
+def user_translator(user_id: int) -> Translator:
+    """Переводчик для произвольного пользователя (админ, покупатель)"""
+    return get_translator(db.get_user_language(user_id))
 
 # === КЛАВИАТУРЫ ===
+# Разметка собирается один раз и переиспользуется. Переводчики кэшируются
+# по языку, поэтому сам объект t годится как ключ кэша. Клавиатуры,
+# зависящие от каталога, дополнительно привязаны к db.catalog_version.
+@lru_cache(maxsize=None)
 def language_keyboard():
     buttons = [
         [
@@ -343,21 +60,22 @@ def language_keyboard():
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def main_menu(user_id: int, is_admin: bool = False):
-    lang = db.get_user_language(user_id)
-    t = TEXTS[lang]
+@lru_cache(maxsize=None)
+def main_menu(t: Translator, is_admin: bool = False):
     buttons = [
-        [KeyboardButton(text=t["sellers"])],
-        [KeyboardButton(text=t["reviews"]), KeyboardButton(text=t["support"])],
-        [KeyboardButton(text=t["settings"])]
+        [KeyboardButton(text=t("sellers"))],
+        [KeyboardButton(text=t("reviews")), KeyboardButton(text=t("support"))],
+        [KeyboardButton(text=t("settings"))]
     ]
     if is_admin:
-        buttons.append([KeyboardButton(text=t["admin_panel"])])
+        buttons.append([KeyboardButton(text=t("admin_panel"))])
     return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
 
-def sellers_keyboard(user_id: int):
-    lang = db.get_user_language(user_id)
-    t = TEXTS[lang]
+def sellers_keyboard(t: Translator):
+    return _sellers_keyboard(t, db.catalog_version)
+
+@lru_cache(maxsize=16)
+def _sellers_keyboard(t: Translator, catalog_version: int):
     sellers = db.get_sellers()
     buttons = []
     for seller_id, data in sellers.items():
@@ -365,12 +83,11 @@ def sellers_keyboard(user_id: int):
             continue
         btn_text = f"{data['name']} — ${data['price']}"
         buttons.append([InlineKeyboardButton(text=btn_text, callback_data=f"buy_{seller_id}")])
-    buttons.append([InlineKeyboardButton(text=t["back"], callback_data="back_main")])
+    buttons.append([InlineKeyboardButton(text=t("back"), callback_data="back_main")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def quantity_keyboard(user_id: int, seller_id: str, max_qty: int = 10):
-    lang = db.get_user_language(user_id)
-    t = TEXTS[lang]
+@lru_cache(maxsize=256)
+def quantity_keyboard(t: Translator, seller_id: str, max_qty: int = 10):
     buttons = []
     row = []
     for i in range(1, min(max_qty + 1, 11)):
@@ -380,32 +97,41 @@ def quantity_keyboard(user_id: int, seller_id: str, max_qty: int = 10):
             row = []
     if row:
         buttons.append(row)
-    buttons.append([InlineKeyboardButton(text=t["back"], callback_data="back_sellers")])
+    buttons.append([InlineKeyboardButton(text=t("back"), callback_data="back_sellers")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def admin_keyboard(user_id: int):
-    lang = db.get_user_language(user_id)
-    t = TEXTS[lang]
+@lru_cache(maxsize=None)
+def admin_keyboard(t: Translator):
     buttons = [
-        [InlineKeyboardButton(text=t["stats_btn"], callback_data="admin_stats")],
-        [InlineKeyboardButton(text=t["add_seller_btn"], callback_data="admin_add_seller")],
-        [InlineKeyboardButton(text=t["delete_seller_btn"], callback_data="admin_del_seller")],
-        [InlineKeyboardButton(text=t["reviews_btn"], callback_data="admin_reviews")],
-        [InlineKeyboardButton(text=t["tickets_btn"], callback_data="admin_tickets")],
-        [InlineKeyboardButton(text=t["gen_keys_btn"], callback_data="admin_gen_keys")],
-        [InlineKeyboardButton(text=t["confirm_btn"], callback_data="admin_confirm")],
-        [InlineKeyboardButton(text=t["back"], callback_data="back_main")]
+        [InlineKeyboardButton(text=t("stats_btn"), callback_data="admin_stats")],
+        [InlineKeyboardButton(text=t("add_seller_btn"), callback_data="admin_add_seller")],
+        [InlineKeyboardButton(text=t("delete_seller_btn"), callback_data="admin_del_seller")],
+        [InlineKeyboardButton(text=t("reviews_btn"), callback_data="admin_reviews")],
+        [InlineKeyboardButton(text=t("tickets_btn"), callback_data="admin_tickets")],
+        [InlineKeyboardButton(text=t("gen_keys_btn"), callback_data="admin_gen_keys")],
+        [InlineKeyboardButton(text=t("confirm_btn"), callback_data="admin_confirm")],
+        [InlineKeyboardButton(text=t("back"), callback_data="back_main")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def reviews_admin_keyboard(user_id: int):
-    lang = db.get_user_language(user_id)
-    t = TEXTS[lang]
+@lru_cache(maxsize=1024)
+def history_keyboard(t: Translator, page: int, has_next: bool):
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀️", callback_data=f"history_{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="▶️", callback_data=f"history_{page + 1}"))
+    buttons = [nav] if nav else []
+    buttons.append([InlineKeyboardButton(text=t("back"), callback_data="back_main")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+@lru_cache(maxsize=None)
+def reviews_admin_keyboard(t: Translator):
     buttons = [
-        [InlineKeyboardButton(text=t["add_review"], callback_data="admin_add_review")],
-        [InlineKeyboardButton(text=t["edit_review"], callback_data="admin_edit_review")],
-        [InlineKeyboardButton(text=t["delete_review"], callback_data="admin_del_review")],
-        [InlineKeyboardButton(text=t["back_to_admin"], callback_data="admin_panel")]
+        [InlineKeyboardButton(text=t("add_review"), callback_data="admin_add_review")],
+        [InlineKeyboardButton(text=t("edit_review"), callback_data="admin_edit_review")],
+        [InlineKeyboardButton(text=t("delete_review"), callback_data="admin_del_review")],
+        [InlineKeyboardButton(text=t("back_to_admin"), callback_data="admin_panel")]
     ]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
@@ -427,18 +153,17 @@ class AdminState(StatesGroup):
     del_review_select = State()
     gen_keys_select = State()
     gen_keys_count = State()
+    import_keys_file = State()
 
 # === ХЭНДЛЕРЫ ===
 
 @dp.message(Command("start"))
-async def cmd_start(message: types.Message):
-    # Проверяем, есть ли пользователь в базе
-    user_exists = str(message.from_user.id) in db.data["users"]
-    
-    if not user_exists:
+async def cmd_start(message: types.Message, user: dict, t: Translator):
+    # Запись пользователя уже достана UserContextMiddleware
+    if user is None:
         # Новый пользователь - показываем выбор языка
         await message.answer(
-            get_text(message.from_user.id, "choose_language"),
+            t("choose_language"),
             reply_markup=language_keyboard()
         )
     else:
@@ -447,8 +172,8 @@ async def cmd_start(message: types.Message):
         db.add_user(message.from_user.id, message.from_user.username)
         
         await message.answer(
-            get_text(message.from_user.id, "welcome"),
-            reply_markup=main_menu(message.from_user.id, is_admin)
+            t("welcome"),
+            reply_markup=main_menu(t, is_admin)
         )
 
 @dp.callback_query(F.data.startswith("lang_"))
@@ -457,67 +182,68 @@ async def process_language(callback: types.CallbackQuery):
     
     # Добавляем пользователя с выбранным языком
     db.add_user(callback.from_user.id, callback.from_user.username, language=lang)
+    t = user_translator(callback.from_user.id)
     
     await callback.message.delete()
     await callback.message.answer(
-        get_text(callback.from_user.id, "language_set"),
-        reply_markup=main_menu(callback.from_user.id, callback.from_user.id == cfg.ADMIN_ID)
+        t("language_set"),
+        reply_markup=main_menu(t, callback.from_user.id == cfg.ADMIN_ID)
     )
     await callback.answer()
 
 # --- ПРОДАВЦЫ ---
 @dp.message(F.text.in_(["🛒 Продавцы", "🛒 Sellers"]))
-async def show_sellers(message: types.Message):
-    text = get_text(message.from_user.id, "select_seller")
+async def show_sellers(message: types.Message, t: Translator):
+    text = t("select_seller")
     valid_sellers = 0
     for seller_id, data in db.get_sellers().items():
         if not re.match(r'^[a-zA-Z0-9_]+$', seller_id):
             continue
         keys_left = db.get_keys_count(seller_id)
         text += f"🔹 <b>{data['name']}</b>\n"
-        text += f"   {get_text(message.from_user.id, 'price')}: ${data['price']} {get_text(message.from_user.id, 'for')} {get_text(message.from_user.id, 'piece')}\n"
-        text += f"   {get_text(message.from_user.id, 'keys_available')}: {keys_left}\n\n"
+        text += f"   {t('price')}: ${data['price']} {t('for')} {t('piece')}\n"
+        text += f"   {t('keys_available')}: {keys_left}\n\n"
         valid_sellers += 1
     
     if valid_sellers == 0:
-        await message.answer(get_text(message.from_user.id, "no_sellers"))
+        await message.answer(t("no_sellers"))
         return
     
-    await message.answer(text, reply_markup=sellers_keyboard(message.from_user.id), parse_mode="HTML")
+    await message.answer(text, reply_markup=sellers_keyboard(t), parse_mode="HTML")
 
 @dp.callback_query(F.data.startswith("buy_"))
-async def process_buy(callback: types.CallbackQuery):
+async def process_buy(callback: types.CallbackQuery, t: Translator):
     seller_id = callback.data.replace("buy_", "")
     
     if not re.match(r'^[a-zA-Z0-9_]+$', seller_id):
-        await callback.answer(get_text(callback.from_user.id, "invalid_seller"))
+        await callback.answer(t("invalid_seller"))
         return
     
     seller = db.get_sellers().get(seller_id)
     
     if not seller:
-        await callback.answer(get_text(callback.from_user.id, "seller_not_found"))
+        await callback.answer(t("seller_not_found"))
         return
     
     if db.get_keys_count(seller_id) == 0:
-        await callback.answer(get_text(callback.from_user.id, "out_of_stock"))
+        await callback.answer(t("out_of_stock"))
         return
     
     max_available = min(db.get_keys_count(seller_id), 10)
     
     text = (
         f"🛒 <b>{seller['name']}</b>\n"
-        f"💵 {get_text(callback.from_user.id, 'price')}: ${seller['price']} {get_text(callback.from_user.id, 'for')} {get_text(callback.from_user.id, 'piece')}\n\n"
-        f"❓ {get_text(callback.from_user.id, 'how_many')}\n"
-        f"📦 {get_text(callback.from_user.id, 'available')}: {max_available} {get_text(callback.from_user.id, 'pcs')}"
+        f"💵 {t('price')}: ${seller['price']} {t('for')} {t('piece')}\n\n"
+        f"❓ {t('how_many')}\n"
+        f"📦 {t('available')}: {max_available} {t('pcs')}"
     )
     
     await callback.message.delete()
-    await callback.message.answer(text, reply_markup=quantity_keyboard(callback.from_user.id, seller_id, max_available), parse_mode="HTML")
+    await callback.message.answer(text, reply_markup=quantity_keyboard(t, seller_id, max_available), parse_mode="HTML")
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("qty_"))
-async def process_quantity(callback: types.CallbackQuery):
+async def process_quantity(callback: types.CallbackQuery, t: Translator):
     data = callback.data.replace("qty_", "")
     
     match = re.match(r'^(.+)_(\d+)$', data)
@@ -529,12 +255,12 @@ async def process_quantity(callback: types.CallbackQuery):
     quantity = int(match.group(2))
     
     if not re.match(r'^[a-zA-Z0-9_]+$', seller_id):
-        await callback.answer(get_text(callback.from_user.id, "invalid_seller"))
+        await callback.answer(t("invalid_seller"))
         return
     
     seller = db.get_sellers().get(seller_id)
     if not seller:
-        await callback.answer(get_text(callback.from_user.id, "seller_not_found"))
+        await callback.answer(t("seller_not_found"))
         return
     
     total_price = seller["price"] * quantity
@@ -542,17 +268,17 @@ async def process_quantity(callback: types.CallbackQuery):
     payment_id = db.create_payment(callback.from_user.id, seller_id, total_price, quantity)
     
     text = (
-        f"🛒 <b>{get_text(callback.from_user.id, 'order')}: {seller['name']}</b>\n"
-        f"📦 {get_text(callback.from_user.id, 'quantity')}: {quantity} {get_text(callback.from_user.id, 'pcs')}\n"
-        f"💵 {get_text(callback.from_user.id, 'total')}: <code>${total_price}</code>\n\n"
-        f"📋 <b>{get_text(callback.from_user.id, 'payment_details')}</b>\n"
+        f"🛒 <b>{t('order')}: {seller['name']}</b>\n"
+        f"📦 {t('quantity')}: {quantity} {t('pcs')}\n"
+        f"💵 {t('total')}: <code>${total_price}</code>\n\n"
+        f"📋 <b>{t('payment_details')}</b>\n"
         f"<code>{cfg.USDT_WALLET}</code>\n\n"
-        f"🆔 <b>{get_text(callback.from_user.id, 'payment_id')}:</b> <code>{payment_id}</code>\n\n"
-        f"⚠️ {get_text(callback.from_user.id, 'after_payment')}"
+        f"🆔 <b>{t('payment_id')}:</b> <code>{payment_id}</code>\n\n"
+        f"⚠️ {t('after_payment')}"
     )
     
     kb = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=get_text(callback.from_user.id, "i_paid"), callback_data=f"paid_{payment_id}")]
+        [InlineKeyboardButton(text=t("i_paid"), callback_data=f"paid_{payment_id}")]
     ])
     
     await callback.message.delete()
@@ -560,45 +286,47 @@ async def process_quantity(callback: types.CallbackQuery):
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("paid_"))
-async def notify_payment(callback: types.CallbackQuery):
+async def notify_payment(callback: types.CallbackQuery, t: Translator):
     payment_id = callback.data.replace("paid_", "")
     payment = db.get_payment(payment_id)
     
-    if not payment:
-        await callback.answer(get_text(callback.from_user.id, "payment_not_found"))
+    # Отметка об оплате снимает заказ с автоматического истечения
+    if not payment or not db.mark_payment_paid(payment_id):
+        await callback.answer(t("payment_not_found"))
         return
     
+    admin_t = user_translator(cfg.ADMIN_ID)
     admin_text = (
-        f"💰 <b>{get_text(cfg.ADMIN_ID, 'new_payment')}</b>\n\n"
-        f"👤 {get_text(cfg.ADMIN_ID, 'user')}: @{callback.from_user.username or callback.from_user.id}\n"
+        f"💰 <b>{admin_t('new_payment')}</b>\n\n"
+        f"👤 {admin_t('user')}: @{callback.from_user.username or callback.from_user.id}\n"
         f"🆔 ID: <code>{callback.from_user.id}</code>\n"
-        f"🛒 {get_text(cfg.ADMIN_ID, 'seller')}: {payment['seller_id']}\n"
-        f"📦 {get_text(cfg.ADMIN_ID, 'quantity')}: {payment['quantity']} {get_text(cfg.ADMIN_ID, 'pcs')}\n"
-        f"💵 {get_text(cfg.ADMIN_ID, 'amount')}: ${payment['amount']}\n"
-        f"🆔 {get_text(cfg.ADMIN_ID, 'payment_id')}: <code>{payment_id}</code>\n\n"
-        f"{get_text(cfg.ADMIN_ID, 'confirm_usage')}"
+        f"🛒 {admin_t('seller')}: {payment['seller_id']}\n"
+        f"📦 {admin_t('quantity')}: {payment['quantity']} {admin_t('pcs')}\n"
+        f"💵 {admin_t('amount')}: ${payment['amount']}\n"
+        f"🆔 {admin_t('payment_id')}: <code>{payment_id}</code>\n\n"
+        f"{admin_t('confirm_usage')}"
     )
     
-    await bot.send_message(cfg.ADMIN_ID, admin_text, parse_mode="HTML")
+    outbox.send(cfg.ADMIN_ID, admin_text, parse_mode="HTML")
     
     await callback.message.edit_text(
-        callback.message.text + f"\n\n{get_text(callback.from_user.id, 'waiting_confirm')}"
+        callback.message.text + f"\n\n{t('waiting_confirm')}"
     )
-    await callback.answer(get_text(callback.from_user.id, "admin_notified"))
+    await callback.answer(t("admin_notified"))
 
 # --- ОТЗЫВЫ ---
 @dp.message(F.text.in_(["⭐ Отзывы", "⭐ Reviews"]))
-async def show_reviews(message: types.Message):
+async def show_reviews(message: types.Message, t: Translator):
     reviews = db.get_reviews()
     
     if not reviews:
-        await message.answer(get_text(message.from_user.id, "no_reviews"))
+        await message.answer(t("no_reviews"))
         return
     
-    text = f"⭐ <b>{get_text(message.from_user.id, 'latest_reviews')}</b>\n\n"
+    text = f"⭐ <b>{t('latest_reviews')}</b>\n\n"
     for r in reviews:
         username = r.get('username') or f"User{r['user_id']}"
-        edited = f" {get_text(message.from_user.id, 'edited')}" if r.get('edited') else ""
+        edited = f" {t('edited')}" if r.get('edited') else ""
         text += f"📝 <b>#{r['id']}</b> | 👤 <b>{username}</b>{edited}\n"
         text += f"💬 {r['text']}\n"
         text += f"📅 {r['date'][:10]}\n\n"
@@ -607,163 +335,189 @@ async def show_reviews(message: types.Message):
 
 # --- ТЕХПОДДЕРЖКА ---
 @dp.message(F.text.in_(["🆘 ТехПоддержка", "🆘 Support"]))
-async def support_start(message: types.Message, state: FSMContext):
+async def support_start(message: types.Message, state: FSMContext, t: Translator):
     await state.set_state(SupportState.waiting_message)
     await message.answer(
-        f"{get_text(message.from_user.id, 'support_title')}\n\n"
-        f"{get_text(message.from_user.id, 'support_desc')}",
+        f"{t('support_title')}\n\n"
+        f"{t('support_desc')}",
         parse_mode="HTML"
     )
 
 @dp.message(SupportState.waiting_message)
-async def support_receive(message: types.Message, state: FSMContext):
+async def support_receive(message: types.Message, state: FSMContext, t: Translator):
     ticket_id = db.create_ticket(message.from_user.id, message.text)
     
+    admin_t = user_translator(cfg.ADMIN_ID)
     admin_text = (
-        f"📩 <b>{get_text(cfg.ADMIN_ID, 'new_ticket').format(ticket_id=ticket_id)}</b>\n\n"
-        f"👤 {get_text(cfg.ADMIN_ID, 'from_user')}: @{message.from_user.username or message.from_user.id}\n"
+        f"📩 <b>{admin_t('new_ticket').format(ticket_id=ticket_id)}</b>\n\n"
+        f"👤 {admin_t('from_user')}: @{message.from_user.username or message.from_user.id}\n"
         f"🆔 User ID: <code>{message.from_user.id}</code>\n\n"
-        f"💬 {get_text(cfg.ADMIN_ID, 'message')}:\n{message.text}\n\n"
-        f"{get_text(cfg.ADMIN_ID, 'reply_cmd')}: /reply {ticket_id} [текст]\n"
-        f"{get_text(cfg.ADMIN_ID, 'close_cmd')}: /close {ticket_id}"
+        f"💬 {admin_t('message')}:\n{message.text}\n\n"
+        f"{admin_t('reply_cmd')}: /reply {ticket_id} [текст]\n"
+        f"{admin_t('close_cmd')}: /close {ticket_id}"
     )
-    await bot.send_message(cfg.ADMIN_ID, admin_text, parse_mode="HTML")
+    outbox.send(cfg.ADMIN_ID, admin_text, parse_mode="HTML")
     
     await message.answer(
-        get_text(message.from_user.id, "ticket_created").format(ticket_id=ticket_id)
+        t("ticket_created").format(ticket_id=ticket_id)
     )
     await state.clear()
 
 # --- НАСТРОЙКИ ---
 @dp.message(F.text.in_(["⚙️ Настройки", "⚙️ Settings"]))
-async def settings(message: types.Message):
-    user_data = db.data["users"].get(str(message.from_user.id), {})
-    purchases = len(user_data.get("purchases", []))
+async def settings(message: types.Message, t: Translator):
+    purchases = db.get_purchase_count(message.from_user.id)
     
     # Убираем эмодзи из начала строк, они уже есть в кнопках
     text = (
-        f"<b>{get_text(message.from_user.id, 'settings_title')}</b>\n\n"
+        f"<b>{t('settings_title')}</b>\n\n"
         f"ID: <code>{message.from_user.id}</code>\n"
-        f"Username: @{message.from_user.username or get_text(message.from_user.id, 'not_set')}\n"
-        f"{get_text(message.from_user.id, 'purchases')}: {purchases}\n\n"
-        f"{get_text(message.from_user.id, 'wallet')}: {get_text(message.from_user.id, 'not_set')}"
+        f"Username: @{message.from_user.username or t('not_set')}\n"
+        f"{t('purchases')}: {purchases}\n\n"
+        f"{t('wallet')}: {t('not_set')}"
     )
-    await message.answer(text, parse_mode="HTML")
+    markup = None
+    if purchases:
+        markup = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=f"🧾 {t('purchase_history')}", callback_data="history_0")]
+        ])
+    await message.answer(text, parse_mode="HTML", reply_markup=markup)
+
+HISTORY_PAGE_SIZE = 5
+
+@dp.callback_query(F.data.startswith("history_"))
+async def purchase_history(callback: types.CallbackQuery, t: Translator):
+    page = int(callback.data.replace("history_", ""))
+    # На одну запись больше, чтобы понять, есть ли следующая страница
+    purchases = db.get_purchases(
+        callback.from_user.id, page * HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE + 1
+    )
+    has_next = len(purchases) > HISTORY_PAGE_SIZE
+    
+    text = f"🧾 <b>{t('purchase_history')}</b>\n\n"
+    if not purchases:
+        text += t("no_purchases")
+    for p in purchases[:HISTORY_PAGE_SIZE]:
+        keys_text = "\n".join(f"<code>{k}</code>" for k in p["keys"])
+        text += f"📅 {p['date'][:10]} | 🛒 {p['seller_id']} | 💵 ${p['amount']}\n{keys_text}\n\n"
+    
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=history_keyboard(t, page, has_next))
+    await callback.answer()
 
 # === АДМИН ПАНЕЛЬ ===
 
 @dp.message(F.text.in_(["🔐 Админ панель", "🔐 Admin Panel"]))
-async def admin_panel(message: types.Message):
+async def admin_panel(message: types.Message, t: Translator):
     if message.from_user.id != cfg.ADMIN_ID:
         return
     
     await message.answer(
-        get_text(message.from_user.id, "admin_panel_title"),
-        reply_markup=admin_keyboard(message.from_user.id),
+        t("admin_panel_title"),
+        reply_markup=admin_keyboard(t),
         parse_mode="HTML"
     )
 
 @dp.callback_query(F.data == "admin_panel")
-async def admin_panel_callback(callback: types.CallbackQuery):
+async def admin_panel_callback(callback: types.CallbackQuery, t: Translator):
     await callback.message.edit_text(
-        get_text(callback.from_user.id, "admin_panel_title"),
-        reply_markup=admin_keyboard(callback.from_user.id),
+        t("admin_panel_title"),
+        reply_markup=admin_keyboard(t),
         parse_mode="HTML"
     )
 
 @dp.callback_query(F.data == "admin_stats")
-async def admin_stats(callback: types.CallbackQuery):
-    users_count = db.get_users_count()
-    
-    total_keys = 0
-    for s in db.get_sellers():
-        if re.match(r'^[a-zA-Z0-9_]+$', s):
-            total_keys += db.get_keys_count(s)
-    
-    open_tickets = len(db.get_open_tickets())
+async def admin_stats(callback: types.CallbackQuery, t: Translator):
+    # Счётчики ведутся при каждом изменении базы, здесь только чтение
+    stats = db.get_stats()
+    sellers = {sid: s for sid, s in db.get_sellers().items() if re.match(r'^[a-zA-Z0-9_]+$', sid)}
     
     text = (
-        f"📊 <b>{get_text(callback.from_user.id, 'stats')}</b>\n\n"
-        f"👥 {get_text(callback.from_user.id, 'users_count')}: {users_count}\n"
-        f"🔑 {get_text(callback.from_user.id, 'total_keys')}: {total_keys}\n"
-        f"📩 {get_text(callback.from_user.id, 'open_tickets')}: {open_tickets}\n\n"
-        f"💰 {get_text(callback.from_user.id, 'sellers')}:\n"
+        f"📊 <b>{t('stats')}</b>\n\n"
+        f"👥 {t('users_count')}: {stats['users']}\n"
+        f"🔑 {t('total_keys')}: {sum(stats['stock'].get(sid, 0) for sid in sellers)}\n"
+        f"📩 {t('open_tickets')}: {stats['open_tickets']}\n"
+        f"⏳ {t('pending_payments_count')}: {stats['pending_payments']}\n"
+        f"💵 {t('revenue')}: ${sum(stats['revenue'].values()):g} "
+        f"({sum(stats['sales'].values())} {t('pcs')})\n\n"
+        f"💰 {t('sellers')}:\n"
     )
-    for sid, data in db.get_sellers().items():
-        if re.match(r'^[a-zA-Z0-9_]+$', sid):
-            text += f"  • {data['name']}: {db.get_keys_count(sid)} {get_text(callback.from_user.id, 'keys')} (${data['price']})\n"
+    for sid, data in sellers.items():
+        text += (
+            f"  • {data['name']}: {stats['stock'].get(sid, 0)} {t('keys')} (${data['price']}), "
+            f"{t('sold')} {stats['sales'].get(sid, 0)} / ${stats['revenue'].get(sid, 0):g}\n"
+        )
     
-    await callback.message.edit_text(text, reply_markup=admin_keyboard(callback.from_user.id), parse_mode="HTML")
+    await callback.message.edit_text(text, reply_markup=admin_keyboard(t), parse_mode="HTML")
 
 # --- ДОБАВИТЬ ПРОДАВЦА ---
 @dp.callback_query(F.data == "admin_add_seller")
-async def admin_add_seller_start(callback: types.CallbackQuery, state: FSMContext):
+async def admin_add_seller_start(callback: types.CallbackQuery, state: FSMContext, t: Translator):
     await state.set_state(AdminState.add_seller_id)
     await callback.message.edit_text(
-        f"➕ <b>{get_text(callback.from_user.id, 'add_seller_btn')}</b>\n\n"
-        f"{get_text(callback.from_user.id, 'enter_seller_id')}",
+        f"➕ <b>{t('add_seller_btn')}</b>\n\n"
+        f"{t('enter_seller_id')}",
         parse_mode="HTML"
     )
 
 @dp.message(AdminState.add_seller_id)
-async def admin_add_seller_id(message: types.Message, state: FSMContext):
+async def admin_add_seller_id(message: types.Message, state: FSMContext, t: Translator):
     seller_id = message.text.strip().lower()
     seller_id = re.sub(r'[^a-z0-9_]', '', seller_id)
     
     if not seller_id:
-        await message.answer(get_text(message.from_user.id, "id_empty"))
+        await message.answer(t("id_empty"))
         return
     
     if len(seller_id) < 3:
-        await message.answer(get_text(message.from_user.id, "id_short"))
+        await message.answer(t("id_short"))
         return
     
     if seller_id in db.get_sellers():
-        await message.answer(get_text(message.from_user.id, "id_exists"))
+        await message.answer(t("id_exists"))
         return
     
     await state.update_data(seller_id=seller_id)
     await state.set_state(AdminState.add_seller_name)
-    await message.answer(f"✅ ID: <code>{seller_id}</code>\n\n{get_text(message.from_user.id, 'enter_seller_name')}", parse_mode="HTML")
+    await message.answer(f"✅ ID: <code>{seller_id}</code>\n\n{t('enter_seller_name')}", parse_mode="HTML")
 
 @dp.message(AdminState.add_seller_name)
-async def admin_add_seller_name(message: types.Message, state: FSMContext):
+async def admin_add_seller_name(message: types.Message, state: FSMContext, t: Translator):
     await state.update_data(name=message.text)
     await state.set_state(AdminState.add_seller_price)
-    await message.answer(get_text(message.from_user.id, "enter_price"))
+    await message.answer(t("enter_price"))
 
 @dp.message(AdminState.add_seller_price)
-async def admin_add_seller_price(message: types.Message, state: FSMContext):
+async def admin_add_seller_price(message: types.Message, state: FSMContext, t: Translator):
     try:
         price = float(message.text.replace(",", "."))
         if price <= 0:
-            await message.answer(get_text(message.from_user.id, "invalid_price"))
+            await message.answer(t("invalid_price"))
             return
     except ValueError:
-        await message.answer(get_text(message.from_user.id, "enter_number"))
+        await message.answer(t("enter_number"))
         return
     
     data = await state.get_data()
     db.add_seller(data["seller_id"], data["name"], price)
     
     await message.answer(
-        f"{get_text(message.from_user.id, 'seller_added')}\n\n"
+        f"{t('seller_added')}\n\n"
         f"🆔 ID: <code>{data['seller_id']}</code>\n"
-        f"🏷️ {get_text(message.from_user.id, 'name')}: {data['name']}\n"
-        f"💵 {get_text(message.from_user.id, 'price')}: ${price}",
-        reply_markup=admin_keyboard(message.from_user.id),
+        f"🏷️ {t('name')}: {data['name']}\n"
+        f"💵 {t('price')}: ${price}",
+        reply_markup=admin_keyboard(t),
         parse_mode="HTML"
     )
     await state.clear()
 
 # --- УДАЛИТЬ ПРОДАВЦА ---
 @dp.callback_query(F.data == "admin_del_seller")
-async def admin_del_seller_start(callback: types.CallbackQuery, state: FSMContext):
+async def admin_del_seller_start(callback: types.CallbackQuery, state: FSMContext, t: Translator):
     sellers = db.get_sellers()
     valid_sellers = {k: v for k, v in sellers.items() if re.match(r'^[a-zA-Z0-9_]+$', k)}
     
     if not valid_sellers:
-        await callback.answer(get_text(callback.from_user.id, "no_sellers_delete"))
+        await callback.answer(t("no_sellers_delete"))
         return
     
     buttons = []
@@ -772,74 +526,70 @@ async def admin_del_seller_start(callback: types.CallbackQuery, state: FSMContex
             text=f"🗑️ {data['name']}", 
             callback_data=f"delsel_{sid}"
         )])
-    buttons.append([InlineKeyboardButton(text=get_text(callback.from_user.id, "cancel"), callback_data="admin_panel")])
+    buttons.append([InlineKeyboardButton(text=t("cancel"), callback_data="admin_panel")])
     
     await callback.message.edit_text(
-        f"➖ <b>{get_text(callback.from_user.id, 'select_seller_delete')}</b>",
+        f"➖ <b>{t('select_seller_delete')}</b>",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
         parse_mode="HTML"
     )
 
 @dp.callback_query(F.data.startswith("delsel_"))
-async def admin_del_seller_confirm(callback: types.CallbackQuery):
+async def admin_del_seller_confirm(callback: types.CallbackQuery, t: Translator):
     seller_id = callback.data.replace("delsel_", "")
     
     if not re.match(r'^[a-zA-Z0-9_]+$', seller_id):
-        await callback.answer(get_text(callback.from_user.id, "invalid_seller"))
+        await callback.answer(t("invalid_seller"))
         return
     
     seller = db.get_sellers().get(seller_id)
     
     if not seller:
-        await callback.answer(get_text(callback.from_user.id, "seller_not_found"))
+        await callback.answer(t("seller_not_found"))
         return
     
     db.remove_seller(seller_id)
     await callback.message.edit_text(
-        f"{get_text(callback.from_user.id, 'seller_deleted')}\n\n<b>{seller['name']}</b>",
-        reply_markup=admin_keyboard(callback.from_user.id),
+        f"{t('seller_deleted')}\n\n<b>{seller['name']}</b>",
+        reply_markup=admin_keyboard(t),
         parse_mode="HTML"
     )
 
 # --- УПРАВЛЕНИЕ ОТЗЫВАМИ ---
 @dp.callback_query(F.data == "admin_reviews")
-async def admin_reviews_menu(callback: types.CallbackQuery):
+async def admin_reviews_menu(callback: types.CallbackQuery, t: Translator):
     await callback.message.edit_text(
-        f"{get_text(callback.from_user.id, 'reviews_management')}\n\n"
-        f"{get_text(callback.from_user.id, 'choose_action')}:",
-        reply_markup=reviews_admin_keyboard(callback.from_user.id),
+        f"{t('reviews_management')}\n\n"
+        f"{t('choose_action')}:",
+        reply_markup=reviews_admin_keyboard(t),
         parse_mode="HTML"
     )
 
 @dp.callback_query(F.data == "admin_add_review")
-async def admin_add_review_start(callback: types.CallbackQuery, state: FSMContext):
+async def admin_add_review_start(callback: types.CallbackQuery, state: FSMContext, t: Translator):
     await state.set_state(AdminState.add_review_user)
     await callback.message.edit_text(
-        f"➕ <b>{get_text(callback.from_user.id, 'add_review')}</b>\n\n"
-        f"{get_text(callback.from_user.id, 'enter_review_user')}",
+        f"➕ <b>{t('add_review')}</b>\n\n"
+        f"{t('enter_review_user')}",
         parse_mode="HTML"
     )
 
 @dp.message(AdminState.add_review_user)
-async def admin_add_review_user(message: types.Message, state: FSMContext):
+async def admin_add_review_user(message: types.Message, state: FSMContext, t: Translator):
     user_input = message.text.strip()
     await state.update_data(user=user_input)
     await state.set_state(AdminState.add_review_text)
-    await message.answer(get_text(message.from_user.id, "enter_review_text"))
+    await message.answer(t("enter_review_text"))
 
 @dp.message(AdminState.add_review_text)
-async def admin_add_review_text(message: types.Message, state: FSMContext):
+async def admin_add_review_text(message: types.Message, state: FSMContext, t: Translator):
     data = await state.get_data()
     user = data["user"]
     
     if user.startswith("@"):
         user = user[1:]
     
-    user_id = None
-    for uid, udata in db.get_all_users().items():
-        if udata.get("username") == user:
-            user_id = int(uid)
-            break
+    user_id = db.find_user_by_username(user)
     
     if not user_id:
         try:
@@ -850,16 +600,16 @@ async def admin_add_review_text(message: types.Message, state: FSMContext):
     review_id = db.add_review(user_id, message.text, user if not user_id else None)
     
     await message.answer(
-        get_text(message.from_user.id, "review_added").format(review_id=review_id),
-        reply_markup=reviews_admin_keyboard(message.from_user.id)
+        t("review_added").format(review_id=review_id),
+        reply_markup=reviews_admin_keyboard(t)
     )
     await state.clear()
 
 @dp.callback_query(F.data == "admin_edit_review")
-async def admin_edit_review_start(callback: types.CallbackQuery, state: FSMContext):
+async def admin_edit_review_start(callback: types.CallbackQuery, state: FSMContext, t: Translator):
     reviews = db.get_reviews()
     if not reviews:
-        await callback.answer(get_text(callback.from_user.id, "no_reviews_edit"))
+        await callback.answer(t("no_reviews_edit"))
         return
     
     buttons = []
@@ -870,53 +620,53 @@ async def admin_edit_review_start(callback: types.CallbackQuery, state: FSMConte
             text=f"#{r['id']} {username}: {text_short}", 
             callback_data=f"edrev_{r['id']}"
         )])
-    buttons.append([InlineKeyboardButton(text=get_text(callback.from_user.id, "back"), callback_data="admin_reviews")])
+    buttons.append([InlineKeyboardButton(text=t("back"), callback_data="admin_reviews")])
     
     await callback.message.edit_text(
-        f"✏️ <b>{get_text(callback.from_user.id, 'select_review_edit')}</b>",
+        f"✏️ <b>{t('select_review_edit')}</b>",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
         parse_mode="HTML"
     )
 
 @dp.callback_query(F.data.startswith("edrev_"))
-async def admin_edit_review_select(callback: types.CallbackQuery, state: FSMContext):
+async def admin_edit_review_select(callback: types.CallbackQuery, state: FSMContext, t: Translator):
     review_id = int(callback.data.replace("edrev_", ""))
     review = db.get_review_by_id(review_id)
     
     if not review:
-        await callback.answer(get_text(callback.from_user.id, "review_not_found"))
+        await callback.answer(t("review_not_found"))
         return
     
     await state.update_data(review_id=review_id)
     await state.set_state(AdminState.edit_review_text)
     
     await callback.message.edit_text(
-        f"✏️ <b>{get_text(callback.from_user.id, 'edit_review')} #{review_id}</b>\n\n"
-        f"{get_text(callback.from_user.id, 'current_text')}:\n{review['text']}\n\n"
-        f"{get_text(callback.from_user.id, 'enter_new_text')}:",
+        f"✏️ <b>{t('edit_review')} #{review_id}</b>\n\n"
+        f"{t('current_text')}:\n{review['text']}\n\n"
+        f"{t('enter_new_text')}:",
         parse_mode="HTML"
     )
 
 @dp.message(AdminState.edit_review_text)
-async def admin_edit_review_save(message: types.Message, state: FSMContext):
+async def admin_edit_review_save(message: types.Message, state: FSMContext, t: Translator):
     data = await state.get_data()
     review_id = data["review_id"]
     
     if db.edit_review(review_id, message.text):
         await message.answer(
-            get_text(message.from_user.id, "review_updated").format(review_id=review_id),
-            reply_markup=reviews_admin_keyboard(message.from_user.id)
+            t("review_updated").format(review_id=review_id),
+            reply_markup=reviews_admin_keyboard(t)
         )
     else:
-        await message.answer(get_text(message.from_user.id, "update_error"))
+        await message.answer(t("update_error"))
     
     await state.clear()
 
 @dp.callback_query(F.data == "admin_del_review")
-async def admin_del_review_start(callback: types.CallbackQuery, state: FSMContext):
+async def admin_del_review_start(callback: types.CallbackQuery, state: FSMContext, t: Translator):
     reviews = db.get_reviews()
     if not reviews:
-        await callback.answer(get_text(callback.from_user.id, "no_reviews_delete"))
+        await callback.answer(t("no_reviews_delete"))
         return
     
     buttons = []
@@ -927,196 +677,235 @@ async def admin_del_review_start(callback: types.CallbackQuery, state: FSMContex
             text=f"🗑️ #{r['id']} {username}", 
             callback_data=f"delrev_{r['id']}"
         )])
-    buttons.append([InlineKeyboardButton(text=get_text(callback.from_user.id, "back"), callback_data="admin_reviews")])
+    buttons.append([InlineKeyboardButton(text=t("back"), callback_data="admin_reviews")])
     
     await callback.message.edit_text(
-        f"🗑️ <b>{get_text(callback.from_user.id, 'select_review_delete')}</b>",
+        f"🗑️ <b>{t('select_review_delete')}</b>",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
         parse_mode="HTML"
     )
 
 @dp.callback_query(F.data.startswith("delrev_"))
-async def admin_del_review_confirm(callback: types.CallbackQuery):
+async def admin_del_review_confirm(callback: types.CallbackQuery, t: Translator):
     review_id = int(callback.data.replace("delrev_", ""))
     db.delete_review(review_id)
     
     await callback.message.edit_text(
-        get_text(callback.from_user.id, "review_deleted").format(review_id=review_id),
-        reply_markup=reviews_admin_keyboard(callback.from_user.id),
+        t("review_deleted").format(review_id=review_id),
+        reply_markup=reviews_admin_keyboard(t),
         parse_mode="HTML"
     )
 
 # --- ГЕНЕРАЦИЯ КЛЮЧЕЙ ---
 @dp.callback_query(F.data == "admin_gen_keys")
-async def admin_gen_menu(callback: types.CallbackQuery, state: FSMContext):
+async def admin_gen_menu(callback: types.CallbackQuery, state: FSMContext, t: Translator):
     buttons = []
     for seller_id, data in db.get_sellers().items():
         if re.match(r'^[a-zA-Z0-9_]+$', seller_id):
             buttons.append([InlineKeyboardButton(
-                text=f"🔑 {data['name']} ({db.get_keys_count(seller_id)} {get_text(callback.from_user.id, 'pcs')})", 
+                text=f"🔑 {data['name']} ({db.get_keys_count(seller_id)} {t('pcs')})", 
                 callback_data=f"gen_{seller_id}"
             )])
-    buttons.append([InlineKeyboardButton(text=get_text(callback.from_user.id, "back"), callback_data="admin_panel")])
+    buttons.append([InlineKeyboardButton(text=t("back"), callback_data="admin_panel")])
     
     await callback.message.edit_text(
-        get_text(callback.from_user.id, "select_seller_gen"),
+        t("select_seller_gen"),
         reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons),
         parse_mode="HTML"
     )
 
 @dp.callback_query(F.data.startswith("gen_"))
-async def admin_gen_count(callback: types.CallbackQuery, state: FSMContext):
+async def admin_gen_count(callback: types.CallbackQuery, state: FSMContext, t: Translator):
     seller_id = callback.data.replace("gen_", "")
     
     if not re.match(r'^[a-zA-Z0-9_]+$', seller_id):
-        await callback.answer(get_text(callback.from_user.id, "invalid_seller"))
+        await callback.answer(t("invalid_seller"))
         return
     
     await state.update_data(seller_id=seller_id)
     await state.set_state(AdminState.gen_keys_count)
     
     await callback.message.edit_text(
-        get_text(callback.from_user.id, "how_many_keys")
+        t("how_many_keys").format(max=cfg.KEYGEN_MAX)
     )
 
 @dp.message(AdminState.gen_keys_count)
-async def admin_gen_execute(message: types.Message, state: FSMContext):
+async def admin_gen_execute(message: types.Message, state: FSMContext, t: Translator):
     try:
         count = int(message.text)
-        if count < 1 or count > 100:
-            await message.answer(get_text(message.from_user.id, "invalid_range"))
+        if count < 1 or count > cfg.KEYGEN_MAX:
+            await message.answer(t("invalid_range").format(max=cfg.KEYGEN_MAX))
             return
     except ValueError:
-        await message.answer(get_text(message.from_user.id, "enter_number"))
+        await message.answer(t("enter_number"))
         return
     
     data = await state.get_data()
     seller_id = data["seller_id"]
     
-    keys = db.generate_keys(seller_id, count)
+    # Пачками, отдавая управление event loop между ними (как при импорте);
+    # в режиме snapshot весь снимок переписывает только последняя пачка
+    first = []
+    for done in range(0, count, cfg.KEYGEN_CHUNK):
+        size = min(cfg.KEYGEN_CHUNK, count - done)
+        keys = db.generate_keys(seller_id, size, save=done + size == count)
+        first += keys[:3 - len(first)]
+        await asyncio.sleep(0)
     
     await message.answer(
-        get_text(message.from_user.id, "keys_generated").format(count=count) + "\n\n" +
-        f"{get_text(message.from_user.id, 'first_three')}:\n" + "\n".join(keys[:3]) + "\n...",
-        reply_markup=admin_keyboard(message.from_user.id)
+        t("keys_generated").format(count=count) + "\n\n" +
+        f"{t('first_three')}:\n" + "\n".join(first) + "\n...",
+        reply_markup=admin_keyboard(t)
     )
     await state.clear()
 
+# --- ИМПОРТ КЛЮЧЕЙ ---
+# Bot API без локального сервера отдаёт ботам файлы до 20 МБ
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+
+@dp.message(Command("import_keys"))
+async def import_keys_cmd(message: types.Message, state: FSMContext, t: Translator):
+    if message.from_user.id != cfg.ADMIN_ID:
+        return
+    
+    args = message.text.split()
+    if len(args) != 2 or not re.match(r'^[a-zA-Z0-9_]+$', args[1]):
+        await message.answer(t("import_usage"))
+        return
+    if args[1] not in db.get_sellers():
+        await message.answer(t("invalid_seller"))
+        return
+    
+    await state.update_data(seller_id=args[1])
+    await state.set_state(AdminState.import_keys_file)
+    await message.answer(t("import_send_file"))
+
+@dp.message(AdminState.import_keys_file, F.document)
+async def import_keys_file(message: types.Message, state: FSMContext, t: Translator):
+    if message.from_user.id != cfg.ADMIN_ID:
+        return
+    if not cfg.TELEGRAM_API_URL and (message.document.file_size or 0) > IMPORT_MAX_FILE_SIZE:
+        await message.answer(t("import_too_big"))
+        return
+    
+    seller_id = (await state.get_data())["seller_id"]
+    await state.clear()
+    await message.answer(t("import_started"))
+    
+    fd, path = tempfile.mkstemp(prefix="keys-", suffix=".txt")
+    os.close(fd)
+    try:
+        await bot.download(message.document, destination=path)
+        stats = await import_file(db, seller_id, path)
+    finally:
+        os.remove(path)
+    await message.answer(t("import_done").format(**stats), reply_markup=admin_keyboard(t))
+
 # --- ТИКЕТЫ ---
 @dp.callback_query(F.data == "admin_tickets")
-async def admin_tickets(callback: types.CallbackQuery):
+async def admin_tickets(callback: types.CallbackQuery, t: Translator):
     tickets = db.get_open_tickets()
     
     if not tickets:
         await callback.message.edit_text(
-            get_text(callback.from_user.id, "no_tickets"),
-            reply_markup=admin_keyboard(callback.from_user.id)
+            t("no_tickets"),
+            reply_markup=admin_keyboard(t)
         )
         return
     
-    text = f"📩 <b>{get_text(callback.from_user.id, 'open_tickets')}</b>\n\n"
-    for tid, t in tickets.items():
-        username = "Unknown"
-        for uid, udata in db.get_all_users().items():
-            if int(uid) == t['user_id']:
-                username = udata.get('username') or uid
-                break
+    text = f"📩 <b>{t('open_tickets')}</b>\n\n"
+    for tid, ticket in tickets.items():
+        user = db.get_user(ticket['user_id'])
+        username = (user.get('username') or ticket['user_id']) if user else "Unknown"
         
         text += f"#{tid} | 👤 {username}\n"
-        text += f"💬 {t['message'][:50]}...\n\n"
+        text += f"💬 {ticket['message'][:50]}...\n\n"
     
-    text += f"\n{get_text(callback.from_user.id, 'reply_cmd')}: /reply [ID] [текст]\n{get_text(callback.from_user.id, 'close_cmd')}: /close [ID]"
+    text += f"\n{t('reply_cmd')}: /reply [ID] [текст]\n{t('close_cmd')}: /close [ID]"
     
-    await callback.message.edit_text(text, reply_markup=admin_keyboard(callback.from_user.id), parse_mode="HTML")
+    await callback.message.edit_text(text, reply_markup=admin_keyboard(t), parse_mode="HTML")
 
 # --- ПОДТВЕРЖДЕНИЕ ОПЛАТЫ ---
 @dp.callback_query(F.data == "admin_confirm")
-async def admin_confirm_menu(callback: types.CallbackQuery):
-    pending = {k: v for k, v in db.data["pending_payments"].items() if v["status"] == "pending"}
+async def admin_confirm_menu(callback: types.CallbackQuery, t: Translator):
+    pending = db.get_pending_payments()
     
     if not pending:
         await callback.message.edit_text(
-            get_text(callback.from_user.id, "no_pending"),
-            reply_markup=admin_keyboard(callback.from_user.id)
+            t("no_pending"),
+            reply_markup=admin_keyboard(t)
         )
         return
     
-    text = f"⏳ <b>{get_text(callback.from_user.id, 'pending_payments')}</b>\n\n"
+    text = f"⏳ <b>{t('pending_payments')}</b>\n\n"
     for pid, p in list(pending.items())[:5]:
         text += f"🆔 <code>{pid}</code>\n"
-        text += f"   👤 {p['user_id']} | 📦 {p['quantity']} {get_text(callback.from_user.id, 'pcs')} | 💵 ${p['amount']}\n\n"
+        text += f"   👤 {p['user_id']} | 📦 {p['quantity']} {t('pcs')} | 💵 ${p['amount']}\n\n"
     
-    text += get_text(callback.from_user.id, "confirm_usage")
+    text += t("confirm_usage")
     
-    await callback.message.edit_text(text, reply_markup=admin_keyboard(callback.from_user.id), parse_mode="HTML")
+    await callback.message.edit_text(text, reply_markup=admin_keyboard(t), parse_mode="HTML")
 
 @dp.message(Command("confirm"))
-async def confirm_payment_cmd(message: types.Message):
+async def confirm_payment_cmd(message: types.Message, t: Translator):
     if message.from_user.id != cfg.ADMIN_ID:
         return
     
     args = message.text.split()
     if len(args) < 2:
-        await message.answer(get_text(message.from_user.id, "confirm_usage_cmd"))
+        await message.answer(t("confirm_usage_cmd"))
         return
     
     payment_id = args[1]
     payment = db.get_payment(payment_id)
     
-    if not payment or payment["status"] == "confirmed":
-        await message.answer(get_text(message.from_user.id, "already_paid"))
+    if payment and not re.match(r'^[a-zA-Z0-9_]+$', payment["seller_id"]):
+        await message.answer(t("invalid_seller"))
         return
     
-    seller_id = payment["seller_id"]
-    quantity = payment["quantity"]
-    
-    if not re.match(r'^[a-zA-Z0-9_]+$', seller_id):
-        await message.answer(get_text(message.from_user.id, "invalid_seller"))
+    # Проверка, списание ключей, покупка и подтверждение - одна транзакция,
+    # повторный /confirm ключи второй раз не выдаст
+    result = db.fulfill_payment(payment_id)
+    if result["status"] in ("not_found", "already_confirmed"):
+        await message.answer(t("already_paid"))
         return
-    
-    if db.get_keys_count(seller_id) < quantity:
+    payment = result["payment"]
+    if result["status"] == "not_enough":
         await message.answer(
-            get_text(message.from_user.id, "not_enough_keys").format(need=quantity, have=db.get_keys_count(seller_id))
+            t("not_enough_keys").format(need=payment["quantity"], have=result["have"])
         )
         return
     
-    keys = []
-    for _ in range(quantity):
-        key = db.get_key(seller_id)
-        if key:
-            keys.append(key)
-    
-    if len(keys) != quantity:
-        await message.answer(get_text(message.from_user.id, "key_error"))
-        return
-    
-    db.confirm_payment(payment_id)
-    db.add_purchase(payment["user_id"], seller_id, keys, payment["amount"])
-    
+    keys = result["keys"]
     keys_text = "\n".join([f"<code>{k}</code>" for k in keys])
+    user_t = user_translator(payment["user_id"])
     user_text = (
-        f"✅ <b>{get_text(payment['user_id'], 'payment_confirmed')}</b>\n\n"
-        f"🔑 {get_text(payment['user_id'], 'your_keys').format(count=len(keys))}:\n\n"
+        f"✅ <b>{user_t('payment_confirmed')}</b>\n\n"
+        f"🔑 {user_t('your_keys').format(count=len(keys))}:\n\n"
         f"{keys_text}\n\n"
-        f"{get_text(payment['user_id'], 'save_keys')}"
+        f"{user_t('save_keys')}"
     )
     
-    try:
-        await bot.send_message(payment["user_id"], user_text, parse_mode="HTML")
-        await message.answer(
-            get_text(message.from_user.id, "keys_sent").format(user_id=payment['user_id'])
-        )
-    except Exception as e:
-        await message.answer(f"{get_text(message.from_user.id, 'error_sending')}: {e}\n\n{get_text(message.from_user.id, 'keys')}:\n" + "\n".join(keys))
+    async def keys_not_delivered(error: str):
+        # Сообщение с ключами уже лежит в недоставленных (/dead_letters retry),
+        # в чат админа ключи не копируются
+        outbox.send(message.chat.id, t("keys_not_delivered").format(
+            payment_id=payment_id, user_id=payment["user_id"], error=error
+        ))
+    
+    outbox.send(payment["user_id"], user_text, on_fail=keys_not_delivered, parse_mode="HTML")
+    await message.answer(
+        t("keys_sent").format(user_id=payment['user_id'])
+    )
 
 @dp.message(Command("reply"))
-async def reply_ticket(message: types.Message):
+async def reply_ticket(message: types.Message, t: Translator):
     if message.from_user.id != cfg.ADMIN_ID:
         return
     
     args = message.text.split(maxsplit=2)
     if len(args) < 3:
-        await message.answer(get_text(message.from_user.id, "reply_usage"))
+        await message.answer(t("reply_usage"))
         return
     
     ticket_id = int(args[1])
@@ -1124,53 +913,165 @@ async def reply_ticket(message: types.Message):
     
     ticket = db.get_ticket(ticket_id)
     if not ticket:
-        await message.answer(get_text(message.from_user.id, "ticket_not_found"))
+        await message.answer(t("ticket_not_found"))
         return
     
     db.add_response(ticket_id, message.from_user.id, text)
     
-    user_text = f"📩 <b>{get_text(ticket['user_id'], 'reply_support').format(ticket_id=ticket_id)}</b>\n\n{text}"
-    try:
-        await bot.send_message(ticket["user_id"], user_text, parse_mode="HTML")
-        await message.answer(
-            get_text(message.from_user.id, "reply_sent").format(user_id=ticket['user_id'])
-        )
-    except Exception as e:
-        await message.answer(f"{get_text(message.from_user.id, 'error_sending')}: {e}")
+    user_t = user_translator(ticket["user_id"])
+    user_text = f"📩 <b>{user_t('reply_support').format(ticket_id=ticket_id)}</b>\n\n{text}"
+    
+    async def reply_not_delivered(error: str):
+        outbox.send(message.chat.id, f"{t('error_sending')} (#{ticket_id}): {error}")
+    
+    outbox.send(ticket["user_id"], user_text, on_fail=reply_not_delivered, parse_mode="HTML")
+    await message.answer(
+        t("reply_sent").format(user_id=ticket['user_id'])
+    )
 
 @dp.message(Command("close"))
-async def close_ticket(message: types.Message):
+async def close_ticket(message: types.Message, t: Translator):
     if message.from_user.id != cfg.ADMIN_ID:
         return
     
     args = message.text.split()
     if len(args) < 2:
-        await message.answer(get_text(message.from_user.id, "close_usage"))
+        await message.answer(t("close_usage"))
         return
     
     ticket_id = int(args[1])
     db.close_ticket(ticket_id)
     await message.answer(
-        get_text(message.from_user.id, "ticket_closed").format(ticket_id=ticket_id)
+        t("ticket_closed").format(ticket_id=ticket_id)
     )
 
+@dp.message(Command("broadcast"))
+async def broadcast_cmd(message: types.Message, t: Translator):
+    if message.from_user.id != cfg.ADMIN_ID:
+        return
+    
+    args = message.text.split(maxsplit=1)
+    if len(args) < 2:
+        await message.answer(t("broadcast_usage"))
+        return
+    
+    broadcast_id = db.create_broadcast(args[1])
+    broadcaster.start(broadcast_id, on_done=report_broadcast)
+    await message.answer(t("broadcast_started").format(broadcast_id=broadcast_id))
+
+@dp.message(Command("broadcast_stop"))
+async def broadcast_stop_cmd(message: types.Message, t: Translator):
+    if message.from_user.id != cfg.ADMIN_ID:
+        return
+    
+    args = message.text.split()
+    if len(args) < 2:
+        await message.answer(t("broadcast_usage"))
+        return
+    
+    broadcast_id = int(args[1])
+    if broadcaster.stop(broadcast_id):
+        await message.answer(t("broadcast_stopped").format(broadcast_id=broadcast_id))
+    else:
+        await message.answer(t("broadcast_not_running"))
+
+async def report_broadcast(broadcast_id: int, stats: dict):
+    """Отчёт админу по завершённой рассылке"""
+    admin_t = user_translator(cfg.ADMIN_ID)
+    outbox.send(cfg.ADMIN_ID, admin_t("broadcast_report").format(broadcast_id=broadcast_id, **stats))
+
+@dp.message(Command("dead_letters"))
+async def dead_letters_cmd(message: types.Message, t: Translator):
+    if message.from_user.id != cfg.ADMIN_ID:
+        return
+    
+    args = message.text.split()
+    if len(args) > 1 and args[1] == "retry":
+        count = outbox.requeue_dead()
+        await message.answer(t("dead_letters_requeued").format(count=count))
+        return
+    
+    letters = db.get_dead_letters()
+    text = t("dead_letters_info").format(count=len(letters), pending=outbox.pending())
+    for letter in letters[-5:]:
+        text += f"\n\n🆔 {letter['chat_id']} | {letter['date'][:16]}\n❌ {letter['error']}"
+    await message.answer(text)
+
+@dp.message(Command("key"))
+async def key_info_cmd(message: types.Message, t: Translator):
+    if message.from_user.id != cfg.ADMIN_ID:
+        return
+    
+    args = message.text.split()
+    if len(args) < 2 or len(args[1]) > 128:
+        await message.answer(t("key_usage"))
+        return
+    
+    if len(args) > 2 and args[2] == "revoke":
+        info = db.revoke_key(args[1])
+    else:
+        info = db.get_key_info(args[1])
+    if not info:
+        await message.answer(t("key_not_found"))
+        return
+    
+    seller = db.get_sellers().get(info["seller_id"])
+    text = t("key_info").format(
+        key=info["key"],
+        seller=seller["name"] if seller else info["seller_id"],
+        status=t(f"key_status_{info['status']}")
+    )
+    if info["user_id"] is not None:
+        user = db.get_user(info["user_id"]) or {}
+        text += "\n" + t("key_owner").format(
+            user=f"@{user['username']}" if user.get("username") else "-",
+            user_id=info["user_id"],
+            sold_at=info["sold_at"][:16]
+        )
+    if info["revoked_at"]:
+        text += "\n" + t("key_revoked_at").format(revoked_at=info["revoked_at"][:16])
+    await message.answer(text)
+
 # === НАВИГАЦИЯ ===
 
 @dp.callback_query(F.data == "back_main")
-async def back_main(callback: types.CallbackQuery):
+async def back_main(callback: types.CallbackQuery, t: Translator):
     is_admin = callback.from_user.id == cfg.ADMIN_ID
     await callback.message.delete()
     await callback.message.answer(
-        get_text(callback.from_user.id, "main_menu"),
-        reply_markup=main_menu(callback.from_user.id, is_admin)
+        t("main_menu"),
+        reply_markup=main_menu(t, is_admin)
     )
 
 @dp.callback_query(F.data == "back_sellers")
-async def back_sellers(callback: types.CallbackQuery):
-    await show_sellers(callback.message)
+async def back_sellers(callback: types.CallbackQuery, t: Translator):
+    await show_sellers(callback.message, t)
+
+# === ФОНОВЫЕ ЗАДАЧИ ===
+async def payment_sweeper():
+    """Периодически архивирует просроченные неоплаченные заказы"""
+    while True:
+        await asyncio.sleep(cfg.PAYMENT_SWEEP_INTERVAL)
+        try:
+            # Пачками, отдавая управление event loop между ними
+            while db.expire_payments(cfg.PAYMENT_TTL, cfg.PAYMENT_SWEEP_BATCH) == cfg.PAYMENT_SWEEP_BATCH:
+                await asyncio.sleep(0)
+        except Exception as e:
+            logging.error(f"Ошибка очистки платежей: {e}")
+
+async def fsm_cleaner():
+    """Периодически удаляет брошенные состояния диалогов"""
+    while True:
+        await asyncio.sleep(cfg.FSM_CLEANUP_INTERVAL)
+        try:
+            removed = storage.cleanup()
+            if removed:
+                logging.info(f"Удалено брошенных состояний: {removed}")
+        except Exception as e:
+            logging.error(f"Ошибка очистки состояний: {e}")
 
 # === ЗАПУСК ===
-async def main():
+def startup_maintenance():
     # Очистка некорректных продавцов при запуске
     for seller_id in list(db.get_sellers().keys()):
         if not re.match(r'^[a-zA-Z0-9_]+$', seller_id):
@@ -1183,8 +1084,34 @@ async def main():
             db.generate_keys(seller_id, 20)
             print(f"Сгенерировано 20 ключей для {seller_id}")
     
+    # Продолжение рассылок, прерванных остановкой бота
+    for broadcast_id in db.get_unfinished_broadcasts():
+        broadcaster.start(broadcast_id, on_done=report_broadcast)
+
+async def main():
+    # При нескольких процессах обслуживание и фоновые задачи - только в WORKER_ID=0
+    primary = cfg.WORKER_ID == 0
+    if primary:
+        startup_maintenance()
+    
     print("Бот запущен!")
-    await dp.start_polling(bot)
+    outbox.start()
+    sweeper = asyncio.create_task(payment_sweeper()) if primary else None
+    cleaner = asyncio.create_task(fsm_cleaner()) if primary and isinstance(storage, SQLiteStorage) else None
+    try:
+        if cfg.BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        if sweeper:
+            sweeper.cancel()
+        if cleaner:
+            cleaner.cancel()
+        await broadcaster.shutdown()
+        await outbox.close(cfg.OUTBOX_DRAIN_TIMEOUT)
+        db.close()
+        await storage.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter
+
+from ratelimit import ChatLimiter, TokenBucket
+
+
+class Broadcaster:
+    """Рассылка сообщения всем пользователям с учётом лимитов Telegram.
+
+    Получатели читаются из хранилища потоком (db.iter_user_ids) пачками по
+    chunk. После каждой пачки в базу пишется курсор и счётчики, поэтому
+    прерванная рассылка продолжается с места остановки (пачка, на которой
+    случился сбой, может быть отправлена повторно).
+
+    limiter - общая корзина исходящих сообщений бота (её же использует
+    Outbox), rate - собственный лимит рассылки поверх неё.
+    """
+
+    def __init__(self, bot: Bot, db, limiter: TokenBucket, rate: float, chat_interval: float,
+                 chunk: int, retries: int):
+        self.bot = bot
+        self.db = db
+        self.chunk = chunk
+        self.retries = retries
+        self.limiter = limiter
+        self.bucket = TokenBucket(rate)
+        self.chats = ChatLimiter(chat_interval)
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._stopping = set()
+
+    def start(self, broadcast_id: int, on_done: Optional[Callable] = None) -> asyncio.Task:
+        """Запускает (или продолжает) рассылку в фоне"""
+        task = asyncio.create_task(self.run(broadcast_id))
+        self._tasks[broadcast_id] = task
+
+        def _finished(task: asyncio.Task):
+            self._tasks.pop(broadcast_id, None)
+            if task.cancelled():
+                return
+            if task.exception():
+                logging.error(f"Ошибка рассылки #{broadcast_id}: {task.exception()}")
+            elif on_done:
+                asyncio.create_task(on_done(broadcast_id, task.result()))
+
+        task.add_done_callback(_finished)
+        return task
+
+    def stop(self, broadcast_id: int) -> bool:
+        """Останавливает рассылку после текущей пачки"""
+        if broadcast_id not in self._tasks:
+            return False
+        self._stopping.add(broadcast_id)
+        return True
+
+    def is_running(self, broadcast_id: int) -> bool:
+        return broadcast_id in self._tasks
+
+    async def shutdown(self):
+        """Прерывает рассылки при остановке бота - они продолжатся при следующем запуске"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run(self, broadcast_id: int) -> Dict:
+        broadcast = self.db.get_broadcast(broadcast_id)
+        text = broadcast["text"]
+        cursor = broadcast["cursor"]
+        sent, failed = broadcast["sent"], broadcast["failed"]
+        started = time.monotonic()
+        delivered = 0
+        status = "done"
+
+        chunk = []
+        for next_cursor, user_id in self.db.iter_user_ids(cursor):
+            chunk.append(user_id)
+            cursor = next_cursor
+            if len(chunk) < self.chunk:
+                continue
+            ok = await self._send_chunk(chunk, text)
+            sent, failed, delivered = sent + ok, failed + len(chunk) - ok, delivered + ok
+            chunk = []
+            self.db.update_broadcast(broadcast_id, cursor=cursor, sent=sent, failed=failed)
+            if broadcast_id in self._stopping:
+                status = "cancelled"
+                break
+        if chunk:
+            ok = await self._send_chunk(chunk, text)
+            sent, failed, delivered = sent + ok, failed + len(chunk) - ok, delivered + ok
+
+        self._stopping.discard(broadcast_id)
+        self.db.update_broadcast(
+            broadcast_id, status=status, cursor=cursor, sent=sent, failed=failed,
+            finished=datetime.now().isoformat()
+        )
+        elapsed = time.monotonic() - started
+        return {
+            "status": status,
+            "sent": sent,
+            "failed": failed,
+            "rate": delivered / elapsed if elapsed > 0 else 0.0
+        }
+
+    async def _send_chunk(self, chunk: list, text: str) -> int:
+        results = await asyncio.gather(*(self._send(user_id, text) for user_id in chunk))
+        return sum(results)
+
+    async def _send(self, user_id: int, text: str) -> bool:
+        for _ in range(self.retries + 1):
+            await self.chats.wait(user_id)
+            await self.bucket.acquire()
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(user_id, text)
+                return True
+            except TelegramRetryAfter as e:
+                # Флуд-контроль: тормозим все отправки бота, а не только этот чат
+                self.limiter.pause(e.retry_after)
+            except TelegramNetworkError as e:
+                logging.warning(f"Рассылка: сетевая ошибка для {user_id}: {e}")
+            except TelegramAPIError as e:
+                # Пользователь заблокировал бота, удалил аккаунт и т.п.
+                logging.info(f"Рассылка: не доставлено {user_id}: {e}")
+                return False
+        return False
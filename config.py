@@ -14,9 +14,99 @@ class Config:
         "seller_3": 4.0
     }
     
+    # Продавцы, создаваемые в пустой базе: id -> (название, цена)
+    DEFAULT_SELLERS = {
+        "seller_1": ("🔥 Mega Keys", 2.0),
+        "seller_2": ("⚡ Pro Keys", 3.0),
+        "seller_3": ("💎 Elite Keys", 4.0)
+    }
+    
     # Кошелёк для оплаты
     USDT_WALLET: str = os.getenv("USDT_WALLET", "")
 
+    # Режим приёма апдейтов: "polling" или "webhook"
+    BOT_MODE: str = os.getenv("BOT_MODE", "polling")
+    # Публичный адрес, который регистрируется в Telegram (без пути)
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT: int = int(os.getenv("PORT", "8080"))
+    WEBHOOK_MAX_CONCURRENCY: int = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "64"))
+    WEBHOOK_DRAIN_TIMEOUT: float = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+    # Несколько процессов бота (webhook): каждый слушает тот же порт
+    # (SO_REUSEPORT), фоновые задачи выполняет только WORKER_ID=0
+    WORKERS: int = int(os.getenv("WORKERS", "1"))
+    WORKER_ID: int = int(os.getenv("WORKER_ID", "0"))
+    # Адрес Bot API (для локального сервера или тестового стенда)
+    TELEGRAM_API_URL: str = os.getenv("TELEGRAM_API_URL", "")
+    
+    # Движок хранилища: "json" (bot_data.json) или "sqlite"
+    DB_BACKEND: str = os.getenv("DB_BACKEND", "json")
+    SQLITE_FILE: str = os.getenv("SQLITE_FILE", "bot_data.sqlite3")
+    
+    # Хранилище: "snapshot" - перезапись bot_data.json при каждом изменении,
+    # "journal" - дозапись изменений в журнал с фоновой компактизацией,
+    # "deferred" - отложенная запись снимка в отдельном потоке,
+    # "shared" - общий журнал под блокировкой для нескольких процессов
+    DB_PERSIST: str = os.getenv("DB_PERSIST", "snapshot")
+    # Максимальная задержка записи в режиме "deferred", секунд
+    FLUSH_DELAY: float = float(os.getenv("FLUSH_DELAY", "1.0"))
+    
+    # Неоплаченные заказы старше PAYMENT_TTL секунд уходят в архив
+    PAYMENT_TTL: int = int(os.getenv("PAYMENT_TTL", "86400"))
+    PAYMENT_SWEEP_INTERVAL: int = int(os.getenv("PAYMENT_SWEEP_INTERVAL", "300"))
+    PAYMENT_SWEEP_BATCH: int = int(os.getenv("PAYMENT_SWEEP_BATCH", "500"))
+    # Наибольшее число ключей, которое админ генерирует за один раз, и
+    # размер пачки: каждая сохраняется одной записью журнала (в режиме
+    # snapshot снимок пишется один раз в конце), между пачками бот
+    # обрабатывает другие апдейты
+    KEYGEN_MAX: int = int(os.getenv("KEYGEN_MAX", "500000"))
+    KEYGEN_CHUNK: int = int(os.getenv("KEYGEN_CHUNK", "10000"))
+    # Импорт ключей из файла: допустимый формат ключа и размер пачки,
+    # которая сохраняется одной записью. Формат - тот же XXXXXXXXXX:xxxxxxxx,
+    # что у генератора: склад хранит ключи записями ширины самого длинного,
+    # и один длинный ключ раздул бы весь склад продавца
+    IMPORT_KEY_PATTERN: str = os.getenv("IMPORT_KEY_PATTERN", r"[A-Z]{10}:[a-z0-9]{8}")
+    IMPORT_CHUNK: int = int(os.getenv("IMPORT_CHUNK", "10000"))
+    JOURNAL_COMPACT_EVERY: int = int(os.getenv("JOURNAL_COMPACT_EVERY", "1000"))
+    JOURNAL_FSYNC: bool = os.getenv("JOURNAL_FSYNC", "0") == "1"
+    # Снимок пишется через временный файл с fsync; предыдущие
+    # SNAPSHOT_GENERATIONS версий хранятся как bot_data.json.1, .2, ...
+    SNAPSHOT_GENERATIONS: int = int(os.getenv("SNAPSHOT_GENERATIONS", "3"))
+    SNAPSHOT_FSYNC: bool = os.getenv("SNAPSHOT_FSYNC", "1") == "1"
+    # Кодек разделов снимка: "json" - с отступами, для отладки, "compact" -
+    # JSON без отступов, "pickle" - двоичный, самый быстрый. Формат читаемого
+    # снимка определяется по файлу, так что кодек можно сменить в любой момент
+    SNAPSHOT_CODEC: str = os.getenv("SNAPSHOT_CODEC", "compact")
+    
+    # Общий лимит исходящих сообщений бота в секунду (у Telegram ~30).
+    # Очередь сообщений и рассылки берут токены из одной корзины, и
+    # RetryAfter от Telegram притормаживает их вместе
+    SEND_RATE: float = float(os.getenv("SEND_RATE", "25"))
+    
+    # Рассылки: собственный лимит в секунду (меньше SEND_RATE, чтобы ответы
+    # пользователям не стояли за рассылкой), минимальный интервал между
+    # сообщениями в один чат и размер пачки
+    BROADCAST_RATE: float = float(os.getenv("BROADCAST_RATE", "20"))
+    BROADCAST_CHAT_INTERVAL: float = float(os.getenv("BROADCAST_CHAT_INTERVAL", "1.0"))
+    BROADCAST_CHUNK: int = int(os.getenv("BROADCAST_CHUNK", "100"))
+    BROADCAST_RETRIES: int = int(os.getenv("BROADCAST_RETRIES", "3"))
+    
+    # Очередь исходящих сообщений: число воркеров и повторы при сетевых
+    # сбоях (задержка OUTBOX_BACKOFF * 2^n секунд)
+    OUTBOX_WORKERS: int = int(os.getenv("OUTBOX_WORKERS", "8"))
+    OUTBOX_RETRIES: int = int(os.getenv("OUTBOX_RETRIES", "5"))
+    OUTBOX_BACKOFF: float = float(os.getenv("OUTBOX_BACKOFF", "1.0"))
+    OUTBOX_DRAIN_TIMEOUT: float = float(os.getenv("OUTBOX_DRAIN_TIMEOUT", "10"))
+    
+    # Состояния диалогов (FSM): "sqlite" - переживают перезапуск, "memory" - нет.
+    # Брошенные состояния старше FSM_TTL секунд удаляются
+    FSM_STORAGE: str = os.getenv("FSM_STORAGE", "sqlite")
+    FSM_FILE: str = os.getenv("FSM_FILE", "bot_fsm.sqlite3")
+    FSM_TTL: int = int(os.getenv("FSM_TTL", "86400"))
+    FSM_CLEANUP_INTERVAL: int = int(os.getenv("FSM_CLEANUP_INTERVAL", "3600"))
+
 cfg = Config()
 
 # import os
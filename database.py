@@ -1,63 +1,735 @@
+import asyncio
+import functools
 import json
+import logging
 import os
-import random
-import string
-from datetime import datetime
-from typing import List, Dict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+
+from config import cfg
+from inventory import KeyInventory
+from journal import Journal, StaleJournal, apply_op
+from keyindex import KeyIndex, key_digest
+from keygen import generate_key_batch, generate_payment_id
+from ledger import PurchaseLedger
+from locking import FileLock
+from snapshot import (
+    CODECS, CorruptSnapshot, EncodedDict, LazyBlob, SectionedData, build, generations, open_snapshot, seal,
+    write_snapshot
+)
+from sqlite_db import SQLiteDatabase
 
 DB_FILE = "bot_data.json"
 
+def mutation(method):
+    """Изменение данных: в режиме "shared" выполняется под межпроцессной
+    блокировкой поверх свежих данных (изменения других процессов
+    подтягиваются перед вызовом)"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._lock is None:
+            return method(self, *args, **kwargs)
+        with self._lock:
+            self._sync()
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class Database:
-    def __init__(self):
-        self.data = self._load()
-        self._init_defaults()
+    # Сколько раз refresh() перечитывает журнал без блокировки,
+    # прежде чем взять её
+    SYNC_RETRIES = 3
+    # Разделы данных читаются из снимка по первому обращению (SectionedData);
+    # при чтении раздела строятся его индексы
+    SECTION_INDEXERS = {
+        "sellers": "_index_sellers",
+        "users": "_index_users",
+        "reviews": "_index_reviews",
+        "tickets": "_index_tickets",
+        "pending_payments": "_index_payments"
+    }
+    # Операции других процессов (см. _sync) правят индексы своего раздела точечно
+    PEER_OP_HANDLERS = {
+        "sellers": "_peer_sellers_op",
+        "users": "_peer_users_op",
+        "reviews": "_peer_reviews_op",
+        "tickets": "_peer_tickets_op",
+        "pending_payments": "_peer_payments_op",
+        "revoked_keys": "_peer_revoked_op"
+    }
+    # Индекс -> раздел, из которого он строится
+    LAZY_INDEXES = {
+        "_users_by_id": "users",
+        "_user_ids_by_name": "users",
+        "_user_ids": "users",
+        "_review_pos": "reviews",
+        "_review_tombstones": "reviews",
+        "_open_tickets": "tickets",
+        "_tickets_by_user": "tickets",
+        "_pending": "pending_payments"
+    }
+    
+    def __init__(self, path: str = DB_FILE, persist: str = cfg.DB_PERSIST, codec: str = cfg.SNAPSHOT_CODEC):
+        self.path = path
+        if codec not in CODECS:
+            raise ValueError(f"Неизвестный кодек снимка {codec!r}, доступны: {', '.join(CODECS)}")
+        self.codec = CODECS[codec]
+        self.journal = None
+        if persist in ("journal", "shared"):
+            self.journal = Journal(path + ".wal", fsync=cfg.JOURNAL_FSYNC)
+        # Режим "shared": несколько процессов пишут в общий журнал
+        # под flock, каждый подтягивает чужие записи (см. _sync)
+        self._lock = FileLock(path + ".lock") if persist == "shared" else None
+        # Какой снимок загружен (inode, mtime) - его замена другим процессом
+        # означает, что журнал свёрнут и данные надо перечитать
+        self._snapshot_id = None
+        self._leftover_journal = None
+        # Данные прочитаны из предыдущего поколения - при запуске снимок
+        # переписывается, чтобы основной файл снова был целым
+        self._restored = False
+        self.ledger = PurchaseLedger(path + ".purchases.jsonl", fsync=cfg.JOURNAL_FSYNC)
+        self._compactor = None
+        # Растёт при любом изменении каталога (продавцы, остатки) - по нему
+        # бот сбрасывает закэшированные клавиатуры
+        self.catalog_version = 0
+        # Отложенная запись: мутации только помечают базу грязной,
+        # снимок пишется в отдельном потоке не чаще раза в FLUSH_DELAY
+        self._writer = ThreadPoolExecutor(max_workers=1) if persist == "deferred" else None
+        self._dirty_since = None
+        self._flush_handle = None
+        self._flush_future = None
+        # Покупки, чьи отметки commit ждут записи снимка (см. _mark_committed)
+        self._unmarked = []
+        # Закодированные разделы (и куски разделов-словарей, EncodedDict):
+        # снимок перекодирует только то, что менялось с прошлой записи
+        self._encoded = {}
+        self._encoded_dicts = {}
+        if self._lock:
+            with self._lock:
+                self.data = self._load()
+                self._init_defaults()
+        else:
+            self.data = self._load()
+            self._init_defaults()
+    
+    def _load(self, truncate: bool = True):
+        data = self._read_newest_snapshot()
+        journal = self.journal
+        if journal is None and os.path.exists(self.path + ".wal"):
+            # Журнал остался от режима "journal" - его записи ещё не в снимке
+            journal = self._leftover_journal = Journal(self.path + ".wal")
+        if journal:
+            seq = data.get("meta", {}).get("journal_seq", 0)
+            first = journal.first_seq()
+            if self._restored and truncate and first is not None and first > seq + 1:
+                # Журнал продолжает более новый (повреждённый) снимок: его операции
+                # ссылаются на позиции, которых в старом поколении нет. Файлы
+                # остаются рядом с суффиксом .orphaned
+                logging.error("Журнал %s (с записи %s) не продолжает восстановленный снимок "
+                              "(journal_seq %s) и отложен", journal.path, first, seq)
+                journal.set_aside(".orphaned")
+            journal.replay(data, seq, truncate=truncate, strict=not truncate)
+        # Индексы строятся для self.data, поэтому разделы, прочитанные при
+        # накате журнала, индексирует уже _build_indexes
+        data.on_load = self._section_loaded
+        return data
+    
+    def __getattr__(self, name):
+        # Индекс ещё не построен: читаем его раздел, при этом индекс и строится
+        section = self.LAZY_INDEXES.get(name)
+        if section is None or "data" not in self.__dict__:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        self.data[section]
+        return self.__dict__[name]
+    
+    def _read_newest_snapshot(self) -> SectionedData:
+        """Открывает самое новое целое поколение снимка"""
+        found = False
+        for path in generations(self.path, cfg.SNAPSHOT_GENERATIONS):
+            try:
+                snapshot = open_snapshot(path)
+            except FileNotFoundError:
+                continue
+            except CorruptSnapshot as e:
+                found = True
+                logging.error("Повреждённый снимок: %s", e)
+                if path == self.path:
+                    # Убираем из ротации, чтобы он не вытеснил целые поколения
+                    os.replace(path, path + ".corrupt")
+                continue
+            if path == self.path:
+                st = os.stat(path)
+                self._snapshot_id = (st.st_ino, st.st_mtime_ns)
+            else:
+                self._restored = True
+                if found:
+                    logging.warning("Данные восстановлены из предыдущего поколения %s", path)
+            if isinstance(snapshot, dict):
+                # Снимок старого формата прочитан целиком
+                return SectionedData(snapshot)
+            return SectionedData(source=snapshot)
+        if found:
+            # Пустая база поверх повреждённой затёрла бы остатки ключей
+            raise RuntimeError(f"Нет ни одного целого снимка {self.path}")
+        return SectionedData()
+    
+    def _snapshot_changed(self) -> bool:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (st.st_ino, st.st_mtime_ns) != self._snapshot_id
+    
+    def _sync(self):
+        """Подтягивает изменения, записанные другими процессами.
+        
+        Дописанные записи журнала применяются по одной операции, индексы
+        правятся только для затронутых записей (_apply_peer_op). Все индексы
+        перестраиваются, только если данные перечитаны со снимка.
+        """
+        reloaded = applied = 0
+        if self._snapshot_changed():
+            # Журнал свёрнут в снимок другим процессом - перечитываем целиком
+            self._reload()
+            reloaded = True
+        elif self.journal.changed():
+            try:
+                applied = self.journal.tail(self.data, self._apply_peer_op)
+            except StaleJournal:
+                self._reload()
+                reloaded = True
+        if reloaded:
+            self._build_indexes()
+        if reloaded or applied:
+            self.catalog_version += 1
     
-    def _load(self):
-        if os.path.exists(DB_FILE):
-            with open(DB_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+    def _apply_peer_op(self, data: SectionedData, op: list):
+        section = str(op[1][0])
+        # Раздел читается (и индексируется) до изменения, иначе индекс
+        # построился бы уже с этой операцией и она учлась бы дважды
+        data[section]
+        handler = self.PEER_OP_HANDLERS.get(section)
+        if handler:
+            getattr(self, handler)(op)
+        else:
+            apply_op(data, op)
+        self._invalidate([op])
+    
+    def _peer_users_op(self, op: list):
+        path = op[1]
+        if len(path) == 1:
+            apply_op(self.data, op)
+            self._index_users()
+            return
+        user_id = int(path[1])
+        old = self._users_by_id.get(user_id)
+        name = old.get("username") if old else None
+        apply_op(self.data, op)
+        user = self.data["users"].get(str(user_id))
+        if name and self._user_ids_by_name.get(name.lower()) == user_id and (user is None or user.get("username") != name):
+            del self._user_ids_by_name[name.lower()]
+        if user is None:
+            self._users_by_id.pop(user_id, None)
+            self._user_ids.remove(user_id)
+            return
+        if old is None:
+            self._user_ids.append(user_id)
+        self._index_user(user_id, user)
+    
+    def _peer_sellers_op(self, op: list):
+        path = op[1]
+        if len(path) == 1 or len(path) == 2 and str(path[1]) in self.data["sellers"]:
+            # Продавец заменён или удалён - его непроданные ключи больше не выпущены
+            self._key_index = None
+        apply_op(self.data, op)
+        if len(path) <= 2:
+            self._index_sellers()
+        elif self._key_index is not None and op[0] == "push" and path[2] == "keys":
+            seller_id = str(path[1])
+            inventory = self.data["sellers"][seller_id]["keys"]
+            self._key_index.issued.update(map(key_digest, op[2]))
+            self._key_index.add_stock(seller_id, inventory, op[2], inventory.next_number - len(op[2]))
+    
+    def _peer_revoked_op(self, op: list):
+        apply_op(self.data, op)
+        if self._key_index is None:
+            return
+        if len(op[1]) == 2 and op[0] == "set":
+            self._key_index.add_issued(str(op[1][1]))
+        else:
+            self._key_index = None
+    
+    def _peer_reviews_op(self, op: list):
+        path = op[1]
+        reviews = self.data["reviews"]
+        if len(path) == 1 and op[0] == "push":
+            start = len(reviews)
+            apply_op(self.data, op)
+            for pos in range(start, len(reviews)):
+                self._index_review(pos, reviews[pos])
+        elif len(path) == 2 and op[0] == "set":
+            pos = int(path[1])
+            old = reviews[pos]
+            if old.get("deleted"):
+                self._review_tombstones -= 1
+            else:
+                self._review_pos.pop(old["id"], None)
+            apply_op(self.data, op)
+            self._index_review(pos, reviews[pos])
+        else:
+            apply_op(self.data, op)
+            self._index_reviews()
+    
+    def _peer_tickets_op(self, op: list):
+        path = op[1]
+        if len(path) == 1 or op[0] == "del":
+            apply_op(self.data, op)
+            self._index_tickets()
+            return
+        ticket_id = int(path[1])
+        existed = str(ticket_id) in self.data["tickets"]
+        apply_op(self.data, op)
+        ticket = self.data["tickets"][str(ticket_id)]
+        if not existed:
+            self._index_ticket(ticket_id, ticket)
+        elif ticket["status"] == "open":
+            self._open_tickets[ticket_id] = ticket
+        else:
+            self._open_tickets.pop(ticket_id, None)
+    
+    def _peer_payments_op(self, op: list):
+        path = op[1]
+        apply_op(self.data, op)
+        if len(path) == 1:
+            self._index_payments()
+            return
+        payment = self.data["pending_payments"].get(str(path[1]))
+        if payment is not None and payment["status"] == "pending":
+            self._pending[str(path[1])] = payment
+        else:
+            self._pending.pop(str(path[1]), None)
+    
+    def _reload(self):
+        old = self.data
+        self.data = self._load(truncate=False)
+        old.close()
+    
+    def refresh(self):
+        """Проверяет, не менялись ли данные в других процессах.
+        
+        Дёшево, если изменений нет (один stat журнала). Чтение идёт без
+        блокировки: если во время него журнал свернули, попытка
+        повторяется, и только после SYNC_RETRIES неудач берётся блокировка.
+        """
+        if self._lock is None:
+            return
+        for _ in range(self.SYNC_RETRIES):
+            try:
+                self._sync()
+                return
+            except StaleJournal:
+                continue
+        with self._lock:
+            self._sync()
+    
+    def _dump(self) -> list:
+        """Разделы снимка [(раздел, байты или LazyBlob)]; собирает и пишет файл _write_snapshot"""
+        if self.journal is None:
+            # Без журнала позиции отзывов нигде не записаны - сдвигать их можно всегда
+            reviews = self._compacted_reviews()
+            if reviews is not None:
+                self._set_reviews(reviews)
+        if self.journal and self.data["meta"].get("journal_seq") != self.journal.seq:
+            self.data["meta"]["journal_seq"] = self.journal.seq
+            self._invalidate([["set", ["meta", "journal_seq"]]])
+        return [(name, self._encode_section(name)) for name in self.data.loaded() + self.data.unloaded()]
+    
+    def _encode_section(self, name: str):
+        blob = self._encoded.get(name)
+        if blob is not None:
+            return blob
+        if not self.data.is_loaded(name):
+            # Непрочитанный раздел не менялся - переносится байтами без разбора
+            blob = self.data.raw(name, self.codec)
+        elif name == "sellers":
+            # Склады в event loop только копируются буферами; в списки ключей
+            # и кодек они превращаются в потоке записи (build), иначе выдача
+            # одного ключа перекодировала бы в loop весь склад продавца
+            sellers = {
+                seller_id: dict(seller, keys=seller["keys"].copy()) for seller_id, seller in self.data[name].items()
+            }
+            blob = LazyBlob(functools.partial(self.codec.encode, sellers, self._encode, background=True))
+        elif isinstance(self.data[name], dict) and self.codec.chunked:
+            encoded = self._encoded_dicts.get(name)
+            if encoded is None:
+                encoded = self._encoded_dicts[name] = EncodedDict(self.codec, self.data[name])
+            blob = encoded.encode(self.data[name], self._encode)
+        else:
+            blob = self.codec.encode(self.data[name], self._encode)
+        self._encoded[name] = blob
+        return blob
+    
+    def _invalidate(self, ops):
+        """Сбрасывает закодированные копии того, что меняют операции"""
+        for op in ops:
+            path = op[1]
+            section = str(path[0])
+            self._encoded.pop(section, None)
+            encoded = self._encoded_dicts.get(section)
+            if encoded is None:
+                continue
+            if len(path) == 1 or not encoded.touch(str(path[1]), deleted=op[0] == "del" and len(path) == 2):
+                del self._encoded_dicts[section]
+    
+    def _reset_encoded(self):
+        self._encoded = {}
+        self._encoded_dicts = {}
+    
+    @staticmethod
+    def _encode(obj):
+        """Сериализация служебных структур в обычный JSON"""
+        if isinstance(obj, KeyInventory):
+            return obj.to_list()
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    
+    def _write_snapshot(self, sections: list):
+        # Сборка и контрольная сумма - в потоке записи, если он есть
+        self._snapshot_id = write_snapshot(
+            self.path, seal(build(sections, self.codec)), cfg.SNAPSHOT_GENERATIONS, cfg.SNAPSHOT_FSYNC
+        )
     
     def _save(self):
-        with open(DB_FILE, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+        """Полная синхронная запись снимка"""
+        if self._compactor:
+            self._compactor.join()
+        reviews = self._compacted_reviews() if self.journal else None
+        sections = self._dump()
+        if reviews is not None:
+            # Операции журнала ссылаются на позиции отзывов: сжатый список
+            # попадает в память только после записи снимка, поглотившего
+            # журнал, иначе при сбое новые операции легли бы на старые позиции
+            sections = [
+                (name, self.codec.encode(reviews, self._encode) if name == "reviews" else blob)
+                for name, blob in sections
+            ]
+        self._write_snapshot(sections)
+        if self.journal:
+            self.journal.reset()
+        if self._leftover_journal:
+            self._leftover_journal.reset()
+            self._leftover_journal = None
+        if reviews is not None:
+            self._set_reviews(reviews)
+    
+    def _commit(self, *ops):
+        """Сохраняет мутацию: в журнал (O(изменения)) или полным снимком"""
+        self._invalidate(ops)
+        if self._writer:
+            self._mark_dirty()
+            return
+        if self.journal is None:
+            self._save()
+            return
+        self.journal.append(list(ops))
+        if self.journal.records >= cfg.JOURNAL_COMPACT_EVERY:
+            if self._lock or self._compacted_reviews() is not None:
+                # Другие процессы должны видеть снимок сразу после удаления
+                # журнала, поэтому пишем его под блокировкой; удалённые
+                # отзывы вырезаются тоже только синхронной записью (см. _save)
+                self._save()
+            else:
+                self._compact()
+    
+    def _compact(self):
+        """Сворачивает журнал в снимок; запись файла идёт в фоновом потоке"""
+        if self._compactor and self._compactor.is_alive():
+            return
+        sections = self._dump()
+        self.journal.rotate()
+        self._compactor = threading.Thread(target=self._finish_compaction, args=(sections,), daemon=True)
+        self._compactor.start()
+    
+    def _finish_compaction(self, sections: list):
+        try:
+            self._write_snapshot(sections)
+        except Exception:
+            # *.old остаётся до следующей свёртки: она допишет к нему журнал (Journal.rotate)
+            logging.exception("Свёртка журнала: снимок не записан")
+            return
+        self.journal.drop_rotated()
+    
+    def _mark_dirty(self):
+        if self._dirty_since is None:
+            self._dirty_since = time.monotonic()
+        if self._flush_handle or self._flush_future:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (скрипты, миграции) пишем сразу
+            self._dirty_since = None
+            self._write_snapshot(self._dump())
+            self._write_marks()
+            return
+        delay = max(0.0, self._dirty_since + cfg.FLUSH_DELAY - time.monotonic())
+        self._flush_handle = loop.call_later(delay, self._start_flush)
+    
+    def _start_flush(self):
+        """Снимает согласованный снимок в event loop и отдаёт запись потоку.
+        
+        В event loop кодируются только изменённые элементы разделов,
+        остальное берётся из кэша; сборка файла, сумма и запись - в потоке.
+        """
+        self._flush_handle = None
+        self._dirty_since = None
+        sections = self._dump()
+        marks, self._unmarked = self._unmarked, []
+        self._flush_future = asyncio.get_running_loop().run_in_executor(self._writer, self._write_snapshot, sections)
+        self._flush_future.add_done_callback(lambda future: self._flush_done(future, marks))
+    
+    def _flush_done(self, future, marks: list):
+        self._flush_future = None
+        if future.exception():
+            logging.error("Ошибка записи %s: %s", self.path, future.exception())
+            self._unmarked[:0] = marks
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+        else:
+            self.ledger.commit(*marks)
+        if self._dirty_since is not None:
+            self._mark_dirty()
+    
+    def _mark_committed(self, payment_id: str):
+        """Отмечает покупку сохранённой, когда её мутация уже на диске.
+        
+        При отложенной записи отметка ждёт снимка: иначе после сбоя журнал
+        покупок подтвердил бы покупку, которой нет в данных.
+        """
+        if self._writer and self._dirty_since is not None:
+            self._unmarked.append(payment_id)
+        else:
+            self.ledger.commit(payment_id)
+    
+    def _write_marks(self):
+        marks, self._unmarked = self._unmarked, []
+        self.ledger.commit(*marks)
+    
+    def close(self):
+        """Дописывает отложенные изменения, дожидается фоновых записей"""
+        if self._writer:
+            if self._flush_handle:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            self._writer.shutdown(wait=True)
+            if self._dirty_since is not None or self._flush_future:
+                self._dirty_since = None
+                self._write_snapshot(self._dump())
+            self._write_marks()
+        if self._compactor:
+            self._compactor.join()
+        if self.journal:
+            self.journal.close()
+        if self._lock:
+            self._lock.close()
+        self.data.close()
     
     def _init_defaults(self):
-        if "users" not in self.data:
-            self.data["users"] = {}
-        if "sellers" not in self.data:
-            self.data["sellers"] = {
-                "seller_1": {"name": "🔥 Mega Keys", "price": 2.0, "keys": []},
-                "seller_2": {"name": "⚡ Pro Keys", "price": 3.0, "keys": []},
-                "seller_3": {"name": "💎 Elite Keys", "price": 4.0, "keys": []}
-            }
-        if "reviews" not in self.data:
-            self.data["reviews"] = []
-        if "tickets" not in self.data:
-            self.data["tickets"] = {}
-        if "pending_payments" not in self.data:
-            self.data["pending_payments"] = {}
-        self._save()
+        """Дополняет данные недостающими разделами; снимок пишется, только если что-то изменилось"""
+        defaults = {
+            "users": dict,
+            "sellers": lambda: {
+                sid: {"name": name, "price": price, "keys": []}
+                for sid, (name, price) in cfg.DEFAULT_SELLERS.items()
+            },
+            "reviews": list,
+            "tickets": dict,
+            "pending_payments": dict,
+            "broadcasts": dict,
+            "dead_letters": list,
+            "revoked_keys": dict,
+            "meta": dict
+        }
+        changed = False
+        for name, factory in defaults.items():
+            if name not in self.data:
+                self.data[name] = factory()
+                changed = True
+        meta = self.data["meta"]
+        if "review_seq" not in meta:
+            meta["review_seq"] = max((r["id"] for r in self.data["reviews"]), default=0)
+            changed = True
+        if "ticket_seq" not in meta:
+            meta["ticket_seq"] = max((int(tid) for tid in self.data["tickets"]), default=0)
+            changed = True
+        if "broadcast_seq" not in meta:
+            meta["broadcast_seq"] = 0
+            changed = True
+        if not meta.get("purchase_ledger"):
+            # Покупки уже в журнале покупок - пользователей при запуске не читаем
+            self._migrate_purchases()
+            meta["purchase_ledger"] = True
+            changed = True
+        if "ledger_checked" not in meta:
+            self._migrate_confirmed_payments()
+            changed = True
+        else:
+            self._settle_ledger()
+        self._build_indexes()
+        if changed or self._leftover_journal or self._restored:
+            self._save()
+    
+    def _migrate_purchases(self):
+        """Переносит покупки из записей пользователей в журнал покупок"""
+        legacy = []
+        for uid, user in self.data["users"].items():
+            for purchase in user.get("purchases", []):
+                legacy.append(dict(purchase, user_id=int(uid)))
+        if legacy:
+            self.ledger.append(*legacy)
+        for user in self.data["users"].values():
+            if "purchases" in user:
+                user["purchase_count"] = user.get("purchase_count", 0) + len(user.pop("purchases"))
+    
+    def _migrate_confirmed_payments(self):
+        """Отмечает покупки в журнале покупок и убирает подтверждённые платежи.
+        
+        Раньше строка журнала покупок считалась по статусу её платежа, а
+        подтверждённые платежи с выданными ключами копились в pending_payments.
+        Теперь выручка и продажи лежат в meta, платежи уходят в архив.
+        """
+        meta = self.data["meta"]
+        payments = self.data["pending_payments"]
+        unresolved = self.ledger.unresolved()
+        self.ledger.commit(*(pid for pid in unresolved if payments.get(pid, {}).get("status") == "confirmed"))
+        self.ledger.abort(*(pid for pid in unresolved if payments.get(pid, {}).get("status") != "confirmed"))
+        meta.setdefault("revenue", {})
+        meta.setdefault("sales", {})
+        confirmed = [pid for pid, p in payments.items() if p["status"] == "confirmed"]
+        for pid in confirmed:
+            self._count_sale(payments[pid])
+        self._archive_payments([
+            {k: v for k, v in payments[pid].items() if k != "keys"} for pid in confirmed
+        ], confirmed)
+        for pid in confirmed:
+            del payments[pid]
+        meta["ledger_checked"] = self.ledger.size()
+    
+    def _settle_ledger(self):
+        """Доводит покупки, прерванные сбоем между записью в журнал покупок и отметкой.
+        
+        Платёж ещё ожидает - мутация не сохранилась (abort); платежа нет -
+        сохранилась, не успела только отметка (commit). Смотреть нужно
+        только строки после последней сохранённой покупки (meta.ledger_checked).
+        """
+        unresolved = self.ledger.unresolved(self.data["meta"]["ledger_checked"])
+        if not unresolved:
+            return
+        payments = self.data["pending_payments"]
+        self.ledger.commit(*(pid for pid in unresolved if pid not in payments))
+        self.ledger.abort(*(pid for pid in unresolved if pid in payments))
+    
+    def _build_indexes(self):
+        """Перестраивает индексы прочитанных разделов.
+        
+        Индексы непрочитанных разделов сбрасываются и строятся при первом
+        обращении (см. __getattr__).
+        """
+        self._reset_encoded()
+        for attr, section in self.LAZY_INDEXES.items():
+            if not self.data.is_loaded(section):
+                self.__dict__.pop(attr, None)
+        for name in self.data.loaded():
+            self._section_loaded(name)
+        # Индекс всех выпущенных ключей собирается лениво при первом обращении
+        self._key_index = None
+    
+    def _section_loaded(self, name: str):
+        indexer = self.SECTION_INDEXERS.get(name)
+        if indexer:
+            getattr(self, indexer)()
+    
+    def _index_sellers(self):
+        for seller in self.data["sellers"].values():
+            if not isinstance(seller.get("keys"), KeyInventory):
+                seller["keys"] = KeyInventory(seller.get("keys", []))
+    
+    def _index_users(self):
+        self._users_by_id = {}
+        self._user_ids_by_name = {}
+        # Порядок регистрации - только дописывается, по нему идут рассылки
+        self._user_ids = [int(uid) for uid in self.data["users"]]
+        for uid in self._user_ids:
+            self._index_user(uid, self.data["users"][str(uid)])
+    
+    def _index_tickets(self):
+        self._open_tickets = {}
+        self._tickets_by_user = {}
+        for tid, ticket in self.data["tickets"].items():
+            self._index_ticket(int(tid), ticket)
+    
+    def _index_payments(self):
+        self._pending = {
+            pid: p for pid, p in self.data["pending_payments"].items() if p["status"] == "pending"
+        }
     
     # === ПОЛЬЗОВАТЕЛИ ===
+    @mutation
     def add_user(self, user_id: int, username: str = None, language: str = "ru"):
-        if str(user_id) not in self.data["users"]:
-            self.data["users"][str(user_id)] = {
+        user = self._users_by_id.get(user_id)
+        if user is None:
+            user = {
                 "username": username,
                 "language": language,
                 "joined": datetime.now().isoformat(),
-                "purchases": []
+                "purchase_count": 0
             }
-            self._save()
+            self.data["users"][str(user_id)] = user
+            self._user_ids.append(user_id)
+            self._index_user(user_id, user)
+            self._commit(["set", ["users", str(user_id)], user])
+        elif username and username != user.get("username"):
+            self.update_username(user_id, username)
+    
+    def _index_user(self, user_id: int, user: Dict):
+        self._users_by_id[user_id] = user
+        if user.get("username"):
+            self._user_ids_by_name[user["username"].lower()] = user_id
+    
+    @mutation
+    def update_username(self, user_id: int, username: str):
+        """Обновляет username пользователя и индекс по нему"""
+        user = self._users_by_id.get(user_id)
+        if user is None or user.get("username") == username:
+            return
+        old = user.get("username")
+        if old and self._user_ids_by_name.get(old.lower()) == user_id:
+            del self._user_ids_by_name[old.lower()]
+        user["username"] = username
+        self._index_user(user_id, user)
+        self._commit(["set", ["users", str(user_id), "username"], username])
+    
+    def find_user_by_username(self, username: str) -> int:
+        """ID пользователя по username (без @, без учёта регистра)"""
+        return self._user_ids_by_name.get(username.lstrip("@").lower())
     
     def get_user_language(self, user_id: int) -> str:
-        user = self.data["users"].get(str(user_id), {})
-        return user.get("language", "ru")
+        user = self._users_by_id.get(user_id)
+        return user.get("language", "ru") if user else "ru"
     
+    @mutation
     def set_user_language(self, user_id: int, language: str):
-        if str(user_id) in self.data["users"]:
-            self.data["users"][str(user_id)]["language"] = language
-            self._save()
+        user = self._users_by_id.get(user_id)
+        if user is not None:
+            user["language"] = language
+            self._commit(["set", ["users", str(user_id), "language"], language])
+    
+    def user_exists(self, user_id: int) -> bool:
+        return user_id in self._users_by_id
+    
+    def get_user(self, user_id: int) -> Dict:
+        return self._users_by_id.get(user_id)
     
     def get_users_count(self) -> int:
         return len(self.data["users"])
@@ -65,116 +737,374 @@ class Database:
     def get_all_users(self) -> Dict:
         return self.data["users"]
     
+    def iter_user_ids(self, cursor: int = 0):
+        """Потоково отдаёт (курсор, ID пользователя) в порядке регистрации.
+        
+        Курсор - позиция, с которой продолжать после этого пользователя.
+        Список только дописывается, поэтому новые пользователи во время
+        обхода не ломают итерацию.
+        """
+        ids = self._user_ids
+        while cursor < len(ids):
+            cursor += 1
+            yield cursor, ids[cursor - 1]
+    
     # === ПРОДАВЦЫ ===
     def get_sellers(self) -> Dict:
         return self.data["sellers"]
     
+    @mutation
     def add_seller(self, seller_id: str, name: str, price: float):
-        self.data["sellers"][seller_id] = {"name": name, "price": price, "keys": []}
-        self._save()
+        self.data["sellers"][seller_id] = {"name": name, "price": price, "keys": KeyInventory()}
+        if self._key_index is not None:
+            # Номера ключей на новом складе начинаются заново
+            self._key_index.stock.pop(seller_id, None)
+        self.catalog_version += 1
+        self._commit(["set", ["sellers", seller_id], {"name": name, "price": price, "keys": []}])
     
+    @mutation
     def remove_seller(self, seller_id: str):
         if seller_id in self.data["sellers"]:
-            del self.data["sellers"][seller_id]
-            self._save()
+            self.data["sellers"].pop(seller_id)
+            # Непроданные ключи удалённого продавца больше нигде не числятся:
+            # из индекса хэшей их не вычеркнуть, он соберётся заново
+            self._key_index = None
+            self.catalog_version += 1
+            self._commit(["del", ["sellers", seller_id]])
             return True
         return False
     
-    def generate_keys(self, seller_id: str, count: int = 10):
-        """Генерирует ключи формата XXXXXXXXXX:xxxxxxxx"""
+    @mutation
+    def generate_keys(self, seller_id: str, count: int = 10, save: bool = True):
+        """Генерирует count ключей формата XXXXXXXXXX:xxxxxxxx.
+        
+        Ключи берутся из os.urandom пачками и сверяются со всеми когда-либо
+        выпущенными, так что повтор проданного ключа исключён. Вся пачка
+        сохраняется одной записью. save=False в режиме snapshot оставляет
+        пачку в памяти до снимка следующей мутации: генерация частями
+        переписывает снимок один раз, с последней частью.
+        """
+        index = self._get_key_index()
         keys = []
-        for _ in range(count):
-            part1 = ''.join(random.choices(string.ascii_uppercase, k=10))
-            part2 = ''.join(random.choices(string.ascii_lowercase + string.digits, k=8))
-            keys.append(f"{part1}:{part2}")
+        while len(keys) < count:
+            for key in generate_key_batch(count - len(keys)):
+                if not index.is_issued(key):
+                    index.add_issued(key)
+                    keys.append(key)
         
-        self.data["sellers"][seller_id]["keys"].extend(keys)
-        self._save()
+        inventory = self.data["sellers"][seller_id]["keys"]
+        index.add_stock(seller_id, inventory, keys, inventory.extend(keys))
+        self.catalog_version += 1
+        op = ["push", ["sellers", seller_id, "keys"], keys]
+        if save or self.journal or self._writer:
+            # Запись в журнал стоит O(пачки) - откладывать её незачем
+            self._commit(op)
+        else:
+            self._invalidate([op])
+        return keys
+    
+    @mutation
+    def import_keys(self, seller_id: str, keys: List[str]) -> int:
+        """Добавляет на склад готовые ключи одной записью, пропуская уже выпущенные.
+        
+        Возвращает число добавленных ключей.
+        """
+        index = self._get_key_index()
+        added = []
+        for key in keys:
+            if not index.is_issued(key):
+                index.add_issued(key)
+                added.append(key)
+        if added:
+            inventory = self.data["sellers"][seller_id]["keys"]
+            index.add_stock(seller_id, inventory, added, inventory.extend(added))
+            self.catalog_version += 1
+            self._commit(["push", ["sellers", seller_id, "keys"], added])
+        return len(added)
+    
+    @mutation
+    def take_keys(self, seller_id: str, count: int) -> List[str]:
+        """Выдает сразу count ключей или None, если их не хватает"""
+        seller = self.data["sellers"].get(seller_id)
+        if not seller:
+            return None
+        keys = seller["keys"].take(count)
+        if keys:
+            self.catalog_version += 1
+            self._commit(["shift", ["sellers", seller_id, "keys"], count])
         return keys
     
     def get_key(self, seller_id: str) -> str:
         """Выдает один ключ и удаляет его"""
-        keys = self.data["sellers"][seller_id]["keys"]
-        if keys:
-            key = keys.pop(0)
-            self._save()
-            return key
-        return None
+        keys = self.take_keys(seller_id, 1)
+        return keys[0] if keys else None
     
     def get_keys_count(self, seller_id: str) -> int:
         return len(self.data["sellers"][seller_id]["keys"])
     
+    # === РЕЕСТР КЛЮЧЕЙ ===
+    # Сами ключи хранятся только на складах (KeyInventory) и в журнале
+    # покупок, индекс держит их хэши (KeyIndex): выпущенные ключи и
+    # смещения строк журнала с проданными. Отозванные ключи хранятся в
+    # revoked_keys: ключ -> {"seller_id", "revoked_at"}.
+    def _get_key_index(self) -> KeyIndex:
+        """Строит индекс по журналу покупок, складам и отозванным ключам,
+        дальше только догоняет журнал покупок"""
+        if self._key_index is not None:
+            self._index_ledger()
+            return self._key_index
+        self._key_index = KeyIndex()
+        self._ledger_indexed = 0
+        self._ledger_open = {}
+        self._index_ledger()
+        index = self._key_index
+        for seller_id, seller in self.data["sellers"].items():
+            index.issued.update(map(key_digest, seller["keys"]))
+            index.add_stock(seller_id, seller["keys"])
+        index.issued.update(map(key_digest, self.data["revoked_keys"]))
+        return index
+    
+    def _index_ledger(self):
+        """Догоняет индекс ключей по журналу покупок с места, где остановился.
+        
+        Так в индекс попадают и покупки других процессов. Строка по платежу
+        ждёт своей отметки commit в _ledger_open.
+        """
+        index = self._key_index
+        pending = self._ledger_open
+        issued = []
+        sold = []
+        for pos, record, end in self.ledger.scan(self._ledger_indexed):
+            self._ledger_indexed = end
+            if "commit" in record:
+                purchase = pending.pop(record["commit"], None)
+            elif "abort" in record:
+                pending.pop(record["abort"], None)
+                purchase = None
+            else:
+                issued += map(key_digest, record["keys"])
+                purchase = (pos, record["keys"])
+                if record.get("payment_id") and record["payment_id"] not in self._unmarked:
+                    pending[record["payment_id"]] = purchase
+                    purchase = None
+            if purchase:
+                start, keys = purchase
+                sold += (index.sold_code(key, start) for key in keys)
+        index.issued.update(issued)
+        index.sold.update(sold)
+    
+    def _find_sale(self, key: str) -> Optional[Dict]:
+        """Последняя сохранённая покупка с этим ключом"""
+        for pos in self._get_key_index().sold_offsets(key):
+            record = self.ledger.read_at(pos)
+            if key in record["keys"]:
+                return record
+        return None
+    
+    def _find_stock(self, key: str) -> tuple:
+        """(продавец, позиция в очереди) ключа на складе или (None, None)"""
+        index = self._get_key_index()
+        for seller_id, seller in self.data["sellers"].items():
+            inventory = seller["keys"]
+            for number in index.stock_numbers(seller_id, key):
+                if inventory.key_at(number) == key:
+                    return seller_id, inventory.position(number)
+        return None, None
+    
+    def get_key_info(self, key: str) -> Optional[Dict]:
+        """Кто продаёт ключ, в каком он состоянии и кому продан; None - ключ не выпускался"""
+        if not self._get_key_index().is_issued(key):
+            return None
+        # Склад перекрывает журнал покупок: ключ, снова добавленный продавцу, в продаже
+        seller_id = self._find_stock(key)[0]
+        user_id = sold_at = None
+        if seller_id is None:
+            purchase = self._find_sale(key)
+            if purchase:
+                seller_id, user_id, sold_at = purchase["seller_id"], purchase["user_id"], purchase["date"]
+        revoked = self.data["revoked_keys"].get(key, {})
+        if seller_id is None:
+            # Отозванные непроданные ключи уже убраны со склада
+            seller_id = revoked.get("seller_id")
+            if seller_id is None:
+                return None
+        revoked_at = revoked.get("revoked_at")
+        if revoked_at:
+            status = "revoked"
+        elif user_id is not None:
+            status = "sold"
+        else:
+            status = "in_stock"
+        return {
+            "key": key,
+            "seller_id": seller_id,
+            "status": status,
+            "user_id": user_id,
+            "sold_at": sold_at,
+            "revoked_at": revoked_at
+        }
+    
+    @mutation
+    def revoke_key(self, key: str) -> Optional[Dict]:
+        """Отзывает ключ: непроданный убирается со склада. Возвращает новое состояние или None"""
+        info = self.get_key_info(key)
+        if info is None or info["status"] == "revoked":
+            return info
+        ops = []
+        if info["status"] == "in_stock":
+            seller_id, position = self._find_stock(key)
+            if position is not None:
+                del self.data["sellers"][seller_id]["keys"][position]
+                self.catalog_version += 1
+                ops.append(["del", ["sellers", info["seller_id"], "keys", position]])
+        revoked = {"seller_id": info["seller_id"], "revoked_at": datetime.now().isoformat()}
+        self.data["revoked_keys"][key] = revoked
+        ops.append(["set", ["revoked_keys", key], revoked])
+        self._commit(*ops)
+        return dict(info, status="revoked", revoked_at=revoked["revoked_at"])
+    
     # === ОТЗЫВЫ ===
+    # Отзывы хранятся списком в порядке добавления. Удалённые остаются
+    # на своих местах как {"id": ..., "deleted": true}, чтобы позиции
+    # в индексе и в журнале не сдвигались; вырезаются при записи снимка,
+    # а при работе с журналом - только синхронной, которая его поглощает.
+    REVIEW_TOMBSTONES_MAX = 100
+    
+    @mutation
     def add_review(self, user_id: int, text: str, username: str = None):
+        meta = self.data["meta"]
+        meta["review_seq"] += 1
         review = {
-            "id": len(self.data["reviews"]) + 1,
+            "id": meta["review_seq"],
             "user_id": user_id,
             "username": username,
             "text": text,
             "date": datetime.now().isoformat()
         }
+        self._review_pos[review["id"]] = len(self.data["reviews"])
         self.data["reviews"].append(review)
-        self._save()
+        self._commit(["set", ["meta", "review_seq"], meta["review_seq"]], ["push", ["reviews"], [review]])
         return review["id"]
     
+    @mutation
     def delete_review(self, review_id: int):
-        self.data["reviews"] = [r for r in self.data["reviews"] if r["id"] != review_id]
-        self._save()
+        pos = self._review_pos.pop(review_id, None)
+        if pos is None:
+            return
+        tombstone = {"id": review_id, "deleted": True}
+        self.data["reviews"][pos] = tombstone
+        self._review_tombstones += 1
+        self._commit(["set", ["reviews", pos], tombstone])
     
+    @mutation
     def edit_review(self, review_id: int, new_text: str):
-        for r in self.data["reviews"]:
-            if r["id"] == review_id:
-                r["text"] = new_text
-                r["edited"] = datetime.now().isoformat()
-                self._save()
-                return True
-        return False
+        pos = self._review_pos.get(review_id)
+        if pos is None:
+            return False
+        r = self.data["reviews"][pos]
+        r["text"] = new_text
+        r["edited"] = datetime.now().isoformat()
+        self._commit(["set", ["reviews", pos], r])
+        return True
     
-    def get_reviews(self) -> List[Dict]:
-        return self.data["reviews"][-20:]  # Последние 20
+    def get_reviews(self, limit: int = 20) -> List[Dict]:
+        """Последние limit отзывов, от старых к новым"""
+        result = []
+        reviews = self.data["reviews"]
+        for i in range(len(reviews) - 1, -1, -1):
+            if len(result) == limit:
+                break
+            if not reviews[i].get("deleted"):
+                result.append(reviews[i])
+        result.reverse()
+        return result
     
     def get_review_by_id(self, review_id: int) -> Dict:
-        for r in self.data["reviews"]:
-            if r["id"] == review_id:
-                return r
-        return None
+        pos = self._review_pos.get(review_id)
+        return self.data["reviews"][pos] if pos is not None else None
+    
+    def _index_reviews(self):
+        self._review_pos = {}
+        self._review_tombstones = 0
+        for pos, r in enumerate(self.data["reviews"]):
+            self._index_review(pos, r)
+    
+    def _index_review(self, pos: int, review: Dict):
+        if review.get("deleted"):
+            self._review_tombstones += 1
+        else:
+            self._review_pos[review["id"]] = pos
+    
+    def _compacted_reviews(self) -> Optional[List[Dict]]:
+        """Отзывы без удалённых или None, если вырезать пока рано"""
+        if not self.data.is_loaded("reviews") or self._review_tombstones <= self.REVIEW_TOMBSTONES_MAX:
+            return None
+        return [r for r in self.data["reviews"] if not r.get("deleted")]
+    
+    def _set_reviews(self, reviews: List[Dict]):
+        self.data["reviews"] = reviews
+        self._index_reviews()
+        self._invalidate([["set", ["reviews"]]])
     
     # === ТЕХПОДДЕРЖКА ===
+    # В data["tickets"] ключи всегда строки (как после загрузки JSON),
+    # снаружи ID тикета - int.
+    @mutation
     def create_ticket(self, user_id: int, message: str) -> int:
-        ticket_id = len(self.data["tickets"]) + 1
-        self.data["tickets"][ticket_id] = {
+        meta = self.data["meta"]
+        meta["ticket_seq"] += 1
+        ticket_id = meta["ticket_seq"]
+        ticket = {
             "user_id": user_id,
             "message": message,
             "status": "open",
             "created": datetime.now().isoformat(),
             "responses": []
         }
-        self._save()
+        self.data["tickets"][str(ticket_id)] = ticket
+        self._index_ticket(ticket_id, ticket)
+        self._commit(["set", ["meta", "ticket_seq"], ticket_id], ["set", ["tickets", str(ticket_id)], ticket])
         return ticket_id
     
+    def _index_ticket(self, ticket_id: int, ticket: Dict):
+        if ticket["status"] == "open":
+            self._open_tickets[ticket_id] = ticket
+        self._tickets_by_user.setdefault(ticket["user_id"], []).append(ticket_id)
+    
     def get_ticket(self, ticket_id: int) -> Dict:
-        return self.data["tickets"].get(ticket_id)
+        return self.data["tickets"].get(str(ticket_id))
     
+    @mutation
     def add_response(self, ticket_id: int, admin_id: int, text: str):
-        if ticket_id in self.data["tickets"]:
-            self.data["tickets"][ticket_id]["responses"].append({
+        ticket = self.get_ticket(ticket_id)
+        if ticket:
+            response = {
                 "admin_id": admin_id,
                 "text": text,
                 "date": datetime.now().isoformat()
-            })
-            self._save()
+            }
+            ticket["responses"].append(response)
+            self._commit(["push", ["tickets", str(ticket_id), "responses"], [response]])
     
+    @mutation
     def close_ticket(self, ticket_id: int):
-        if ticket_id in self.data["tickets"]:
-            self.data["tickets"][ticket_id]["status"] = "closed"
-            self._save()
+        ticket = self.get_ticket(ticket_id)
+        if ticket and ticket["status"] != "closed":
+            ticket["status"] = "closed"
+            self._open_tickets.pop(ticket_id, None)
+            self._commit(["set", ["tickets", str(ticket_id), "status"], "closed"])
     
     def get_open_tickets(self) -> Dict:
-        return {k: v for k, v in self.data["tickets"].items() if v["status"] == "open"}
+        return dict(self._open_tickets)
+    
+    def get_user_tickets(self, user_id: int) -> Dict:
+        """Тикеты пользователя: ID -> тикет"""
+        return {tid: self.data["tickets"][str(tid)] for tid in self._tickets_by_user.get(user_id, [])}
     
     # === ПЛАТЕЖИ ===
+    @mutation
     def create_payment(self, user_id: int, seller_id: str, amount: float, quantity: int) -> str:
-        payment_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=12))
+        payment_id = generate_payment_id()
         self.data["pending_payments"][payment_id] = {
             "user_id": user_id,
             "seller_id": seller_id,
@@ -183,25 +1113,242 @@ class Database:
             "status": "pending",
             "created": datetime.now().isoformat()
         }
-        self._save()
+        self._pending[payment_id] = self.data["pending_payments"][payment_id]
+        self._commit(["set", ["pending_payments", payment_id], self.data["pending_payments"][payment_id]])
         return payment_id
     
     def get_payment(self, payment_id: str) -> Dict:
         return self.data["pending_payments"].get(payment_id)
     
+    def get_pending_payments(self) -> Dict:
+        return dict(self._pending)
+    
+    @mutation
+    def mark_payment_paid(self, payment_id: str) -> bool:
+        """Отмечает, что покупатель сообщил об оплате; такой заказ не истекает.
+        
+        Возвращает False, если заказа нет среди ожидающих.
+        """
+        payment = self._pending.get(payment_id)
+        if payment is None:
+            return False
+        if "paid_at" not in payment:
+            payment["paid_at"] = datetime.now().isoformat()
+            self._commit(["set", ["pending_payments", payment_id, "paid_at"], payment["paid_at"]])
+        return True
+    
+    @mutation
     def confirm_payment(self, payment_id: str):
-        if payment_id in self.data["pending_payments"]:
-            self.data["pending_payments"][payment_id]["status"] = "confirmed"
-            self._save()
+        """Подтверждает платёж без выдачи ключей: он уходит в архив"""
+        payment = self._pending.pop(payment_id, None)
+        if payment:
+            self._archive_payments([payment], [payment_id], status="confirmed")
+            del self.data["pending_payments"][payment_id]
+            self._commit(["del", ["pending_payments", payment_id]], *self._count_sale(payment))
     
-    def add_purchase(self, user_id: int, seller_id: str, keys: list, amount: float):
-        purchase = {
+    @mutation
+    def fulfill_payment(self, payment_id: str) -> Dict:
+        """Выдаёт ключи по оплате одной транзакцией.
+        
+        Проверка статуса, списание ключей, запись покупки и удаление
+        платежа из ожидающих происходят без await и сохраняются одной
+        записью, поэтому ключи не выдаются дважды и не теряются при сбое.
+        Подтверждённый платёж живёт дальше только строкой журнала покупок:
+        повторный вызов возвращает выданные ключи оттуда.
+        
+        Возвращает {"status": ..., "payment": ..., "keys": ...}, где status:
+        "confirmed", "already_confirmed", "not_enough" (есть "have") или "not_found".
+        """
+        payment = self.data["pending_payments"].get(payment_id)
+        if not payment:
+            purchase = self.ledger.find(payment_id)
+            if purchase is None:
+                return {"status": "not_found"}
+            payment = {
+                "user_id": purchase["user_id"],
+                "seller_id": purchase["seller_id"],
+                "amount": purchase["amount"],
+                "quantity": len(purchase["keys"]),
+                "status": "confirmed"
+            }
+            return {"status": "already_confirmed", "payment": payment, "keys": purchase["keys"]}
+        seller = self.data["sellers"].get(payment["seller_id"])
+        have = len(seller["keys"]) if seller else 0
+        if have < payment["quantity"]:
+            return {"status": "not_enough", "payment": payment, "have": have}
+        if self._lock:
+            # Покупку мог оборвать упавший соседний процесс
+            self._settle_ledger()
+        
+        keys = seller["keys"].take(payment["quantity"])
+        self.catalog_version += 1
+        payment["status"] = "confirmed"
+        self._pending.pop(payment_id, None)
+        del self.data["pending_payments"][payment_id]
+        ops = [
+            ["shift", ["sellers", payment["seller_id"], "keys"], len(keys)],
+            ["del", ["pending_payments", payment_id]]
+        ]
+        ops += self._count_sale(payment)
+        # Строка журнала покупок пишется до коммита, отметка commit - после:
+        # если коммит не случится, строка так и не будет засчитана
+        ops += self._record_purchase(
+            payment["user_id"], payment["seller_id"], keys, payment["amount"], payment_id
+        )
+        self._commit(*ops)
+        self._mark_committed(payment_id)
+        return {"status": "confirmed", "payment": payment, "keys": keys}
+    
+    def _count_sale(self, payment: Dict) -> List[list]:
+        """Выручка и продажи продавца в meta, возвращает операции"""
+        seller_id = payment["seller_id"]
+        meta = self.data["meta"]
+        meta["revenue"][seller_id] = meta["revenue"].get(seller_id, 0.0) + payment["amount"]
+        meta["sales"][seller_id] = meta["sales"].get(seller_id, 0) + payment["quantity"]
+        return [
+            ["set", ["meta", "revenue", seller_id], meta["revenue"][seller_id]],
+            ["set", ["meta", "sales", seller_id], meta["sales"][seller_id]]
+        ]
+    
+    def _archive_payments(self, payments: List[Dict], payment_ids: List[str], status: str = None):
+        """Дописывает платежи в архив (.payments_archive.jsonl)"""
+        if not payment_ids:
+            return
+        with open(self.path + ".payments_archive.jsonl", 'a', encoding='utf-8') as f:
+            for payment, payment_id in zip(payments, payment_ids):
+                record = dict(payment, id=payment_id)
+                if status:
+                    record["status"] = status
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    
+    @mutation
+    def expire_payments(self, max_age: float, limit: int = 500) -> int:
+        """Переносит в архив до limit неоплаченных заказов старше max_age секунд.
+        
+        Ожидающие платежи лежат в индексе в порядке создания, поэтому
+        обход останавливается на первом непросроченном. Заказы, об оплате
+        которых сообщил покупатель (paid_at), ждут решения админа и не истекают.
+        """
+        cutoff = (datetime.now() - timedelta(seconds=max_age)).isoformat()
+        expired = []
+        for payment_id, payment in self._pending.items():
+            if len(expired) == limit or payment["created"] >= cutoff:
+                break
+            if "paid_at" not in payment:
+                expired.append(payment_id)
+        if not expired:
+            return 0
+        self._archive_payments([self._pending[pid] for pid in expired], expired, status="expired")
+        for payment_id in expired:
+            del self._pending[payment_id]
+            del self.data["pending_payments"][payment_id]
+        self._commit(*[["del", ["pending_payments", payment_id]] for payment_id in expired])
+        return len(expired)
+    
+    # === ПОКУПКИ ===
+    def _record_purchase(self, user_id: int, seller_id: str, keys: list, amount: float,
+                         payment_id: str = None) -> List[list]:
+        """Дописывает покупку в журнал покупок, возвращает операции счётчиков"""
+        date = datetime.now().isoformat()
+        pos = self.ledger.append({
+            "user_id": user_id,
             "seller_id": seller_id,
             "keys": keys,
             "amount": amount,
-            "date": datetime.now().isoformat()
+            "date": date,
+            "payment_id": payment_id
+        })
+        ops = []
+        if payment_id:
+            # Строки до этой уже отмечены, после сбоя проверяются только следующие
+            self.data["meta"]["ledger_checked"] = pos
+            ops.append(["set", ["meta", "ledger_checked"], pos])
+        user = self._users_by_id.get(user_id)
+        if user is not None:
+            user["purchase_count"] = user.get("purchase_count", 0) + 1
+            ops.append(["set", ["users", str(user_id), "purchase_count"], user["purchase_count"]])
+        return ops
+    
+    @mutation
+    def add_purchase(self, user_id: int, seller_id: str, keys: list, amount: float):
+        ops = self._record_purchase(user_id, seller_id, keys, amount)
+        if ops:
+            self._commit(*ops)
+    
+    def get_purchase_count(self, user_id: int) -> int:
+        user = self._users_by_id.get(user_id)
+        return user.get("purchase_count", 0) if user else 0
+    
+    def get_purchases(self, user_id: int, offset: int = 0, limit: int = 10) -> List[Dict]:
+        """История покупок от новых к старым, постранично"""
+        return self.ledger.read(user_id, offset, limit)
+
+    # === СТАТИСТИКА ===
+    def get_stats(self) -> Dict:
+        """Сводка для админки из поддерживаемых индексов и счётчиков"""
+        return {
+            "users": len(self._users_by_id),
+            "open_tickets": len(self._open_tickets),
+            "pending_payments": len(self._pending),
+            "stock": {sid: len(s["keys"]) for sid, s in self.data["sellers"].items()},
+            "revenue": dict(self.data["meta"]["revenue"]),
+            "sales": dict(self.data["meta"]["sales"])
+        }
+    
+    # === РАССЫЛКИ ===
+    @mutation
+    def create_broadcast(self, text: str) -> int:
+        meta = self.data["meta"]
+        meta["broadcast_seq"] += 1
+        broadcast_id = meta["broadcast_seq"]
+        broadcast = {
+            "text": text,
+            "status": "running",
+            "cursor": 0,
+            "sent": 0,
+            "failed": 0,
+            "created": datetime.now().isoformat()
         }
-        self.data["users"][str(user_id)]["purchases"].append(purchase)
-        self._save()
+        self.data["broadcasts"][str(broadcast_id)] = broadcast
+        self._commit(["set", ["meta", "broadcast_seq"], broadcast_id], ["set", ["broadcasts", str(broadcast_id)], broadcast])
+        return broadcast_id
+    
+    def get_broadcast(self, broadcast_id: int) -> Dict:
+        return self.data["broadcasts"].get(str(broadcast_id))
+    
+    @mutation
+    def update_broadcast(self, broadcast_id: int, **fields):
+        broadcast = self.get_broadcast(broadcast_id)
+        if broadcast:
+            broadcast.update(fields)
+            self._commit(*[["set", ["broadcasts", str(broadcast_id), k], v] for k, v in fields.items()])
+    
+    def get_unfinished_broadcasts(self) -> Dict:
+        return {int(bid): b for bid, b in self.data["broadcasts"].items() if b["status"] == "running"}
+    
+    # === НЕДОСТАВЛЕННЫЕ СООБЩЕНИЯ ===
+    @mutation
+    def add_dead_letter(self, letter: Dict):
+        self.data["dead_letters"].append(letter)
+        self._commit(["push", ["dead_letters"], [letter]])
+    
+    def get_dead_letters(self) -> List[Dict]:
+        return self.data["dead_letters"]
+    
+    @mutation
+    def pop_dead_letters(self) -> List[Dict]:
+        """Забирает все недоставленные сообщения (для повторной отправки)"""
+        letters = self.data["dead_letters"]
+        self.data["dead_letters"] = []
+        self._commit(["set", ["dead_letters"], []])
+        return letters
+
+def create_database():
+    """Создаёт хранилище согласно cfg.DB_BACKEND"""
+    if cfg.DB_BACKEND == "sqlite":
+        return SQLiteDatabase(cfg.SQLITE_FILE)
+    # Нескольким процессам нужен общий журнал, остальные режимы
+    # рассчитаны на единственного писателя
+    return Database(persist="shared" if cfg.WORKERS > 1 else cfg.DB_PERSIST)
 
-db = Database()
\ No newline at end of file
+db = create_database()
\ No newline at end of file
@@ -0,0 +1,100 @@
+import json
+import sqlite3
+import time
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm(updated);
+"""
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище на SQLite с кэшем в памяти.
+
+    Чтения обслуживаются из кэша (read-through: промах один раз читает
+    строку из базы), записи сразу уходят в базу, поэтому незавершённые
+    сценарии админки и техподдержки переживают перезапуск. Пустые записи
+    (нет состояния и данных) в базе не хранятся. Брошенные состояния
+    старше ttl удаляет cleanup(). Когда хранилище делят несколько
+    процессов, кэш отключается (cache=False) - каждое чтение идёт в базу.
+    """
+
+    def __init__(self, path: str, ttl: float, cache: bool = True):
+        self.path = path
+        self.ttl = ttl
+        self.cache = cache
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        # ключ -> [состояние, данные, время изменения]
+        self._cache: Dict[StorageKey, list] = {}
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:{key.business_connection_id}:{key.destiny}"
+
+    def _record(self, key: StorageKey) -> list:
+        record = self._cache.get(key)
+        if record is None:
+            row = self.conn.execute(
+                "SELECT state, data, updated FROM fsm WHERE key = ?", (self._key(key),)
+            ).fetchone()
+            record = [row[0], json.loads(row[1]), row[2]] if row else [None, {}, 0.0]
+            if self.cache:
+                self._cache[key] = record
+        return record
+
+    def _write(self, key: StorageKey, record: list):
+        record[2] = time.time()
+        with self.conn:
+            if record[0] is None and not record[1]:
+                self.conn.execute("DELETE FROM fsm WHERE key = ?", (self._key(key),))
+            else:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO fsm (key, state, data, updated) VALUES (?, ?, ?, ?)",
+                    (self._key(key), record[0], json.dumps(record[1], ensure_ascii=False), record[2])
+                )
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = self._record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._write(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._record(key)[0]
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        record = self._record(key)
+        record[1] = data.copy()
+        self._write(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return self._record(key)[1].copy()
+
+    def cleanup(self) -> int:
+        """Удаляет брошенные состояния старше ttl, возвращает их число"""
+        deadline = time.time() - self.ttl
+        with self.conn:
+            removed = self.conn.execute("DELETE FROM fsm WHERE updated < ?", (deadline,)).rowcount
+        # Пустые записи в кэше - только память, их дешевле перечитать
+        self._cache = {
+            key: record for key, record in self._cache.items()
+            if record[2] >= deadline and (record[0] is not None or record[1])
+        }
+        return removed
+
+    async def close(self) -> None:
+        self.conn.close()
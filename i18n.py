@@ -0,0 +1,382 @@
+from functools import lru_cache
+
+# === ЛОКАЛИЗАЦИЯ ===
+TEXTS = {
+    "ru": {
+        # === Главное меню ===
+        "welcome": "👋 Добро пожаловать в P2E Keys Shop!\n\n🔑 Здесь вы можете купить ключи для Play-to-Earn игр\n💰 Оплата принимается в USDT (TRC20)\n\nВыберите действие:",
+        "choose_language": "🌍 Выберите язык / Choose language:",
+        "language_set": "✅ Язык установлен: Русский",
+        "main_menu": "Главное меню:",
+        
+        # Кнопки (с эмодзи)
+        "sellers": "🛒 Продавцы",
+        "reviews": "⭐ Отзывы",
+        "support": "🆘 ТехПоддержка",
+        "settings": "⚙️ Настройки",
+        "admin_panel": "🔐 Админ панель",
+        "back": "🔙 Назад",
+        "cancel": "🔙 Отмена",
+        "i_paid": "✅ Я оплатил",
+        
+        # === Продавцы ===
+        "select_seller": "Выберите продавца:\n\n",
+        "no_sellers": "Нет доступных продавцов!",
+        "price": "Цена",
+        "keys_available": "Ключей в наличии",
+        "keys": "ключей",
+        "how_many": "Сколько ключей хотите купить?",
+        "available": "Доступно",
+        "order": "Заказ",
+        "quantity": "Количество",
+        "total": "Сумма к оплате",
+        "payment_details": "Реквизиты для оплаты USDT (TRC20):",
+        "payment_id": "ID платежа",
+        "after_payment": "После оплаты нажмите кнопку ниже.\nАдминистратор проверит платеж и вышлет ключи.",
+        
+        # === Платежи ===
+        "payment_not_found": "Платеж не найден!",
+        "new_payment": "Новая оплата!",
+        "user": "Пользователь",
+        "seller": "Продавец",
+        "amount": "Сумма",
+        "waiting_confirm": "Ожидаем подтверждения администратора...",
+        "admin_notified": "Администратор уведомлен!",
+        "payment_confirmed": "Оплата подтверждена!",
+        "your_keys": "Ваши ключи ({count} шт.):",
+        "save_keys": "Сохраните их! Покажите это сообщение при входе в игру.",
+        "pending_payments": "Ожидают подтверждения:",
+        "no_pending": "Нет ожидающих платежей.",
+        "confirm_usage": "Для подтверждения отправьте:\n/confirm [PAYMENT_ID]",
+        "already_paid": "Платеж не найден или уже подтвержден!",
+        "not_enough_keys": "Недостаточно ключей! Нужно {need}, есть {have}",
+        "key_error": "Ошибка при выдаче ключей!",
+        
+        # === Отзывы ===
+        "no_reviews": "Пока нет отзывов. Будьте первым!",
+        "latest_reviews": "Последние отзывы:",
+        "edited": "(изменено)",
+        
+        # === Поддержка ===
+        "support_title": "Техническая поддержка",
+        "support_desc": "Опишите вашу проблему или вопрос одним сообщением.\nМы ответим вам как можно скорее!",
+        "ticket_created": "Ваше обращение #{ticket_id} принято!\nМы ответим вам в ближайшее время.",
+        "new_ticket": "Новый тикет #{ticket_id}",
+        "from_user": "От",
+        "message": "Сообщение",
+        "reply_cmd": "Для ответа",
+        "close_cmd": "Для закрытия",
+        "reply_support": "Ответ поддержки по тикету #{ticket_id}:",
+        "no_tickets": "Нет открытых тикетов.",
+        "open_tickets": "Открытые тикеты:",
+        "ticket_not_found": "Тикет не найден!",
+        "ticket_closed": "Тикет #{ticket_id} закрыт",
+        "reply_sent": "Ответ отправлен пользователю {user_id}",
+        "error_sending": "Ошибка отправки",
+        
+        # === Настройки ===
+        "settings_title": "Ваши настройки",
+        "your_id": "ID",
+        "username": "Username",
+        "purchases": "Покупок",
+        "wallet": "Кошелек для выплат",
+        "purchase_history": "История покупок",
+        "no_purchases": "Покупок пока нет",
+        "not_set": "Не установлен",
+        
+        # === Ошибки и валидация ===
+        "invalid_seller": "Некорректный ID продавца!",
+        "seller_not_found": "Продавец не найден!",
+        "out_of_stock": "Ключи закончились!",
+        "invalid_price": "Цена должна быть больше 0!",
+        "enter_number": "Введите число!",
+        "invalid_range": "Введите число от 1 до {max}!",
+        "id_empty": "ID не может быть пустым! Используйте только латинские буквы и цифры.",
+        "id_short": "ID слишком короткий (минимум 3 символа)!",
+        "id_exists": "Такой ID уже существует! Введите другой:",
+        
+        # === Успешные действия ===
+        "seller_added": "Продавец добавлен!",
+        "seller_deleted": "Продавец удален!",
+        "review_added": "Отзыв #{review_id} добавлен!",
+        "review_updated": "Отзыв #{review_id} обновлен!",
+        "review_deleted": "Отзыв #{review_id} удален!",
+        "keys_generated": "Сгенерировано {count} ключей!",
+        "keys_sent": "Ключи отправлены пользователю {user_id}",
+        "keys_not_delivered": "❌ Ключи по заказу {payment_id} не доставлены пользователю {user_id}: {error}\nПовторить отправку: /dead_letters retry",
+        
+        # === Админ панель ===
+        "admin_panel_title": "Административная панель",
+        "reviews_management": "Управление отзывами",
+        "choose_action": "Выберите действие:",
+        
+        # Кнопки админки
+        "stats_btn": "📊 Статистика",
+        "add_seller_btn": "➕ Добавить продавца",
+        "delete_seller_btn": "➖ Удалить продавца",
+        "reviews_btn": "📝 Управление отзывами",
+        "tickets_btn": "📩 Тикеты поддержки",
+        "gen_keys_btn": "🔑 Генерировать ключи",
+        "confirm_btn": "✅ Подтвердить оплату",
+        "add_review": "➕ Добавить отзыв",
+        "edit_review": "✏️ Редактировать отзыв",
+        "delete_review": "🗑️ Удалить отзыв",
+        "back_to_admin": "🔙 Назад в админку",
+        
+        # === Формы ===
+        "enter_seller_id": "Шаг 1/3: Введите ID продавца (только латинские буквы, цифры и _)\nНапример: seller_vip, super_keys, megashop",
+        "enter_seller_name": "Шаг 2/3: Введите название продавца (с эмодзи):",
+        "enter_price": "Шаг 3/3: Введите цену за ключ (число, например 2.5):",
+        "enter_review_user": "Шаг 1/2: Введите ID пользователя (или @username):",
+        "enter_review_text": "Шаг 2/2: Введите текст отзыва:",
+        "select_review_edit": "Выберите отзыв для редактирования:",
+        "select_review_delete": "Выберите отзыв для удаления:",
+        "enter_new_text": "Введите новый текст:",
+        "current_text": "Текущий текст",
+        "how_many_keys": "Сколько ключей сгенерировать? (введите число от 1 до {max}):",
+        "select_seller_gen": "Выберите продавца для генерации ключей:",
+        "select_seller_delete": "Выберите продавца для удаления:",
+        
+        # === Статистика ===
+        "stats": "Статистика бота",
+        "users_count": "Пользователей",
+        "total_keys": "Всего ключей",
+        "pending_payments_count": "Ожидают оплаты",
+        "revenue": "Выручка",
+        "sold": "продано",
+        
+        # === Прочее ===
+        "no_sellers_delete": "Нет продавцов для удаления!",
+        "no_reviews_edit": "Нет отзывов для редактирования!",
+        "no_reviews_delete": "Нет отзывов для удаления!",
+        "review_not_found": "Отзыв не найден!",
+        "update_error": "Ошибка при обновлении!",
+        "first_three": "Первые 3",
+        "name": "Название",
+        "piece": "шт.",
+        "for": "за",
+        "pcs": "шт.",
+        "confirm_usage_cmd": "Использование: /confirm [PAYMENT_ID]",
+        "reply_usage": "Использование: /reply [TICKET_ID] [текст]",
+        "close_usage": "Использование: /close [TICKET_ID]",
+        "broadcast_usage": "Использование: /broadcast [текст]\nОстановить: /broadcast_stop [ID]",
+        "broadcast_started": "📣 Рассылка #{broadcast_id} запущена",
+        "broadcast_stopped": "⏹ Рассылка #{broadcast_id} остановлена",
+        "broadcast_not_running": "Рассылка не найдена или уже завершена",
+        "broadcast_report": "📣 Рассылка #{broadcast_id}: {status}\n✅ Доставлено: {sent}\n❌ Ошибок: {failed}\n⚡ Скорость: {rate:.1f} сообщ./с",
+        "dead_letters_info": "📭 Недоставлено сообщений: {count}\n📤 В очереди: {pending}\nПовторить отправку: /dead_letters retry",
+        "dead_letters_requeued": "🔁 Повторно поставлено в очередь: {count}",
+        "key_usage": "Использование: /key [КЛЮЧ]\nОтозвать: /key [КЛЮЧ] revoke",
+        "key_not_found": "❌ Такой ключ не выпускался",
+        "key_info": "🔑 {key}\n🏪 Продавец: {seller}\n📌 Статус: {status}",
+        "key_owner": "👤 Покупатель: {user} ({user_id})\n📅 Продан: {sold_at}",
+        "key_revoked_at": "🚫 Отозван: {revoked_at}",
+        "key_status_in_stock": "на складе",
+        "key_status_sold": "продан",
+        "key_status_revoked": "отозван",
+        "import_usage": "Использование: /import_keys [SELLER_ID], затем отправьте файл",
+        "import_send_file": "📄 Отправьте файл с ключами (TXT или CSV, по ключу XXXXXXXXXX:xxxxxxxx в строке)",
+        "import_too_big": "❌ Файл больше 20 МБ. Загрузите его на сервер и запустите: python key_import.py [SELLER_ID] [файл]",
+        "import_started": "⏳ Импорт запущен...",
+        "import_done": "✅ Импорт завершён\n📄 Строк: {lines}\n➕ Добавлено: {added}\n🔁 Повторов: {duplicates}\n⚠️ Неверный формат: {invalid}"
+    },
+    "en": {
+        # === Main Menu ===
+        "welcome": "👋 Welcome to P2E Keys Shop!\n\n🔑 Here you can buy keys for Play-to-Earn games\n💰 Payment accepted in USDT (TRC20)\n\nChoose an action:",
+        "choose_language": "🌍 Choose language / Выберите язык:",
+        "language_set": "✅ Language set: English",
+        "main_menu": "Main menu:",
+        
+        # Buttons (with emoji)
+        "sellers": "🛒 Sellers",
+        "reviews": "⭐ Reviews",
+        "support": "🆘 Support",
+        "settings": "⚙️ Settings",
+        "admin_panel": "🔐 Admin Panel",
+        "back": "🔙 Back",
+        "cancel": "🔙 Cancel",
+        "i_paid": "✅ I paid",
+        
+        # === Sellers ===
+        "select_seller": "Select a seller:\n\n",
+        "no_sellers": "No sellers available!",
+        "price": "Price",
+        "keys_available": "Keys available",
+        "keys": "keys",
+        "how_many": "How many keys do you want to buy?",
+        "available": "Available",
+        "order": "Order",
+        "quantity": "Quantity",
+        "total": "Total to pay",
+        "payment_details": "Payment details for USDT (TRC20):",
+        "payment_id": "Payment ID",
+        "after_payment": "After payment, click the button below.\nAdministrator will verify and send the keys.",
+        
+        # === Payments ===
+        "payment_not_found": "Payment not found!",
+        "new_payment": "New payment!",
+        "user": "User",
+        "seller": "Seller",
+        "amount": "Amount",
+        "waiting_confirm": "Waiting for administrator confirmation...",
+        "admin_notified": "Administrator notified!",
+        "payment_confirmed": "Payment confirmed!",
+        "your_keys": "Your keys ({count} pcs.):",
+        "save_keys": "Save them! Show this message when entering the game.",
+        "pending_payments": "Pending confirmation:",
+        "no_pending": "No pending payments.",
+        "confirm_usage": "To confirm send:\n/confirm [PAYMENT_ID]",
+        "already_paid": "Payment not found or already confirmed!",
+        "not_enough_keys": "Not enough keys! Need {need}, have {have}",
+        "key_error": "Error issuing keys!",
+        
+        # === Reviews ===
+        "no_reviews": "No reviews yet. Be the first!",
+        "latest_reviews": "Latest reviews:",
+        "edited": "(edited)",
+        
+        # === Support ===
+        "support_title": "Technical Support",
+        "support_desc": "Describe your problem or question in one message.\nWe will reply as soon as possible!",
+        "ticket_created": "Your ticket #{ticket_id} has been received!\nWe will reply soon.",
+        "new_ticket": "New ticket #{ticket_id}",
+        "from_user": "From",
+        "message": "Message",
+        "reply_cmd": "To reply",
+        "close_cmd": "To close",
+        "reply_support": "Support reply for ticket #{ticket_id}:",
+        "no_tickets": "No open tickets.",
+        "open_tickets": "Open tickets:",
+        "ticket_not_found": "Ticket not found!",
+        "ticket_closed": "Ticket #{ticket_id} closed",
+        "reply_sent": "Reply sent to user {user_id}",
+        "error_sending": "Error sending",
+        
+        # === Settings ===
+        "settings_title": "Your Settings",
+        "your_id": "ID",
+        "username": "Username",
+        "purchases": "Purchases",
+        "wallet": "Payout wallet",
+        "purchase_history": "Purchase history",
+        "no_purchases": "No purchases yet",
+        "not_set": "Not set",
+        
+        # === Errors & Validation ===
+        "invalid_seller": "Invalid seller ID!",
+        "seller_not_found": "Seller not found!",
+        "out_of_stock": "Out of stock!",
+        "invalid_price": "Price must be greater than 0!",
+        "enter_number": "Please enter a number!",
+        "invalid_range": "Enter a number from 1 to {max}!",
+        "id_empty": "ID cannot be empty! Use latin letters and numbers only.",
+        "id_short": "ID too short (minimum 3 characters)!",
+        "id_exists": "This ID already exists! Enter another:",
+        
+        # === Success Actions ===
+        "seller_added": "Seller added!",
+        "seller_deleted": "Seller deleted!",
+        "review_added": "Review #{review_id} added!",
+        "review_updated": "Review #{review_id} updated!",
+        "review_deleted": "Review #{review_id} deleted!",
+        "keys_generated": "Generated {count} keys!",
+        "keys_sent": "Keys sent to user {user_id}",
+        "keys_not_delivered": "❌ Keys for order {payment_id} were not delivered to user {user_id}: {error}\nRetry: /dead_letters retry",
+        
+        # === Admin Panel ===
+        "admin_panel_title": "Administrative Panel",
+        "reviews_management": "Reviews Management",
+        "choose_action": "Choose action:",
+        
+        # Admin buttons
+        "stats_btn": "📊 Statistics",
+        "add_seller_btn": "➕ Add Seller",
+        "delete_seller_btn": "➖ Delete Seller",
+        "reviews_btn": "📝 Reviews",
+        "tickets_btn": "📩 Support Tickets",
+        "gen_keys_btn": "🔑 Generate Keys",
+        "confirm_btn": "✅ Confirm Payment",
+        "add_review": "➕ Add Review",
+        "edit_review": "✏️ Edit Review",
+        "delete_review": "🗑️ Delete Review",
+        "back_to_admin": "🔙 Back to Admin",
+        
+        # === Forms ===
+        "enter_seller_id": "Step 1/3: Enter seller ID (latin letters, numbers and _ only)\nExample: seller_vip, super_keys, megashop",
+        "enter_seller_name": "Step 2/3: Enter seller name (with emoji):",
+        "enter_price": "Step 3/3: Enter price per key (number, e.g. 2.5):",
+        "enter_review_user": "Step 1/2: Enter user ID (or @username):",
+        "enter_review_text": "Step 2/2: Enter review text:",
+        "select_review_edit": "Select review to edit:",
+        "select_review_delete": "Select review to delete:",
+        "enter_new_text": "Enter new text:",
+        "current_text": "Current text",
+        "how_many_keys": "How many keys to generate? (enter number from 1 to {max}):",
+        "select_seller_gen": "Select seller to generate keys for:",
+        "select_seller_delete": "Select seller to delete:",
+        
+        # === Statistics ===
+        "stats": "Bot Statistics",
+        "users_count": "Users",
+        "total_keys": "Total keys",
+        "pending_payments_count": "Awaiting payment",
+        "revenue": "Revenue",
+        "sold": "sold",
+        
+        # === Other ===
+        "no_sellers_delete": "No sellers to delete!",
+        "no_reviews_edit": "No reviews to edit!",
+        "no_reviews_delete": "No reviews to delete!",
+        "review_not_found": "Review not found!",
+        "update_error": "Error updating!",
+        "first_three": "First 3",
+        "name": "Name",
+        "piece": "pc.",
+        "for": "for",
+        "pcs": "pcs.",
+        "confirm_usage_cmd": "Usage: /confirm [PAYMENT_ID]",
+        "reply_usage": "Usage: /reply [TICKET_ID] [text]",
+        "close_usage": "Usage: /close [TICKET_ID]",
+        "broadcast_usage": "Usage: /broadcast [text]\nStop: /broadcast_stop [ID]",
+        "broadcast_started": "📣 Broadcast #{broadcast_id} started",
+        "broadcast_stopped": "⏹ Broadcast #{broadcast_id} stopped",
+        "broadcast_not_running": "Broadcast not found or already finished",
+        "broadcast_report": "📣 Broadcast #{broadcast_id}: {status}\n✅ Delivered: {sent}\n❌ Failed: {failed}\n⚡ Rate: {rate:.1f} msg/s",
+        "dead_letters_info": "📭 Undelivered messages: {count}\n📤 Queued: {pending}\nRetry: /dead_letters retry",
+        "dead_letters_requeued": "🔁 Requeued: {count}",
+        "key_usage": "Usage: /key [KEY]\nRevoke: /key [KEY] revoke",
+        "key_not_found": "❌ No such key was issued",
+        "key_info": "🔑 {key}\n🏪 Seller: {seller}\n📌 Status: {status}",
+        "key_owner": "👤 Buyer: {user} ({user_id})\n📅 Sold: {sold_at}",
+        "key_revoked_at": "🚫 Revoked: {revoked_at}",
+        "key_status_in_stock": "in stock",
+        "key_status_sold": "sold",
+        "key_status_revoked": "revoked",
+        "import_usage": "Usage: /import_keys [SELLER_ID], then send the file",
+        "import_send_file": "📄 Send a file with keys (TXT or CSV, one XXXXXXXXXX:xxxxxxxx key per line)",
+        "import_too_big": "❌ The file is larger than 20 MB. Upload it to the server and run: python key_import.py [SELLER_ID] [file]",
+        "import_started": "⏳ Import started...",
+        "import_done": "✅ Import finished\n📄 Lines: {lines}\n➕ Added: {added}\n🔁 Duplicates: {duplicates}\n⚠️ Invalid format: {invalid}"
+    }
+}
+
+
+class Translator:
+    """Переводчик, привязанный к языку пользователя"""
+    
+    __slots__ = ("lang", "texts")
+    
+    def __init__(self, lang: str):
+        self.lang = lang if lang in TEXTS else "ru"
+        self.texts = TEXTS[self.lang]
+    
+    def __call__(self, key: str, **kwargs) -> str:
+        text = self.texts.get(key, key)
+        if kwargs:
+            text = text.format(**kwargs)
+        return text
+
+
+@lru_cache(maxsize=None)
+def get_translator(lang: str) -> Translator:
+    return Translator(lang)
@@ -0,0 +1,185 @@
+from bisect import bisect_left, insort
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+class KeyInventory:
+    """Очередь непроданных ключей продавца.
+
+    Ключи хранятся записями фиксированной ширины в одном bytearray (ключ
+    XXXXXXXXXX:xxxxxxxx занимает 19 байт вместо ~77 у строки в списке);
+    более короткие ключи дополняются нулевыми байтами. Если приходит ключ
+    длиннее текущей ширины, записи один раз переписываются с новой шириной.
+    Выданные ключи отсекаются сдвигом указателя головы, поэтому выдача n
+    ключей стоит O(n), а не O(размера склада). Выданный префикс вырезается,
+    когда он занимает больше половины буфера.
+
+    Каждый добавленный ключ получает номер (по порядку добавления), который
+    не меняется при выдаче и удалении соседей: по номеру ключ находится
+    за O(log числа удалений из середины) - так его ищет индекс ключей.
+    """
+
+    __slots__ = ("_buf", "_width", "_head", "_count", "_added", "_base", "_holes")
+
+    COMPACT_MIN = 1024
+    ITER_CHUNK = 4096
+    PAD = b"\0"
+
+    def __init__(self, keys: Iterable[str] = ()):
+        self._buf = bytearray()
+        self._width = 0
+        self._head = 0
+        self._count = 0
+        # Номер следующего ключа; записей, вырезанных из начала буфера;
+        # номера ключей, удалённых из середины (del inventory[i])
+        self._added = 0
+        self._base = 0
+        self._holes = []
+        self.extend(keys)
+
+    def __len__(self) -> int:
+        return self._count - self._head
+
+    def __iter__(self):
+        # Пачками, чтобы не создавать строки для всего склада сразу
+        for start in range(self._head, self._count, self.ITER_CHUNK):
+            yield from self._decode(start, min(start + self.ITER_CHUNK, self._count))
+
+    def __delitem__(self, index):
+        """del inventory[:n] - операция "shift" из журнала, del inventory[i] - "del" одного ключа"""
+        if isinstance(index, int):
+            if not 0 <= index < len(self):
+                raise IndexError("индекс за пределами склада")
+            insort(self._holes, self._number(self._head + index))
+            pos = (self._head + index) * self._width
+            del self._buf[pos:pos + self._width]
+            self._count -= 1
+            return
+        if not isinstance(index, slice) or index.start is not None or index.step is not None:
+            raise TypeError("KeyInventory поддерживает только удаление с начала: del inventory[:n]")
+        self.take(min(index.stop, len(self)))
+
+    def _decode(self, start: int, stop: int) -> List[str]:
+        """Ключи записей с start по stop (номера записей в буфере)"""
+        width = self._width
+        if not width or stop <= start:
+            return []
+        blob = bytes(self._buf[start * width:stop * width])
+        try:
+            # Обычный случай - ASCII: символ равен байту, режем готовую строку
+            text = blob.decode("ascii")
+        except UnicodeDecodeError:
+            return [blob[pos:pos + width].rstrip(self.PAD).decode("utf-8") for pos in range(0, len(blob), width)]
+        keys = [text[pos:pos + width] for pos in range(0, len(text), width)]
+        if "\0" in text:
+            keys = [key.rstrip("\0") for key in keys]
+        return keys
+
+    def _widen(self, width: int):
+        """Переписывает записи с новой шириной"""
+        old = self._width
+        if old:
+            buf = self._buf
+            self._buf = bytearray(b"".join(
+                bytes(buf[pos:pos + old]).ljust(width, self.PAD) for pos in range(0, len(buf), old)
+            ))
+        self._width = width
+
+    def extend(self, keys: Iterable[str]) -> int:
+        """Добавляет ключи в конец очереди, возвращает номер первого"""
+        start = self._added
+        records = [key.encode("utf-8") for key in keys]
+        if not records:
+            return start
+        longest = max(map(len, records))
+        if longest > self._width:
+            self._widen(longest)
+        width = self._width
+        if min(map(len, records)) == width:
+            self._buf += b"".join(records)
+        else:
+            self._buf += b"".join(record.ljust(width, self.PAD) for record in records)
+        self._count += len(records)
+        self._added += len(records)
+        return start
+
+    def take(self, n: int) -> Optional[List[str]]:
+        """Выдает n ключей из начала очереди или None, если ключей меньше n"""
+        if n < 1 or len(self) < n:
+            return None
+        keys = self._decode(self._head, self._head + n)
+        self._head += n
+        if self._head >= self.COMPACT_MIN and self._head * 2 >= self._count:
+            del self._buf[:self._head * self._width]
+            self._count -= self._head
+            self._base += self._head
+            self._head = 0
+        return keys
+
+    def index(self, key: str) -> int:
+        """Позиция ключа в очереди (поиск по буферу, для редких операций вроде отзыва)"""
+        record = key.encode("utf-8")
+        width = self._width
+        if len(record) > width:
+            raise ValueError(f"{key!r} нет на складе")
+        record = record.ljust(width, self.PAD)
+        pos = self._buf.find(record, self._head * width)
+        while pos >= 0:
+            if pos % width == 0:
+                return pos // width - self._head
+            pos = self._buf.find(record, pos + 1)
+        raise ValueError(f"{key!r} нет на складе")
+
+    @property
+    def next_number(self) -> int:
+        """Номер, который получит следующий добавленный ключ"""
+        return self._added
+
+    def _number(self, record: int) -> int:
+        """Номер ключа в записи буфера record"""
+        number = record + self._base
+        for hole in self._holes:
+            if hole > number:
+                break
+            number += 1
+        return number
+
+    def _record(self, number: int) -> Optional[int]:
+        """Запись буфера с ключом number; None - ключ выдан или удалён"""
+        holes = bisect_left(self._holes, number)
+        if holes < len(self._holes) and self._holes[holes] == number:
+            return None
+        record = number - self._base - holes
+        return record if self._head <= record < self._count else None
+
+    def key_at(self, number: int) -> Optional[str]:
+        """Ключ с номером number, если он ещё на складе"""
+        record = self._record(number)
+        return None if record is None else self._decode(record, record + 1)[0]
+
+    def position(self, number: int) -> Optional[int]:
+        """Позиция в очереди ключа с номером number"""
+        record = self._record(number)
+        return None if record is None else record - self._head
+
+    def numbered(self) -> Iterator[Tuple[int, str]]:
+        """(номер, ключ) всех ключей на складе"""
+        holes = self._holes
+        passed = bisect_left(holes, self._head + self._base)
+        number = self._head + self._base + passed
+        for key in self:
+            while passed < len(holes) and holes[passed] <= number:
+                passed += 1
+                number += 1
+            yield number, key
+            number += 1
+
+    def to_list(self) -> List[str]:
+        return self._decode(self._head, self._count)
+
+    def copy(self) -> "KeyInventory":
+        """Копия ключей на складе одним копированием буфера (номера не переносятся)"""
+        clone = KeyInventory()
+        clone._buf = self._buf[self._head * self._width:self._count * self._width]
+        clone._width = self._width
+        clone._count = clone._added = len(self)
+        return clone
@@ -0,0 +1,235 @@
+import json
+import os
+import shutil
+import threading
+from typing import Callable, List, Optional
+
+
+class StaleJournal(Exception):
+    """Журнал заменён или в нём пропуск - данные нужно перечитать со снимка"""
+
+
+def apply_op(data: dict, op: list):
+    """Применяет одну операцию журнала к данным.
+
+    Операции:
+        ["set", path, value]  - записать значение
+        ["del", path]         - удалить ключ
+        ["push", path, items] - дописать элементы в конец списка
+        ["shift", path, n]    - убрать n элементов из начала списка
+    """
+    kind, path = op[0], op[1]
+    target = data
+    for key in path[:-1]:
+        target = target[str(key) if isinstance(target, dict) else key]
+    last = path[-1]
+    if isinstance(target, dict):
+        last = str(last)
+    if kind == "set":
+        target[last] = op[2]
+    elif kind == "del":
+        if isinstance(target, dict):
+            target.pop(last, None)
+        else:
+            del target[last]
+    elif kind == "push":
+        target[last].extend(op[2])
+    elif kind == "shift":
+        del target[last][:op[2]]
+    else:
+        raise ValueError(f"Неизвестная операция журнала: {kind}")
+
+
+class Journal:
+    """Журнал изменений (write-ahead log) в формате JSON Lines.
+
+    Каждая мутация - одна компактная строка {"s": seq, "o": [ops]}.
+    При компактизации текущий журнал переименовывается в *.old, снимок
+    пишется в фоне, после чего *.old удаляется. Номер seq в снимке
+    позволяет не применять записи повторно после сбоя.
+    """
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.old_path = path + ".old"
+        self.fsync = fsync
+        self.seq = 0
+        self.records = 0
+        self._lock = threading.Lock()
+        self._file = None
+        # Какой файл и до какого байта уже прочитан - по ним видно
+        # записи других процессов (см. changed/tail)
+        self._ino = None
+        self._offset = 0
+
+    def _apply(self, data: dict, record: dict, strict: bool, apply: Callable = apply_op) -> bool:
+        if record["s"] <= self.seq:
+            return False
+        if strict and record["s"] != self.seq + 1:
+            raise StaleJournal(f"пропуск в журнале: {self.seq} -> {record['s']}")
+        for op in record["o"]:
+            apply(data, op)
+        self.seq = record["s"]
+        return True
+
+    def replay(self, data: dict, after_seq: int = 0, truncate: bool = True, strict: bool = False) -> int:
+        """Применяет к данным записи с seq > after_seq, возвращает последний seq.
+
+        truncate - отрезать недописанный хвост (только когда в журнал
+        никто не пишет), strict - требовать непрерывности seq.
+        """
+        self.close()
+        self.seq = after_seq
+        self.records = 0
+        self._ino = None
+        self._offset = 0
+        for path in (self.old_path, self.path):
+            try:
+                f = open(path, "r+", encoding="utf-8")
+            except FileNotFoundError:
+                continue
+            with f:
+                good = 0
+                while True:
+                    line = f.readline()
+                    if not line:
+                        break
+                    if not line.endswith("\n") and not truncate:
+                        # Строку ещё дописывает другой процесс
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        if truncate:
+                            # Недописанная последняя строка после сбоя - отрезаем
+                            f.truncate(good)
+                            break
+                        raise StaleJournal(f"повреждённая запись в {path}")
+                    good = f.tell()
+                    if self._apply(data, record, strict) and path == self.path:
+                        self.records += 1
+                if path == self.path:
+                    self._ino = os.fstat(f.fileno()).st_ino
+                    self._offset = good
+        return self.seq
+
+    def first_seq(self) -> Optional[int]:
+        """seq первой записи журнала, None - журнал пуст"""
+        for path in (self.old_path, self.path):
+            try:
+                with open(path, "rb") as f:
+                    line = f.readline()
+            except FileNotFoundError:
+                continue
+            if line.endswith(b"\n"):
+                return json.loads(line)["s"]
+        return None
+
+    def set_aside(self, suffix: str):
+        """Переименовывает файлы журнала, убирая их из наката (для разбора вручную)"""
+        self.close()
+        for path in (self.old_path, self.path):
+            if os.path.exists(path):
+                os.replace(path, path + suffix)
+
+    def changed(self) -> bool:
+        """Дописал ли кто-то журнал после нашего последнего чтения"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return self._ino is not None
+        return st.st_ino != self._ino or st.st_size != self._offset
+
+    def tail(self, data: dict, apply: Callable = apply_op) -> int:
+        """Применяет чужие записи, дописанные после нашего последнего чтения.
+
+        apply(data, op) применяет одну операцию (по умолчанию apply_op) -
+        через него вызывающий поправляет свои индексы. Возвращает число
+        применённых записей. Если журнал заменили
+        (компактизация в другом процессе) или в нём пропуск, бросает
+        StaleJournal - тогда данные нужно перечитать со снимка.
+        """
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            if self._ino is not None:
+                raise StaleJournal("журнал свёрнут в снимок")
+            return 0
+        with f:
+            st = os.fstat(f.fileno())
+            if self._ino is None:
+                self._ino, self._offset = st.st_ino, 0
+            elif st.st_ino != self._ino or st.st_size < self._offset:
+                raise StaleJournal("журнал заменён")
+            f.seek(self._offset)
+            chunk = f.read()
+        applied = 0
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            if not line:
+                continue
+            if self._apply(data, json.loads(line), strict=True, apply=apply):
+                applied += 1
+                self.records += 1
+        self._offset += end
+        return applied
+
+    def _open(self):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+            self._ino = os.fstat(self._file.fileno()).st_ino
+
+    def append(self, ops: List[list]) -> int:
+        """Дописывает одну мутацию в журнал"""
+        with self._lock:
+            self._open()
+            self.seq += 1
+            line = json.dumps({"s": self.seq, "o": ops}, ensure_ascii=False, separators=(",", ":"))
+            self._file.write(line + "\n")
+            self._file.flush()
+            # Под блокировкой конец файла - конец нашей записи
+            self._offset = os.fstat(self._file.fileno()).st_size
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.records += 1
+            return self.seq
+
+    def rotate(self):
+        """Откладывает текущий журнал в *.old до записи снимка.
+
+        Если *.old остался от свёртки, чей снимок не записался, его записей
+        ещё нет ни в одном снимке - текущий журнал дописывается к нему.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path) and os.path.exists(self.old_path):
+                with open(self.path, "rb") as src, open(self.old_path, "ab") as dst:
+                    shutil.copyfileobj(src, dst)
+                    dst.flush()
+                    if self.fsync:
+                        os.fsync(dst.fileno())
+                # Сбой до удаления не страшен: повторы отсеет seq при накате
+                os.remove(self.path)
+            elif os.path.exists(self.path):
+                os.replace(self.path, self.old_path)
+            self.records = 0
+            self._ino = None
+            self._offset = 0
+
+    def drop_rotated(self):
+        """Удаляет отложенный журнал - его записи уже в снимке"""
+        if os.path.exists(self.old_path):
+            os.remove(self.old_path)
+
+    def reset(self):
+        """Очищает журнал полностью (после синхронной записи снимка)"""
+        self.rotate()
+        self.drop_rotated()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,79 @@
+"""Импорт ключей поставщика из текстового или CSV-файла.
+
+    python key_import.py SELLER_ID keys.txt
+
+Файл читается построчно: ключ - вся строка или её первый столбец
+(разделители , ; и табуляция), пустые строки, комментарии (#) и
+заголовок "key" пропускаются. Ключи сверяются с форматом
+cfg.IMPORT_KEY_PATTERN и добавляются пачками по cfg.IMPORT_CHUNK, каждая
+пачка сохраняется одной записью. Уже выпущенные ключи (на складе, проданные,
+отозванные) не добавляются. Пока бот запущен, импорт из консоли безопасен
+только с общим хранилищем (DB_BACKEND=sqlite или DB_PERSIST=shared).
+В режиме DB_PERSIST=snapshot каждая пачка перезаписывает весь снимок,
+поэтому миллионы ключей лучше загружать в режиме journal.
+"""
+import asyncio
+import re
+import sys
+from typing import Dict, Iterable, Iterator, List
+
+from config import cfg
+
+KEY_RE = re.compile(cfg.IMPORT_KEY_PATTERN)
+SEPARATORS = re.compile(r"[,;\t]")
+
+
+def parse_line(line: str) -> str:
+    """Ключ из строки файла: первый столбец без пробелов и кавычек"""
+    return SEPARATORS.split(line, 1)[0].strip().strip("\"'")
+
+
+def iter_chunks(lines: Iterable[str], stats: Dict, chunk_size: int = cfg.IMPORT_CHUNK) -> Iterator[List[str]]:
+    """Проверенные ключи пачками по chunk_size; счётчики строк и ошибок копятся в stats"""
+    chunk = []
+    for line in lines:
+        stats["lines"] += 1
+        key = parse_line(line)
+        if not key or key.startswith("#") or (stats["lines"] == 1 and key.lower() == "key"):
+            continue
+        if not KEY_RE.fullmatch(key):
+            stats["invalid"] += 1
+            continue
+        chunk.append(key)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+async def import_file(db, seller_id: str, path: str, chunk_size: int = cfg.IMPORT_CHUNK) -> Dict:
+    """Импортирует файл, возвращает {"lines", "added", "duplicates", "invalid"}.
+
+    Между пачками управление отдаётся event loop, чтобы бот продолжал
+    обрабатывать апдейты.
+    """
+    stats = {"lines": 0, "added": 0, "duplicates": 0, "invalid": 0}
+    with open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+        for chunk in iter_chunks(f, stats, chunk_size):
+            added = db.import_keys(seller_id, chunk)
+            stats["added"] += added
+            stats["duplicates"] += len(chunk) - added
+            await asyncio.sleep(0)
+    return stats
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    from database import db
+
+    seller_id, path = sys.argv[1], sys.argv[2]
+    if seller_id not in db.get_sellers():
+        sys.exit(f"Продавец не найден: {seller_id}")
+    result = asyncio.run(import_file(db, seller_id, path))
+    db.close()
+    print(
+        f"Строк: {result['lines']}, добавлено: {result['added']}, "
+        f"повторов: {result['duplicates']}, с ошибкой формата: {result['invalid']}"
+    )
@@ -0,0 +1,54 @@
+import os
+import random
+import string
+from functools import lru_cache
+
+KEY_HEAD_ALPHABET = string.ascii_uppercase
+KEY_TAIL_ALPHABET = string.ascii_lowercase + string.digits
+KEY_HEAD_LEN = 10
+KEY_TAIL_LEN = 8
+
+
+@lru_cache(maxsize=None)
+def _translation(alphabet: str) -> tuple:
+    size = len(alphabet)
+    limit = 256 - 256 % size
+    table = bytes(ord(alphabet[b % size]) if b < limit else 0 for b in range(256))
+    return table, bytes(range(limit, 256)), limit
+
+
+def _random_chars(alphabet: str, count: int) -> str:
+    """count символов alphabet из os.urandom.
+
+    Байт переводится в символ таблицей bytes.translate; байты из хвоста
+    диапазона, который не делится на размер алфавита, выбрасываются,
+    чтобы символы были равновероятны.
+    """
+    table, rejected, limit = _translation(alphabet)
+    chunks, have = [], 0
+    while have < count:
+        # Запас на отброшенные байты, чтобы обычно хватало одного чтения
+        need = (count - have) * 256 // limit + 64
+        chunk = os.urandom(need).translate(table, rejected)
+        chunks.append(chunk)
+        have += len(chunk)
+    return b"".join(chunks)[:count].decode("ascii")
+
+
+def generate_key_batch(count: int) -> list:
+    """count ключей формата XXXXXXXXXX:xxxxxxxx из криптостойкого генератора"""
+    heads = _random_chars(KEY_HEAD_ALPHABET, count * KEY_HEAD_LEN)
+    tails = _random_chars(KEY_TAIL_ALPHABET, count * KEY_TAIL_LEN)
+    return [
+        f"{heads[i * KEY_HEAD_LEN:(i + 1) * KEY_HEAD_LEN]}:{tails[i * KEY_TAIL_LEN:(i + 1) * KEY_TAIL_LEN]}"
+        for i in range(count)
+    ]
+
+
+def generate_key() -> str:
+    """Генерирует ключ формата XXXXXXXXXX:xxxxxxxx"""
+    return generate_key_batch(1)[0]
+
+
+def generate_payment_id() -> str:
+    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=12))
@@ -0,0 +1,136 @@
+from array import array
+from bisect import bisect_left
+from itertools import chain, groupby
+from typing import Dict, Iterable, List
+
+MASK64 = (1 << 64) - 1
+
+
+def key_digest(key: str) -> int:
+    """64-битный хэш ключа (hash строки - свой в каждом процессе, индекс тоже)"""
+    return hash(key) & MASK64
+
+
+class DigestIndex:
+    """Отсортированный набор 64-битных кодов: 8 байт на запись.
+
+    Коды лежат в array("Q"), новые копятся в обычном set и вливаются в
+    массив, когда их набирается MERGE_AT. Для поиска диапазона новые коды
+    сортируются при первом обращении после изменения. Повторы не хранятся.
+    """
+
+    MERGE_AT = 65536
+
+    def __init__(self, codes: Iterable[int] = ()):
+        self._sorted = array("Q")
+        self._recent = set()
+        self._recent_sorted = None
+        self.update(codes)
+
+    def __len__(self) -> int:
+        return len(self._sorted) + len(self._recent)
+
+    def add(self, code: int):
+        if code in self:
+            return
+        self._recent.add(code)
+        self._recent_sorted = None
+        if len(self._recent) >= self.MERGE_AT:
+            self._merge(())
+
+    def update(self, codes: Iterable[int]):
+        """Добавляет много кодов: крупная пачка вливается одной сортировкой"""
+        codes = list(codes)
+        if len(codes) < self.MERGE_AT:
+            for code in codes:
+                self.add(code)
+        else:
+            self._merge(codes)
+
+    def _merge(self, codes: List[int]):
+        merged = sorted(chain(self._sorted, self._recent, codes))
+        self._sorted = array("Q", (code for code, _ in groupby(merged)))
+        self._recent = set()
+        self._recent_sorted = None
+
+    def __contains__(self, code: int) -> bool:
+        if code in self._recent:
+            return True
+        i = bisect_left(self._sorted, code)
+        return i < len(self._sorted) and self._sorted[i] == code
+
+    def between(self, low: int, high: int) -> List[int]:
+        """Коды из [low, high)"""
+        codes = self._sorted[bisect_left(self._sorted, low):bisect_left(self._sorted, high)].tolist()
+        if self._recent:
+            if self._recent_sorted is None:
+                self._recent_sorted = array("Q", sorted(self._recent))
+            recent = self._recent_sorted
+            codes += recent[bisect_left(recent, low):bisect_left(recent, high)].tolist()
+        return codes
+
+
+class KeyIndex:
+    """Индекс выпущенных ключей без самих ключей.
+
+    issued - хэши всех когда-либо выпущенных ключей (склад, проданные,
+    отозванные): по нему генерация и импорт отсеивают повторы. Совпадение
+    хэша ещё не значит совпадение ключа, но ложное "уже выпущен" стоит
+    только одного лишнего ключа генератора. sold - "хэш -> смещение строки
+    в журнале покупок" (старшие 64 - OFFSET_BITS бит хэша и смещение в
+    одном коде): кому продан ключ, точно читается из журнала по смещению.
+    stock - по продавцу "хэш -> номер ключа в KeyInventory" (так же в
+    одном коде): ключ на складе проверяется одним чтением по номеру.
+    Выданные со склада ключи из stock не вычёркиваются - по номеру их уже
+    нет, а индекс продавца собирается заново, когда таких набирается
+    больше, чем ключей на складе.
+    """
+
+    OFFSET_BITS = 36
+    OFFSET_MASK = (1 << OFFSET_BITS) - 1
+    NUMBER_BITS = 32
+    NUMBER_MASK = (1 << NUMBER_BITS) - 1
+
+    def __init__(self, issued: Iterable[int] = (), sold: Iterable[int] = ()):
+        self.issued = DigestIndex(issued)
+        self.sold = DigestIndex(sold)
+        self.stock: Dict[str, DigestIndex] = {}
+
+    @classmethod
+    def sold_code(cls, key: str, offset: int) -> int:
+        return key_digest(key) >> cls.OFFSET_BITS << cls.OFFSET_BITS | offset
+
+    def is_issued(self, key: str) -> bool:
+        return key_digest(key) in self.issued
+
+    def add_issued(self, key: str):
+        self.issued.add(key_digest(key))
+
+    def add_sold(self, key: str, offset: int):
+        self.sold.add(self.sold_code(key, offset))
+
+    def sold_offsets(self, key: str) -> List[int]:
+        """Смещения строк журнала покупок, где может быть ключ (от новых к старым)"""
+        low = self.sold_code(key, 0)
+        return sorted((code & self.OFFSET_MASK for code in self.sold.between(low, low + self.OFFSET_MASK + 1)),
+                      reverse=True)
+
+    @classmethod
+    def stock_code(cls, key: str, number: int) -> int:
+        return key_digest(key) >> cls.NUMBER_BITS << cls.NUMBER_BITS | number
+
+    def add_stock(self, seller_id: str, inventory, keys: List[str] = (), start: int = 0):
+        """Добавляет в индекс склада ключи keys с номерами от start (уже лежащие в inventory)"""
+        index = self.stock.get(seller_id)
+        if index is None or len(index) > 2 * len(inventory) + DigestIndex.MERGE_AT:
+            self.stock[seller_id] = DigestIndex(self.stock_code(key, number) for number, key in inventory.numbered())
+        else:
+            index.update(self.stock_code(key, start + i) for i, key in enumerate(keys))
+
+    def stock_numbers(self, seller_id: str, key: str) -> List[int]:
+        """Номера ключей продавца, которые могут совпадать с key"""
+        index = self.stock.get(seller_id)
+        if index is None:
+            return []
+        low = self.stock_code(key, 0)
+        return [code & self.NUMBER_MASK for code in index.between(low, low + self.NUMBER_MASK + 1)]
@@ -0,0 +1,169 @@
+import json
+import os
+from typing import Dict, List, Optional, Set
+
+
+class PurchaseLedger:
+    """Журнал покупок в формате JSON Lines, только дозапись.
+
+    Покупки не хранятся в записях пользователей, поэтому снимок базы не
+    растёт вместе с историей. Индекс "пользователь -> смещения строк"
+    строится лениво при первом чтении истории и дальше догоняет файл с
+    места, где остановился (в том числе строки других процессов).
+
+    Покупка по платежу (payment_id) пишется до сохранения базы и
+    считается только после строки-отметки {"commit": payment_id}; отметка
+    {"abort": payment_id} закрывает строку, которая так и не сохранилась.
+    Строка с тем же payment_id, записанная повторно (сбой до сохранения и
+    повторный /confirm), заменяет предыдущую.
+    """
+
+    TAIL_CHUNK = 4096
+
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self._offsets: Dict[int, List[int]] = {}
+        self._by_payment: Dict[str, tuple] = {}
+        self._committed: Set[str] = set()
+        self._scanned = 0
+
+    def append(self, *records: dict) -> int:
+        """Дописывает строки, возвращает смещение первой"""
+        lines = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records)
+        with open(self.path, "a+b") as f:
+            pos = self._cut_torn_tail(f)
+            f.write(lines.encode("utf-8"))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        return pos
+
+    def _cut_torn_tail(self, f) -> int:
+        """Отрезает недописанную при сбое последнюю строку, возвращает конец файла.
+
+        Иначе следующая строка приклеилась бы к ней и не читалась бы никогда.
+        """
+        end = f.seek(0, os.SEEK_END)
+        if not end or os.pread(f.fileno(), 1, end - 1) == b"\n":
+            return end
+        good = end
+        while good:
+            start = max(0, good - self.TAIL_CHUNK)
+            newline = os.pread(f.fileno(), good - start, start).rfind(b"\n")
+            if newline >= 0:
+                good = start + newline + 1
+                break
+            good = start
+        f.truncate(good)
+        return good
+
+    def commit(self, *payment_ids: str):
+        """Отмечает покупки по платежам сохранёнными"""
+        if payment_ids:
+            self.append(*({"commit": pid} for pid in payment_ids))
+
+    def abort(self, *payment_ids: str):
+        """Закрывает строки покупок, которые не были сохранены"""
+        if payment_ids:
+            self.append(*({"abort": pid} for pid in payment_ids))
+
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def unresolved(self, offset: int = 0) -> List[str]:
+        """payment_id покупок после offset, у которых нет ни commit, ни abort"""
+        open_ids = {}
+        for _, record, _ in self.scan(offset):
+            if "commit" in record or "abort" in record:
+                open_ids.pop(record.get("commit") or record.get("abort"), None)
+            elif record.get("payment_id"):
+                open_ids[record["payment_id"]] = True
+        return list(open_ids)
+
+    def scan(self, offset: int):
+        """(начало, запись, конец) всех дописанных до конца строк после offset"""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            pos = offset
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                yield pos, json.loads(line), pos + len(line)
+                pos += len(line)
+
+    def _catch_up(self):
+        for pos, record, end in self.scan(self._scanned):
+            if "commit" in record:
+                self._committed.add(record["commit"])
+            elif "abort" in record:
+                self._committed.discard(record["abort"])
+            else:
+                offsets = self._offsets.setdefault(record["user_id"], [])
+                payment_id = record.get("payment_id")
+                if payment_id in self._by_payment:
+                    user_id, old = self._by_payment[payment_id]
+                    self._offsets[user_id].remove(old)
+                    self._committed.discard(payment_id)
+                offsets.append(pos)
+                if payment_id:
+                    self._by_payment[payment_id] = (record["user_id"], pos)
+            self._scanned = end
+
+    def _counts(self, record: dict, also: Set[str] = frozenset()) -> bool:
+        payment_id = record.get("payment_id")
+        return not payment_id or payment_id in self._committed or payment_id in also
+
+    def iter_records(self, also: Set[str] = frozenset()):
+        """Сохранённые покупки по порядку; also - payment_id, отметки которых ещё не записаны"""
+        self._catch_up()
+        for pos, record, _ in self.scan(0):
+            if pos >= self._scanned:
+                break
+            if "commit" in record or "abort" in record or not self._counts(record, also):
+                continue
+            payment_id = record.get("payment_id")
+            if payment_id and self._by_payment[payment_id][1] != pos:
+                continue
+            yield record
+
+    def find(self, payment_id: str) -> Optional[Dict]:
+        """Сохранённая покупка по платежу"""
+        self._catch_up()
+        if payment_id not in self._committed:
+            return None
+        return self.read_at(self._by_payment[payment_id][1])
+
+    def read_at(self, pos: int) -> Dict:
+        """Строка журнала по смещению"""
+        with open(self.path, "rb") as f:
+            f.seek(pos)
+            return json.loads(f.readline())
+
+    def read(self, user_id: int, offset: int = 0, limit: int = 10) -> List[Dict]:
+        """Покупки пользователя от новых к старым: limit штук, пропустив offset"""
+        self._catch_up()
+        positions = self._offsets.get(user_id, [])
+        records = []
+        if not positions:
+            return records
+        with open(self.path, "rb") as f:
+            for pos in reversed(positions):
+                f.seek(pos)
+                record = json.loads(f.readline())
+                if not self._counts(record):
+                    continue
+                if offset:
+                    offset -= 1
+                    continue
+                records.append(record)
+                if len(records) == limit:
+                    break
+        return records
@@ -0,0 +1,34 @@
+import fcntl
+import os
+
+
+class FileLock:
+    """Межпроцессная блокировка на flock с повторным входом.
+
+    Блокировка рекомендательная: её соблюдают только процессы бота,
+    работающие с тем же файлом.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+        self._depth = 0
+
+    def __enter__(self):
+        if self._depth == 0:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._depth = 0
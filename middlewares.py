@@ -0,0 +1,35 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from i18n import get_translator
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Один раз на апдейт достаёт запись пользователя и его язык.
+
+    В хэндлеры передаются:
+        user - запись пользователя из базы (None для новых)
+        lang - код языка
+        t    - переводчик, привязанный к языку
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        # Подтягиваем изменения других процессов бота (если они есть)
+        self.db.refresh()
+        from_user = data.get("event_from_user")
+        user = self.db.get_user(from_user.id) if from_user else None
+        lang = user.get("language", "ru") if user else "ru"
+        data["user"] = user
+        data["lang"] = lang
+        data["t"] = get_translator(lang)
+        return await handler(event, data)
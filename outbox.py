@@ -0,0 +1,177 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from ratelimit import TokenBucket
+
+
+class OutboundMessage:
+    __slots__ = ("chat_id", "text", "kwargs", "on_fail", "attempts", "resumed", "timer")
+
+    def __init__(self, chat_id: int, text: str, kwargs: dict, on_fail: Optional[Callable[[str], Awaitable]]):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.on_fail = on_fail
+        self.attempts = 0
+        # resumed - сообщение возвращается в очередь первым в своём чате
+        # (после паузы перед повтором), timer - отложенный возврат
+        self.resumed = False
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class Outbox:
+    """Очередь исходящих сообщений.
+
+    Хэндлеры кладут сообщение в очередь и сразу возвращаются, отправкой
+    занимаются воркеры. Чаты закреплены за воркерами по chat_id, поэтому
+    сообщения в один чат уходят строго по порядку. Лимит частоты и паузу
+    RetryAfter задаёт корзина limiter, общая с рассылками. Сообщение,
+    упавшее из-за сетевого сбоя, возвращается в очередь с экспоненциальной
+    задержкой, а пока оно ждёт, следующие сообщения в тот же чат
+    откладываются за ним; воркер тем временем обслуживает другие чаты.
+    Недоставленные сообщения попадают в dead-letter хранилище
+    (db.add_dead_letter).
+    """
+
+    def __init__(self, bot: Bot, db, workers: int, retries: int, backoff: float, limiter: TokenBucket):
+        self.bot = bot
+        self.db = db
+        self.retries = retries
+        self.backoff = backoff
+        self.bucket = limiter
+        self._queues: List[asyncio.Queue] = [asyncio.Queue() for _ in range(workers)]
+        self._workers: List[asyncio.Task] = []
+        # Чаты, где сообщение ждёт повтора: chat_id -> сообщения за ним
+        self._held: Dict[int, Deque[OutboundMessage]] = {}
+        self._timers: Set[asyncio.TimerHandle] = set()
+
+    def _queue(self, chat_id: int) -> asyncio.Queue:
+        return self._queues[chat_id % len(self._queues)]
+
+    def send(self, chat_id: int, text: str, on_fail: Optional[Callable[[str], Awaitable]] = None, **kwargs):
+        """Ставит сообщение в очередь. on_fail(error) вызывается, если доставить не удалось"""
+        message = OutboundMessage(chat_id, text, kwargs, on_fail)
+        self._queue(chat_id).put_nowait(message)
+
+    def pending(self) -> int:
+        return (sum(q.qsize() for q in self._queues) + len(self._timers)
+                + sum(len(held) for held in self._held.values()))
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker(q)) for q in self._queues]
+
+    async def close(self, timeout: float):
+        """Дожидается отправки очереди (не дольше timeout) и останавливает воркеры"""
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Очередь сообщений не отправлена до конца: {self.pending()}")
+        for timer in self._timers:
+            timer.cancel()
+        self._timers.clear()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.gather(*(q.join() for q in self._queues))
+            if not self._timers:
+                return
+            # Отложенные повторы вернутся в очереди по таймеру
+            await asyncio.sleep(max(0.0, min(t.when() for t in self._timers) - loop.time()))
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            message = await queue.get()
+            held = self._held.get(message.chat_id)
+            if held is not None and not message.resumed:
+                # Более раннее сообщение в этот чат ждёт повтора - встаём за ним
+                held.append(message)
+                queue.task_done()
+                continue
+            message.resumed = False
+            try:
+                done = await self._deliver(message)
+            except Exception as e:
+                logging.error(f"Ошибка очереди сообщений: {e}")
+                done = True
+            if done:
+                self._release(message.chat_id)
+            queue.task_done()
+
+    async def _deliver(self, message: OutboundMessage) -> bool:
+        """Отправляет сообщение. False - отправка отложена до повтора"""
+        while True:
+            await self.bucket.acquire()
+            message.attempts += 1
+            try:
+                await self.bot.send_message(message.chat_id, message.text, **message.kwargs)
+                return True
+            except TelegramRetryAfter as e:
+                # Флуд-контроль не считается попыткой - Telegram сам сказал, когда можно
+                message.attempts -= 1
+                self.bucket.pause(e.retry_after)
+                continue
+            except (TelegramNetworkError, TelegramServerError) as e:
+                error = str(e)
+                if message.attempts <= self.retries:
+                    self._defer(message, self.backoff * 2 ** (message.attempts - 1))
+                    return False
+            except TelegramAPIError as e:
+                # Бот заблокирован, чат не найден и т.п. - повтор не поможет
+                error = str(e)
+            await self._dead(message, error)
+            return True
+
+    def _defer(self, message: OutboundMessage, delay: float):
+        """Возвращает сообщение в очередь через delay секунд, придерживая его чат"""
+        self._held.setdefault(message.chat_id, deque())
+        message.resumed = True
+        message.timer = asyncio.get_running_loop().call_later(delay, self._resume, message)
+        self._timers.add(message.timer)
+
+    def _resume(self, message: OutboundMessage):
+        self._timers.discard(message.timer)
+        message.timer = None
+        self._queue(message.chat_id).put_nowait(message)
+
+    def _release(self, chat_id: int):
+        """Пропускает следующее придержанное сообщение чата"""
+        held = self._held.get(chat_id)
+        if held is None:
+            return
+        if held:
+            message = held.popleft()
+            message.resumed = True
+            self._queue(chat_id).put_nowait(message)
+        else:
+            del self._held[chat_id]
+
+    async def _dead(self, message: OutboundMessage, error: str):
+        logging.warning(f"Сообщение для {message.chat_id} не доставлено: {error}")
+        self.db.add_dead_letter({
+            "chat_id": message.chat_id,
+            "text": message.text,
+            "kwargs": message.kwargs,
+            "error": error,
+            "attempts": message.attempts,
+            "date": datetime.now().isoformat()
+        })
+        if message.on_fail:
+            await message.on_fail(error)
+
+    def requeue_dead(self) -> int:
+        """Повторно ставит в очередь все недоставленные сообщения"""
+        letters = self.db.pop_dead_letters()
+        for letter in letters:
+            self.send(letter["chat_id"], letter["text"], **letter["kwargs"])
+        return len(letters)
@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, запас до capacity"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Ждёт, пока не освободится токен"""
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def pause(self, seconds: float):
+        """Опустошает корзину на seconds (ответ RetryAfter от Telegram)"""
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+
+class ChatLimiter:
+    """Минимальный интервал между сообщениями в один чат"""
+
+    PRUNE_AT = 10000
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = {}
+
+    async def wait(self, chat_id: int):
+        now = time.monotonic()
+        ready = self._next.get(chat_id, now)
+        self._next[chat_id] = max(now, ready) + self.interval
+        if ready > now:
+            await asyncio.sleep(ready - now)
+        if len(self._next) > self.PRUNE_AT:
+            self._next = {cid: t for cid, t in self._next.items() if t > now}
@@ -0,0 +1,487 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+import struct
+import threading
+
+# Контрольная сумма дописывается последним полем объекта, поэтому снимок
+# остаётся обычным JSON (его читают migrate_from_json и люди)
+CHECKSUM_MARK = ',\n  "_checksum": "'
+# Перед суммой - таблица разделов {"раздел": [начало, конец]} в байтах от
+# начала файла, по ней раздел читается и разбирается отдельно от остальных
+SECTIONS_MARK = ',\n  "_sections": '
+# Хвост снимка: метка, sha256 в hex и закрывающие '"\n}'
+CHECKSUM_TAIL = len(CHECKSUM_MARK) + 64 + 3
+# Двоичный снимок (кодек pickle) начинается с метки, по ней и узнаётся
+BINARY_MAGIC = b"P2EBOT-SNAPSHOT\x00"
+
+
+class CorruptSnapshot(ValueError):
+    """Снимок недописан или повреждён"""
+
+
+class JsonCodec:
+    """Разделы в JSON: с отступами (удобно читать глазами) или компактно"""
+
+    binary = False
+    # Раздел-словарь можно собрать из отдельно закодированных кусков
+    chunked = True
+
+    def __init__(self, name: str, indent: bool):
+        self.name = name
+        self.indent = indent
+
+    def encode(self, value, default=None, background: bool = False) -> bytes:
+        """background - кодирование в потоке записи: C-кодировщик не отпускает
+        GIL, пока не закончит, а чистый Python отдаёт его event loop"""
+        if not self.indent:
+            if background:
+                encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=default)
+                return "".join(encoder.iterencode(value)).encode("utf-8")
+            return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=default).encode("utf-8")
+        text = json.dumps(value, ensure_ascii=False, indent=2, default=default)
+        # Раздел вложен в объект снимка: в JSON перевод строки внутри
+        # значений экранирован, так что все настоящие переводы строк - отступы
+        return text.replace("\n", "\n  ").encode("utf-8")
+
+    def encode_chunk(self, chunk: dict, default=None) -> bytes:
+        """Элементы словаря без скобок; join_chunks собирает из кусков раздел, как encode"""
+        if not self.indent:
+            text = json.dumps(chunk, ensure_ascii=False, separators=(",", ":"), default=default)
+            return text[1:-1].encode("utf-8")
+        text = json.dumps(chunk, ensure_ascii=False, indent=2, default=default)
+        # '{' в начале и '\n  }' в конце (с учётом отступа раздела)
+        return text.replace("\n", "\n  ")[1:-4].encode("utf-8")
+
+    def join_chunks(self, chunks: list) -> bytes:
+        if not chunks:
+            return b"{}"
+        return b"{" + b",".join(chunks) + (b"\n  }" if self.indent else b"}")
+
+    def decode(self, blob: bytes):
+        return json.loads(blob)
+
+
+class _Pickler(pickle.Pickler):
+    default = None
+
+    def reducer_override(self, obj):
+        # Вызывается только для небазовых типов (и классов, которыми pickle
+        # восстанавливает значения): как и в JSON, объект заменяет default(obj)
+        if self.default is None or isinstance(obj, type):
+            return NotImplemented
+        value = self.default(obj)
+        return type(value), (value,)
+
+
+class PickleCodec:
+    """Разделы в pickle: быстрее и компактнее JSON, но файл двоичный"""
+
+    binary = True
+    chunked = False
+    name = "pickle"
+
+    def encode(self, value, default=None, background: bool = False) -> bytes:
+        # У pickle нет кодировщика на Python приемлемой скорости: GIL держится
+        # всю запись раздела и в потоке
+        buf = io.BytesIO()
+        pickler = _Pickler(buf, protocol=pickle.HIGHEST_PROTOCOL)
+        pickler.default = default
+        pickler.dump(value)
+        return buf.getvalue()
+
+    def decode(self, blob: bytes):
+        return pickle.loads(blob)
+
+
+# Кодеки разделов снимка (cfg.SNAPSHOT_CODEC)
+CODECS = {
+    "json": JsonCodec("json", indent=True),
+    "compact": JsonCodec("compact", indent=False),
+    "pickle": PickleCodec()
+}
+
+
+class EncodedDict:
+    """Закодированный раздел-словарь, нарезанный на куски по CHUNK элементов.
+    
+    После изменения элемента перекодируется только его кусок. Новые
+    элементы дописываются в последний кусок (в словаре они тоже в конце).
+    Удаление элемента сдвигает куски - тогда раздел кодируется заново.
+    """
+
+    CHUNK = 1024
+
+    def __init__(self, codec, value: dict):
+        self.codec = codec
+        self._keys = []
+        self._blobs = []
+        self._where = {}
+        for key in value:
+            self._append(key)
+
+    def _append(self, key: str):
+        if not self._keys or len(self._keys[-1]) == self.CHUNK:
+            self._keys.append([])
+            self._blobs.append(None)
+        self._where[key] = len(self._keys) - 1
+        self._keys[-1].append(key)
+
+    def touch(self, key: str, deleted: bool = False) -> bool:
+        """Отмечает изменённый элемент; False - кусками больше не обойтись"""
+        if deleted:
+            return False
+        chunk = self._where.get(key)
+        if chunk is None:
+            self._append(key)
+            chunk = self._where[key]
+        self._blobs[chunk] = None
+        return True
+
+    def encode(self, value: dict, default=None) -> bytes:
+        for n, keys in enumerate(self._keys):
+            if self._blobs[n] is None:
+                self._blobs[n] = self.codec.encode_chunk({key: value[key] for key in keys}, default)
+        return self.codec.join_chunks(self._blobs)
+
+
+class LazyBlob:
+    """Раздел, который кодируется при первом обращении - в потоке записи снимка"""
+
+    def __init__(self, encode):
+        self._encode = encode
+        self._blob = None
+        self._lock = threading.Lock()
+
+    def __call__(self) -> bytes:
+        with self._lock:
+            if self._blob is None:
+                self._blob = self._encode()
+                # Копия данных больше не нужна - в кэше остаются только байты
+                self._encode = None
+            return self._blob
+
+
+
+def seal(body: bytes) -> bytes:
+    """Добавляет к снимку sha256 его содержимого"""
+    if body.startswith(BINARY_MAGIC):
+        return body + hashlib.sha256(body).digest()
+    if not body.endswith(b"\n}"):
+        raise ValueError("Снимок должен быть непустым JSON-объектом с отступами")
+    digest = hashlib.sha256(body).hexdigest()
+    return body[:-2] + f'{CHECKSUM_MARK}{digest}"\n}}'.encode("utf-8")
+
+
+def read_snapshot(path: str) -> dict:
+    """Читает снимок и проверяет контрольную сумму.
+
+    Снимки без суммы (записанные до её появления) принимаются, если это
+    корректный JSON.
+    """
+    with open(path, "rb") as f:
+        blob = f.read()
+    try:
+        data = json.loads(blob)
+    except ValueError as e:
+        raise CorruptSnapshot(f"{path}: {e}") from None
+    data.pop("_sections", None)
+    digest = data.pop("_checksum", None)
+    if digest is not None:
+        idx = blob.rfind(CHECKSUM_MARK.encode("utf-8"))
+        if idx < 0 or hashlib.sha256(blob[:idx] + b"\n}").hexdigest() != digest:
+            raise CorruptSnapshot(f"{path}: контрольная сумма не совпадает")
+    return data
+
+
+def build(sections, codec) -> bytes:
+    """Собирает снимок из пар (раздел, байты раздела в кодеке codec или LazyBlob) с таблицей разделов"""
+    if codec.binary:
+        parts = [BINARY_MAGIC]
+        pos = len(BINARY_MAGIC)
+    else:
+        parts = [b"{"]
+        pos = 1
+    table = {}
+    for name, body in sections:
+        if isinstance(body, LazyBlob):
+            body = body()
+        if not codec.binary:
+            head = f'{"," if table else ""}\n  {json.dumps(name, ensure_ascii=False)}: '.encode("utf-8")
+            pos += len(head)
+            parts.append(head)
+        table[name] = [pos, pos + len(body)]
+        pos += len(body)
+        parts.append(body)
+    index = json.dumps({"codec": codec.name, "sections": table}).encode("utf-8")
+    if codec.binary:
+        parts += [index, struct.pack(">Q", pos)]
+    else:
+        parts += [SECTIONS_MARK.encode("utf-8"), index, b"\n}"]
+    return b"".join(parts)
+
+
+class SectionedSnapshot:
+    """Снимок с таблицей разделов: каждый раздел читается по первому обращению.
+
+    Файл остаётся открытым, поэтому разделы читаются из того же снимка,
+    даже если его уже заменил более новый.
+    """
+
+    def __init__(self, path: str, f, sections: dict, codec):
+        self.path = path
+        self.codec = codec
+        self._file = f
+        self._sections = sections
+
+    def names(self) -> list:
+        return list(self._sections)
+
+    def raw(self, name: str) -> bytes:
+        start, end = self._sections[name]
+        return os.pread(self._file.fileno(), end - start, start)
+
+    def load(self, name: str):
+        try:
+            return self.codec.decode(self.raw(name))
+        except Exception as e:
+            raise CorruptSnapshot(f"{self.path}, раздел {name}: {e}") from None
+
+    def close(self):
+        self._file.close()
+
+
+def _hash_prefix(f, length: int):
+    """sha256 первых length байт файла, читая его кусками"""
+    digest = hashlib.sha256()
+    f.seek(0)
+    left = length
+    while left > 0:
+        chunk = f.read(min(left, 1 << 20))
+        if not chunk:
+            raise CorruptSnapshot(f"{f.name}: файл короче, чем ожидалось")
+        digest.update(chunk)
+        left -= len(chunk)
+    return digest
+
+
+def _parse_index(path: str, blob: bytes) -> tuple:
+    try:
+        index = json.loads(blob)
+        if "codec" not in index:
+            # Таблица первой версии - только смещения, разделы в JSON с отступами
+            return index, CODECS["json"]
+        return index["sections"], CODECS[index["codec"]]
+    except (ValueError, KeyError, TypeError) as e:
+        raise CorruptSnapshot(f"{path}: таблица разделов: {e!r}") from None
+
+
+def _open_binary(path: str, f, size: int) -> SectionedSnapshot:
+    # Хвост: смещение таблицы (8 байт) и sha256 всего, что до суммы (32 байта)
+    if size < len(BINARY_MAGIC) + 40:
+        raise CorruptSnapshot(f"{path}: недописан")
+    tail = os.pread(f.fileno(), 40, size - 40)
+    if _hash_prefix(f, size - 32).digest() != tail[8:]:
+        raise CorruptSnapshot(f"{path}: контрольная сумма не совпадает")
+    index_at = struct.unpack(">Q", tail[:8])[0]
+    sections, codec = _parse_index(path, os.pread(f.fileno(), size - 40 - index_at, index_at))
+    return SectionedSnapshot(path, f, sections, codec)
+
+
+def _open_json(path: str, f, size: int):
+    tail_start = max(0, size - 65536)
+    tail = os.pread(f.fileno(), size - tail_start, tail_start)
+    checksum_at = size - CHECKSUM_TAIL
+    sections_at = tail.rfind(SECTIONS_MARK.encode("utf-8"))
+    if checksum_at < 0 or not tail.endswith(b'"\n}') or sections_at < 0 \
+            or tail[checksum_at - tail_start:].find(CHECKSUM_MARK.encode("utf-8")) != 0:
+        f.close()
+        return read_snapshot(path)
+    digest = _hash_prefix(f, checksum_at)
+    digest.update(b"\n}")
+    expected = tail[checksum_at - tail_start + len(CHECKSUM_MARK):-3].decode("ascii", "replace")
+    if digest.hexdigest() != expected:
+        raise CorruptSnapshot(f"{path}: контрольная сумма не совпадает")
+    sections, codec = _parse_index(path, tail[sections_at + len(SECTIONS_MARK):checksum_at - tail_start])
+    return SectionedSnapshot(path, f, sections, codec)
+
+
+def open_snapshot(path: str):
+    """Проверяет контрольную сумму и возвращает SectionedSnapshot.
+
+    Формат (JSON или двоичный) и кодек разделов определяются по самому
+    файлу, поэтому SNAPSHOT_CODEC можно менять между запусками. Сумма
+    считается потоково, без разбора разделов. Снимок без таблицы разделов
+    (записанный до её появления) читается целиком - тогда возвращается dict.
+    """
+    f = open(path, "rb")
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if os.pread(f.fileno(), len(BINARY_MAGIC), 0) == BINARY_MAGIC:
+            return _open_binary(path, f, size)
+        return _open_json(path, f, size)
+    except BaseException:
+        f.close()
+        raise
+
+
+def load_snapshot(path: str) -> dict:
+    """Все разделы снимка любого формата"""
+    snapshot = open_snapshot(path)
+    if isinstance(snapshot, dict):
+        return snapshot
+    try:
+        return {name: snapshot.load(name) for name in snapshot.names()}
+    finally:
+        snapshot.close()
+
+
+def generations(path: str, count: int) -> list:
+    """Файлы снимка от нового к старому: path, path.1 ... path.count"""
+    return [path] + [f"{path}.{i}" for i in range(1, count + 1)]
+
+
+def write_snapshot(path: str, blob: bytes, keep: int, fsync: bool) -> tuple:
+    """Атомарно заменяет снимок, сохраняя keep предыдущих поколений.
+
+    Данные пишутся во временный файл, который после fsync переименовывается
+    поверх основного, поэтому сбой на любом шаге оставляет целый снимок.
+    Возвращает (inode, mtime) нового снимка.
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(blob)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+        st = os.fstat(f.fileno())
+    if keep > 0 and os.path.exists(path):
+        names = generations(path, keep)
+        for older, newer in zip(reversed(names[1:]), reversed(names[:-1])):
+            if newer != path and os.path.exists(newer):
+                os.replace(newer, older)
+        # Жёсткая ссылка, чтобы основной файл не пропадал ни на миг
+        if os.path.exists(names[1]):
+            os.remove(names[1])
+        os.link(path, names[1])
+    os.replace(tmp_path, path)
+    if fsync:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    return st.st_ino, st.st_mtime_ns
+
+
+class SectionedData(dict):
+    """Данные базы: разделы верхнего уровня разбираются из снимка по первому обращению.
+
+    Прочитанный раздел становится обычным элементом словаря, после чего
+    вызывается on_load(раздел). Непрочитанные разделы при записи снимка
+    копируются байтами из исходного файла (raw).
+    """
+
+    def __init__(self, loaded: dict = None, source: SectionedSnapshot = None, on_load=None):
+        super().__init__(loaded or {})
+        self.source = source
+        self.on_load = on_load
+        self._unloaded = [name for name in source.names() if not dict.__contains__(self, name)] if source else []
+
+    def __missing__(self, name):
+        if name not in self._unloaded:
+            raise KeyError(name)
+        value = self.source.load(name)
+        self._unloaded.remove(name)
+        dict.__setitem__(self, name, value)
+        if self.on_load:
+            self.on_load(name)
+        return value
+
+    def __contains__(self, name) -> bool:
+        return dict.__contains__(self, name) or name in self._unloaded
+
+    def __setitem__(self, name, value):
+        if name in self._unloaded:
+            self._unloaded.remove(name)
+        dict.__setitem__(self, name, value)
+
+    def __delitem__(self, name):
+        if name in self._unloaded:
+            self._unloaded.remove(name)
+        else:
+            dict.__delitem__(self, name)
+
+    # Обход и копирование видят все разделы: непрочитанные по имени,
+    # значения которых нужны - читаются
+    def __iter__(self):
+        return iter(self.loaded() + self.unloaded())
+
+    def __len__(self) -> int:
+        return dict.__len__(self) + len(self._unloaded)
+
+    def __eq__(self, other) -> bool:
+        return dict(self.items()) == other
+
+    __ne__ = object.__ne__
+
+    def keys(self) -> list:
+        return list(self)
+
+    def values(self) -> list:
+        return [self[name] for name in self]
+
+    def items(self) -> list:
+        return [(name, self[name]) for name in self]
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def setdefault(self, name, default=None):
+        if name not in self:
+            self[name] = default
+        return self[name]
+
+    def pop(self, name, *default):
+        if name in self._unloaded:
+            self[name]
+        return dict.pop(self, name, *default)
+
+    def popitem(self) -> tuple:
+        if self._unloaded:
+            name = self._unloaded[-1]
+            return name, self.pop(name)
+        return dict.popitem(self)
+
+    def update(self, *args, **kwargs):
+        for name, value in dict(*args, **kwargs).items():
+            self[name] = value
+
+    def clear(self):
+        dict.clear(self)
+        self._unloaded.clear()
+
+    def copy(self) -> dict:
+        return dict(self.items())
+
+    def is_loaded(self, name) -> bool:
+        return dict.__contains__(self, name)
+
+    def loaded(self) -> list:
+        return list(dict.keys(self))
+
+    def unloaded(self) -> list:
+        return list(self._unloaded)
+
+    def raw(self, name, codec) -> bytes:
+        """Непрочитанный раздел в кодеке codec"""
+        if self.source.codec is codec:
+            return self.source.raw(name)
+        # Снимок записан другим кодеком - раздел перекодируется, не попадая в данные
+        return codec.encode(self.source.load(name))
+
+    def close(self):
+        if self.source:
+            self.source.close()
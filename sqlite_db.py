@@ -0,0 +1,883 @@
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+
+from config import cfg
+from journal import Journal
+from keygen import generate_key_batch, generate_payment_id
+from ledger import PurchaseLedger
+from snapshot import load_snapshot
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT,
+    language TEXT NOT NULL DEFAULT 'ru',
+    joined TEXT NOT NULL,
+    purchase_count INTEGER NOT NULL DEFAULT 0
+);
+DROP INDEX IF EXISTS idx_users_username;
+CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users(username COLLATE NOCASE);
+
+CREATE TABLE IF NOT EXISTS sellers (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    price REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS keys (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    seller_id TEXT NOT NULL,
+    key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_keys_seller ON keys(seller_id, id);
+
+-- Все когда-либо выпущенные ключи: на складе (user_id NULL), проданные и
+-- отозванные. Пополняет его generate_keys, проданные строки не удаляются,
+-- поэтому проданный ключ не повторится
+CREATE TABLE IF NOT EXISTS key_registry (
+    key TEXT PRIMARY KEY,
+    seller_id TEXT,
+    user_id INTEGER,
+    sold_at TEXT,
+    revoked_at TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS reviews (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    username TEXT,
+    text TEXT NOT NULL,
+    date TEXT NOT NULL,
+    edited TEXT
+);
+
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    message TEXT,
+    status TEXT NOT NULL,
+    created TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tickets_status ON tickets(status);
+CREATE INDEX IF NOT EXISTS idx_tickets_user ON tickets(user_id);
+
+CREATE TABLE IF NOT EXISTS ticket_responses (
+    ticket_id INTEGER NOT NULL,
+    admin_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_ticket ON ticket_responses(ticket_id);
+
+CREATE TABLE IF NOT EXISTS payments (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    seller_id TEXT NOT NULL,
+    amount REAL NOT NULL,
+    quantity INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    created TEXT NOT NULL,
+    keys TEXT,
+    paid_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status);
+
+CREATE TABLE IF NOT EXISTS purchases (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    seller_id TEXT NOT NULL,
+    keys TEXT NOT NULL,
+    amount REAL NOT NULL,
+    date TEXT NOT NULL,
+    payment_id TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_purchases_user ON purchases(user_id);
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL,
+    status TEXT NOT NULL,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created TEXT NOT NULL,
+    finished TEXT
+);
+
+-- Счётчики для админки поддерживаются триггерами на каждом изменении:
+-- users, open_tickets, pending_payments, stock:<продавец>, revenue:<продавец>, sales:<продавец>
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL DEFAULT 0
+);
+CREATE TRIGGER IF NOT EXISTS stats_users_ins AFTER INSERT ON users BEGIN
+    INSERT INTO stats (name, value) VALUES ('users', 1) ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_users_del AFTER DELETE ON users BEGIN
+    UPDATE stats SET value = value - 1 WHERE name = 'users';
+END;
+CREATE TRIGGER IF NOT EXISTS stats_keys_ins AFTER INSERT ON keys BEGIN
+    INSERT INTO stats (name, value) VALUES ('stock:' || NEW.seller_id, 1)
+    ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_keys_del AFTER DELETE ON keys BEGIN
+    UPDATE stats SET value = value - 1 WHERE name = 'stock:' || OLD.seller_id;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_tickets_ins AFTER INSERT ON tickets WHEN NEW.status = 'open' BEGIN
+    INSERT INTO stats (name, value) VALUES ('open_tickets', 1) ON CONFLICT(name) DO UPDATE SET value = value + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_tickets_upd AFTER UPDATE OF status ON tickets
+WHEN (OLD.status = 'open') != (NEW.status = 'open') BEGIN
+    INSERT INTO stats (name, value) VALUES ('open_tickets', CASE WHEN NEW.status = 'open' THEN 1 ELSE -1 END)
+    ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_payments_ins AFTER INSERT ON payments BEGIN
+    INSERT INTO stats (name, value) VALUES ('pending_payments', NEW.status = 'pending')
+    ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+    INSERT INTO stats (name, value) SELECT 'revenue:' || NEW.seller_id, NEW.amount WHERE NEW.status = 'confirmed'
+    ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+    INSERT INTO stats (name, value) SELECT 'sales:' || NEW.seller_id, NEW.quantity WHERE NEW.status = 'confirmed'
+    ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+END;
+CREATE TRIGGER IF NOT EXISTS stats_payments_upd AFTER UPDATE OF status ON payments WHEN OLD.status != NEW.status BEGIN
+    UPDATE stats SET value = value + (NEW.status = 'pending') - (OLD.status = 'pending') WHERE name = 'pending_payments';
+    INSERT INTO stats (name, value)
+    SELECT 'revenue:' || NEW.seller_id, NEW.amount * ((NEW.status = 'confirmed') - (OLD.status = 'confirmed'))
+    WHERE NEW.status = 'confirmed' OR OLD.status = 'confirmed'
+    ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+    INSERT INTO stats (name, value)
+    SELECT 'sales:' || NEW.seller_id, NEW.quantity * ((NEW.status = 'confirmed') - (OLD.status = 'confirmed'))
+    WHERE NEW.status = 'confirmed' OR OLD.status = 'confirmed'
+    ON CONFLICT(name) DO UPDATE SET value = value + excluded.value;
+END;
+
+CREATE TABLE IF NOT EXISTS dead_letters (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    kwargs TEXT NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    date TEXT NOT NULL
+);
+"""
+
+
+class SQLiteDatabase:
+    """Хранилище на SQLite с тем же набором методов, что и Database"""
+
+    def __init__(self, path: str = cfg.SQLITE_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        # Растёт при любом изменении каталога (продавцы, остатки)
+        self.catalog_version = 0
+        self._data_version = self._read_data_version()
+        self._init_defaults()
+
+    def _migrate(self):
+        """Добавляет столбцы, появившиеся после создания базы"""
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(payments)")}
+        if "keys" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE payments ADD COLUMN keys TEXT")
+        if "paid_at" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE payments ADD COLUMN paid_at TEXT")
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(purchases)")}
+        if "payment_id" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE purchases ADD COLUMN payment_id TEXT")
+        with self.conn:
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_purchases_payment ON purchases(payment_id)")
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(users)")}
+        if "purchase_count" not in columns:
+            with self.conn:
+                self.conn.execute("ALTER TABLE users ADD COLUMN purchase_count INTEGER NOT NULL DEFAULT 0")
+                self.conn.execute(
+                    "UPDATE users SET purchase_count = (SELECT COUNT(*) FROM purchases WHERE user_id = users.id)"
+                )
+        if self.conn.execute("SELECT 1 FROM stats LIMIT 1").fetchone() is None:
+            self._rebuild_stats()
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(key_registry)")}
+        if "seller_id" not in columns:
+            with self.conn:
+                for column in ("seller_id TEXT", "user_id INTEGER", "sold_at TEXT", "revoked_at TEXT"):
+                    self.conn.execute(f"ALTER TABLE key_registry ADD COLUMN {column}")
+            self._register_keys()
+        elif self.conn.execute("SELECT 1 FROM key_registry LIMIT 1").fetchone() is None:
+            self._register_keys()
+
+    def _register_keys(self):
+        """Вносит в реестр ключи склада, покупок и выданные по платежам"""
+        with self.conn:
+            self.conn.executescript("""
+                INSERT INTO key_registry (key, seller_id) SELECT key, seller_id FROM keys WHERE true
+                    ON CONFLICT(key) DO UPDATE SET seller_id = excluded.seller_id;
+                INSERT INTO key_registry (key, seller_id, user_id, sold_at)
+                    SELECT j.value, p.seller_id, p.user_id, p.date FROM purchases AS p, json_each(p.keys) AS j WHERE true
+                    ON CONFLICT(key) DO UPDATE SET
+                        seller_id = excluded.seller_id, user_id = excluded.user_id, sold_at = excluded.sold_at;
+                INSERT OR IGNORE INTO key_registry (key, seller_id, user_id, sold_at)
+                    SELECT j.value, p.seller_id, p.user_id, p.created FROM payments AS p, json_each(p.keys) AS j
+                    WHERE p.keys IS NOT NULL;
+            """)
+
+    def _rebuild_stats(self):
+        """Пересчитывает счётчики stats по данным (база без триггеров или после миграции)"""
+        with self.conn:
+            self.conn.execute("DELETE FROM stats")
+            self.conn.executescript("""
+                INSERT INTO stats (name, value) SELECT 'users', COUNT(*) FROM users;
+                INSERT INTO stats (name, value) SELECT 'open_tickets', COUNT(*) FROM tickets WHERE status = 'open';
+                INSERT INTO stats (name, value) SELECT 'pending_payments', COUNT(*) FROM payments WHERE status = 'pending';
+                INSERT INTO stats (name, value) SELECT 'stock:' || seller_id, COUNT(*) FROM keys GROUP BY seller_id;
+                INSERT INTO stats (name, value)
+                    SELECT 'revenue:' || seller_id, SUM(amount) FROM payments WHERE status = 'confirmed' GROUP BY seller_id;
+                INSERT INTO stats (name, value)
+                    SELECT 'sales:' || seller_id, SUM(quantity) FROM payments WHERE status = 'confirmed' GROUP BY seller_id;
+            """)
+
+    def _init_defaults(self):
+        if self.conn.execute("SELECT 1 FROM sellers LIMIT 1").fetchone() is None:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO sellers (id, name, price) VALUES (?, ?, ?)",
+                    [(sid, name, price) for sid, (name, price) in cfg.DEFAULT_SELLERS.items()]
+                )
+
+    def close(self):
+        self.conn.close()
+
+    def _read_data_version(self) -> int:
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def refresh(self):
+        """Замечает коммиты других процессов и сбрасывает кэш каталога"""
+        version = self._read_data_version()
+        if version != self._data_version:
+            self._data_version = version
+            self.catalog_version += 1
+
+    # === ПОЛЬЗОВАТЕЛИ ===
+    def _user_dict(self, row) -> Dict:
+        return {
+            "username": row["username"],
+            "language": row["language"],
+            "joined": row["joined"],
+            "purchase_count": row["purchase_count"]
+        }
+
+    def add_user(self, user_id: int, username: str = None, language: str = "ru"):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO users (id, username, language, joined) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET username = excluded.username "
+                "WHERE excluded.username IS NOT NULL AND username IS NOT excluded.username",
+                (user_id, username, language, datetime.now().isoformat())
+            )
+
+    def update_username(self, user_id: int, username: str):
+        """Обновляет username пользователя"""
+        with self.conn:
+            self.conn.execute("UPDATE users SET username = ? WHERE id = ?", (username, user_id))
+
+    def find_user_by_username(self, username: str) -> int:
+        """ID пользователя по username (без @, без учёта регистра)"""
+        row = self.conn.execute(
+            "SELECT id FROM users WHERE username = ? COLLATE NOCASE LIMIT 1", (username.lstrip("@"),)
+        ).fetchone()
+        return row["id"] if row else None
+
+    def user_exists(self, user_id: int) -> bool:
+        return self.conn.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone() is not None
+
+    def get_user(self, user_id: int) -> Dict:
+        row = self.conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+        return self._user_dict(row) if row else None
+
+    def get_user_language(self, user_id: int) -> str:
+        row = self.conn.execute("SELECT language FROM users WHERE id = ?", (user_id,)).fetchone()
+        return row["language"] if row else "ru"
+
+    def set_user_language(self, user_id: int, language: str):
+        with self.conn:
+            self.conn.execute("UPDATE users SET language = ? WHERE id = ?", (language, user_id))
+
+    def get_users_count(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def get_all_users(self) -> Dict:
+        rows = self.conn.execute("SELECT * FROM users ORDER BY rowid").fetchall()
+        return {str(row["id"]): self._user_dict(row) for row in rows}
+
+    def iter_user_ids(self, cursor: int = 0, page_size: int = 1000):
+        """Потоково отдаёт (курсор, ID пользователя) страницами по ID.
+
+        Курсор - ID последнего отданного пользователя.
+        """
+        while True:
+            rows = self.conn.execute(
+                "SELECT id FROM users WHERE id > ? ORDER BY id LIMIT ?", (cursor, page_size)
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                cursor = row["id"]
+                yield cursor, cursor
+
+    # === ПРОДАВЦЫ ===
+    def get_sellers(self) -> Dict:
+        rows = self.conn.execute("SELECT id, name, price FROM sellers ORDER BY rowid").fetchall()
+        return {row["id"]: {"name": row["name"], "price": row["price"]} for row in rows}
+
+    def add_seller(self, seller_id: str, name: str, price: float):
+        with self.conn:
+            self.conn.execute("DELETE FROM keys WHERE seller_id = ?", (seller_id,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sellers (id, name, price) VALUES (?, ?, ?)",
+                (seller_id, name, price)
+            )
+        self.catalog_version += 1
+
+    def remove_seller(self, seller_id: str):
+        with self.conn:
+            cur = self.conn.execute("DELETE FROM sellers WHERE id = ?", (seller_id,))
+            # Непроданные ключи удалённого продавца больше нигде не числятся
+            self.conn.execute(
+                "DELETE FROM key_registry WHERE key IN (SELECT key FROM keys WHERE seller_id = ?) AND user_id IS NULL",
+                (seller_id,)
+            )
+            self.conn.execute("DELETE FROM keys WHERE seller_id = ?", (seller_id,))
+        self.catalog_version += 1
+        return cur.rowcount > 0
+
+    def generate_keys(self, seller_id: str, count: int = 10, save: bool = True):
+        """Генерирует count уникальных ключей формата XXXXXXXXXX:xxxxxxxx одной транзакцией
+        (save - как у Database; транзакция стоит O(пачки), поэтому фиксируется всегда)"""
+        keys = []
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            while len(keys) < count:
+                # RETURNING отдаёт только вставленные строки, повторы отсеивает сам реестр
+                batch = self.conn.execute(
+                    "INSERT OR IGNORE INTO key_registry (key, seller_id) SELECT value, ? FROM json_each(?) RETURNING key",
+                    (seller_id, json.dumps(generate_key_batch(count - len(keys))))
+                ).fetchall()
+                keys.extend(row[0] for row in batch)
+            self.conn.execute(
+                "INSERT INTO keys (seller_id, key) SELECT ?, value FROM json_each(?)", (seller_id, json.dumps(keys))
+            )
+        self.catalog_version += 1
+        return keys
+
+    def import_keys(self, seller_id: str, keys: List[str]) -> int:
+        """Добавляет на склад готовые ключи одной транзакцией, пропуская уже выпущенные"""
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            added = [row[0] for row in self.conn.execute(
+                "INSERT OR IGNORE INTO key_registry (key, seller_id) SELECT value, ? FROM json_each(?) RETURNING key",
+                (seller_id, json.dumps(keys))
+            ).fetchall()]
+            self.conn.execute(
+                "INSERT INTO keys (seller_id, key) SELECT ?, value FROM json_each(?)", (seller_id, json.dumps(added))
+            )
+        if added:
+            self.catalog_version += 1
+        return len(added)
+
+    def take_keys(self, seller_id: str, count: int) -> List[str]:
+        """Выдает сразу count ключей или None, если их не хватает"""
+        if count < 1:
+            return None
+        with self.conn:
+            # Блокировка на запись сразу, иначе два процесса выберут одни и те же ключи
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute(
+                "SELECT id, key FROM keys WHERE seller_id = ? ORDER BY id LIMIT ?", (seller_id, count)
+            ).fetchall()
+            if len(rows) < count:
+                return None
+            self.conn.execute("DELETE FROM keys WHERE seller_id = ? AND id <= ?", (seller_id, rows[-1]["id"]))
+        self.catalog_version += 1
+        return [row["key"] for row in rows]
+
+    def get_key(self, seller_id: str) -> str:
+        """Выдает один ключ и удаляет его"""
+        keys = self.take_keys(seller_id, 1)
+        return keys[0] if keys else None
+
+    def get_keys_count(self, seller_id: str) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM keys WHERE seller_id = ?", (seller_id,)).fetchone()[0]
+
+    # === ОТЗЫВЫ ===
+    @staticmethod
+    def _review_dict(row) -> Dict:
+        review = {
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "username": row["username"],
+            "text": row["text"],
+            "date": row["date"]
+        }
+        if row["edited"]:
+            review["edited"] = row["edited"]
+        return review
+
+    def add_review(self, user_id: int, text: str, username: str = None):
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO reviews (user_id, username, text, date) VALUES (?, ?, ?, ?)",
+                (user_id, username, text, datetime.now().isoformat())
+            )
+        return cur.lastrowid
+
+    def delete_review(self, review_id: int):
+        with self.conn:
+            self.conn.execute("DELETE FROM reviews WHERE id = ?", (review_id,))
+
+    def edit_review(self, review_id: int, new_text: str):
+        with self.conn:
+            cur = self.conn.execute(
+                "UPDATE reviews SET text = ?, edited = ? WHERE id = ?",
+                (new_text, datetime.now().isoformat(), review_id)
+            )
+        return cur.rowcount > 0
+
+    def get_reviews(self, limit: int = 20) -> List[Dict]:
+        """Последние limit отзывов, от старых к новым"""
+        rows = self.conn.execute("SELECT * FROM reviews ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [self._review_dict(row) for row in reversed(rows)]
+
+    def get_review_by_id(self, review_id: int) -> Dict:
+        row = self.conn.execute("SELECT * FROM reviews WHERE id = ?", (review_id,)).fetchone()
+        return self._review_dict(row) if row else None
+
+    # === ТЕХПОДДЕРЖКА ===
+    def _ticket_dict(self, row) -> Dict:
+        responses = self.conn.execute(
+            "SELECT admin_id, text, date FROM ticket_responses WHERE ticket_id = ? ORDER BY rowid",
+            (row["id"],)
+        ).fetchall()
+        return {
+            "user_id": row["user_id"],
+            "message": row["message"],
+            "status": row["status"],
+            "created": row["created"],
+            "responses": [dict(r) for r in responses]
+        }
+
+    def create_ticket(self, user_id: int, message: str) -> int:
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO tickets (user_id, message, status, created) VALUES (?, ?, 'open', ?)",
+                (user_id, message, datetime.now().isoformat())
+            )
+        return cur.lastrowid
+
+    def get_ticket(self, ticket_id: int) -> Dict:
+        row = self.conn.execute("SELECT * FROM tickets WHERE id = ?", (ticket_id,)).fetchone()
+        return self._ticket_dict(row) if row else None
+
+    def add_response(self, ticket_id: int, admin_id: int, text: str):
+        with self.conn:
+            if self.conn.execute("SELECT 1 FROM tickets WHERE id = ?", (ticket_id,)).fetchone():
+                self.conn.execute(
+                    "INSERT INTO ticket_responses (ticket_id, admin_id, text, date) VALUES (?, ?, ?, ?)",
+                    (ticket_id, admin_id, text, datetime.now().isoformat())
+                )
+
+    def close_ticket(self, ticket_id: int):
+        with self.conn:
+            self.conn.execute("UPDATE tickets SET status = 'closed' WHERE id = ?", (ticket_id,))
+
+    def get_open_tickets(self) -> Dict:
+        rows = self.conn.execute("SELECT * FROM tickets WHERE status = 'open' ORDER BY id").fetchall()
+        return {row["id"]: self._ticket_dict(row) for row in rows}
+
+    def get_user_tickets(self, user_id: int) -> Dict:
+        """Тикеты пользователя: ID -> тикет"""
+        rows = self.conn.execute("SELECT * FROM tickets WHERE user_id = ? ORDER BY id", (user_id,)).fetchall()
+        return {row["id"]: self._ticket_dict(row) for row in rows}
+
+    # === ПЛАТЕЖИ ===
+    @staticmethod
+    def _payment_dict(row) -> Dict:
+        return {
+            "user_id": row["user_id"],
+            "seller_id": row["seller_id"],
+            "amount": row["amount"],
+            "quantity": row["quantity"],
+            "status": row["status"],
+            "created": row["created"],
+            **({"paid_at": row["paid_at"]} if row["paid_at"] else {})
+        }
+
+    def create_payment(self, user_id: int, seller_id: str, amount: float, quantity: int) -> str:
+        payment_id = generate_payment_id()
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO payments (id, user_id, seller_id, amount, quantity, status, created) "
+                "VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                (payment_id, user_id, seller_id, amount, quantity, datetime.now().isoformat())
+            )
+        return payment_id
+
+    def get_payment(self, payment_id: str) -> Dict:
+        row = self.conn.execute("SELECT * FROM payments WHERE id = ?", (payment_id,)).fetchone()
+        return self._payment_dict(row) if row else None
+
+    def get_pending_payments(self) -> Dict:
+        rows = self.conn.execute("SELECT * FROM payments WHERE status = 'pending' ORDER BY rowid").fetchall()
+        return {row["id"]: self._payment_dict(row) for row in rows}
+
+    def mark_payment_paid(self, payment_id: str) -> bool:
+        """Отмечает, что покупатель сообщил об оплате; такой заказ не истекает"""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE payments SET paid_at = ? WHERE id = ? AND status = 'pending' AND paid_at IS NULL",
+                (datetime.now().isoformat(), payment_id)
+            )
+        row = self.conn.execute("SELECT status FROM payments WHERE id = ?", (payment_id,)).fetchone()
+        return row is not None and row["status"] == "pending"
+
+    def confirm_payment(self, payment_id: str):
+        with self.conn:
+            self.conn.execute("UPDATE payments SET status = 'confirmed' WHERE id = ?", (payment_id,))
+
+    def fulfill_payment(self, payment_id: str) -> Dict:
+        """Выдаёт ключи по оплате одной транзакцией (см. Database.fulfill_payment)"""
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute("SELECT * FROM payments WHERE id = ?", (payment_id,)).fetchone()
+            if not row or row["status"] not in ("pending", "confirmed"):
+                return {"status": "not_found"}
+            payment = self._payment_dict(row)
+            if payment["status"] == "confirmed":
+                # Выданные ключи - в покупке; в старых базах они лежали в платеже
+                purchase = self.conn.execute(
+                    "SELECT keys FROM purchases WHERE payment_id = ? ORDER BY id DESC LIMIT 1", (payment_id,)
+                ).fetchone()
+                keys = purchase["keys"] if purchase else row["keys"]
+                return {"status": "already_confirmed", "payment": payment, "keys": json.loads(keys or "[]")}
+            rows = self.conn.execute(
+                "SELECT id, key FROM keys WHERE seller_id = ? ORDER BY id LIMIT ?",
+                (payment["seller_id"], payment["quantity"])
+            ).fetchall()
+            if len(rows) < payment["quantity"]:
+                return {"status": "not_enough", "payment": payment, "have": len(rows)}
+            keys = [r["key"] for r in rows]
+            self.conn.execute(
+                "DELETE FROM keys WHERE seller_id = ? AND id <= ?", (payment["seller_id"], rows[-1]["id"])
+            )
+            self.conn.execute("UPDATE payments SET status = 'confirmed' WHERE id = ?", (payment_id,))
+            self._insert_purchase(payment["user_id"], payment["seller_id"], keys, payment["amount"], payment_id)
+        self.catalog_version += 1
+        payment["status"] = "confirmed"
+        return {"status": "confirmed", "payment": payment, "keys": keys}
+
+    def expire_payments(self, max_age: float, limit: int = 500) -> int:
+        """Помечает просроченными до limit неоплаченных заказов старше max_age секунд.
+
+        Заказы, об оплате которых сообщил покупатель, не истекают.
+        """
+        cutoff = (datetime.now() - timedelta(seconds=max_age)).isoformat()
+        with self.conn:
+            cur = self.conn.execute(
+                "UPDATE payments SET status = 'expired' WHERE id IN ("
+                "SELECT id FROM payments WHERE status = 'pending' AND paid_at IS NULL AND created < ? LIMIT ?)",
+                (cutoff, limit)
+            )
+        return cur.rowcount
+
+    # === ПОКУПКИ ===
+    def _insert_purchase(self, user_id: int, seller_id: str, keys: list, amount: float,
+                         payment_id: str = None):
+        date = datetime.now().isoformat()
+        self.conn.execute(
+            "INSERT INTO purchases (user_id, seller_id, keys, amount, date, payment_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, seller_id, json.dumps(keys), amount, date, payment_id)
+        )
+        self.conn.execute(
+            "UPDATE key_registry SET seller_id = ?, user_id = ?, sold_at = ? "
+            "WHERE key IN (SELECT value FROM json_each(?))",
+            (seller_id, user_id, date, json.dumps(keys))
+        )
+        self.conn.execute("UPDATE users SET purchase_count = purchase_count + 1 WHERE id = ?", (user_id,))
+
+    def add_purchase(self, user_id: int, seller_id: str, keys: list, amount: float):
+        with self.conn:
+            self._insert_purchase(user_id, seller_id, keys, amount)
+
+    def get_purchase_count(self, user_id: int) -> int:
+        row = self.conn.execute("SELECT purchase_count FROM users WHERE id = ?", (user_id,)).fetchone()
+        return row[0] if row else 0
+
+    def get_purchases(self, user_id: int, offset: int = 0, limit: int = 10) -> List[Dict]:
+        """История покупок от новых к старым, постранично"""
+        rows = self.conn.execute(
+            "SELECT seller_id, keys, amount, date FROM purchases WHERE user_id = ? "
+            "ORDER BY id DESC LIMIT ? OFFSET ?", (user_id, limit, offset)
+        ).fetchall()
+        return [
+            {"seller_id": r["seller_id"], "keys": json.loads(r["keys"]), "amount": r["amount"], "date": r["date"]}
+            for r in rows
+        ]
+
+    # === РЕЕСТР КЛЮЧЕЙ ===
+    @staticmethod
+    def _key_info_dict(row) -> Dict:
+        if row["revoked_at"]:
+            status = "revoked"
+        elif row["user_id"] is not None:
+            status = "sold"
+        else:
+            status = "in_stock"
+        return {
+            "key": row["key"],
+            "seller_id": row["seller_id"],
+            "status": status,
+            "user_id": row["user_id"],
+            "sold_at": row["sold_at"],
+            "revoked_at": row["revoked_at"]
+        }
+
+    def get_key_info(self, key: str) -> Optional[Dict]:
+        row = self.conn.execute("SELECT * FROM key_registry WHERE key = ?", (key,)).fetchone()
+        return self._key_info_dict(row) if row else None
+
+    def revoke_key(self, key: str) -> Optional[Dict]:
+        """Отзывает ключ: непроданный убирается со склада. Возвращает новое состояние или None"""
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute("SELECT * FROM key_registry WHERE key = ?", (key,)).fetchone()
+            if row is None or row["revoked_at"]:
+                return self._key_info_dict(row) if row else None
+            if row["user_id"] is None:
+                self.conn.execute("DELETE FROM keys WHERE seller_id = ? AND key = ?", (row["seller_id"], key))
+            self.conn.execute("UPDATE key_registry SET revoked_at = ? WHERE key = ?", (datetime.now().isoformat(), key))
+            row = self.conn.execute("SELECT * FROM key_registry WHERE key = ?", (key,)).fetchone()
+        self.catalog_version += 1
+        return self._key_info_dict(row)
+
+    # === СТАТИСТИКА ===
+    def get_stats(self) -> Dict:
+        """Сводка для админки из счётчиков, которые ведут триггеры"""
+        stats = {"users": 0, "open_tickets": 0, "pending_payments": 0, "stock": {}, "revenue": {}, "sales": {}}
+        # Продавец без ключей есть в сводке с нулём, как и в JSON-базе
+        for row in self.conn.execute("SELECT id FROM sellers"):
+            stats["stock"][row["id"]] = 0
+        for row in self.conn.execute("SELECT name, value FROM stats"):
+            kind, _, seller_id = row["name"].partition(":")
+            if seller_id:
+                stats[kind][seller_id] = row["value"] if kind == "revenue" else int(row["value"])
+            else:
+                stats[kind] = int(row["value"])
+        return stats
+
+    # === РАССЫЛКИ ===
+    def create_broadcast(self, text: str) -> int:
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO broadcasts (text, status, created) VALUES (?, 'running', ?)",
+                (text, datetime.now().isoformat())
+            )
+        return cur.lastrowid
+
+    def get_broadcast(self, broadcast_id: int) -> Dict:
+        row = self.conn.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,)).fetchone()
+        return {k: row[k] for k in row.keys() if k != "id"} if row else None
+
+    def update_broadcast(self, broadcast_id: int, **fields):
+        columns = ", ".join(f"{k} = ?" for k in fields)
+        with self.conn:
+            self.conn.execute(f"UPDATE broadcasts SET {columns} WHERE id = ?", (*fields.values(), broadcast_id))
+
+    def get_unfinished_broadcasts(self) -> Dict:
+        rows = self.conn.execute("SELECT id FROM broadcasts WHERE status = 'running'").fetchall()
+        return {row["id"]: self.get_broadcast(row["id"]) for row in rows}
+
+    # === НЕДОСТАВЛЕННЫЕ СООБЩЕНИЯ ===
+    def add_dead_letter(self, letter: Dict):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO dead_letters (chat_id, text, kwargs, error, attempts, date) VALUES (?, ?, ?, ?, ?, ?)",
+                (letter["chat_id"], letter["text"], json.dumps(letter["kwargs"]),
+                 letter["error"], letter["attempts"], letter["date"])
+            )
+
+    def get_dead_letters(self) -> List[Dict]:
+        rows = self.conn.execute("SELECT * FROM dead_letters ORDER BY id").fetchall()
+        return [self._dead_letter_dict(row) for row in rows]
+
+    def pop_dead_letters(self) -> List[Dict]:
+        """Забирает все недоставленные сообщения (для повторной отправки)"""
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            letters = self.get_dead_letters()
+            self.conn.execute("DELETE FROM dead_letters")
+        return letters
+
+    @staticmethod
+    def _dead_letter_dict(row) -> Dict:
+        return {
+            "chat_id": row["chat_id"],
+            "text": row["text"],
+            "kwargs": json.loads(row["kwargs"]),
+            "error": row["error"],
+            "attempts": row["attempts"],
+            "date": row["date"]
+        }
+
+
+def migrate_from_json(json_path: str, sqlite_path: str):
+    """Перенос данных из bot_data.json в SQLite.
+    
+    Строки с ID обновляются (upsert), строки без ID (ключи склада, ответы
+    тикетов, покупки, недоставленные сообщения) не дублируются, поэтому
+    перенос можно запускать повторно.
+    """
+    data = load_snapshot(json_path)
+    # Режимы journal и shared: изменения после последней свёртки лежат в
+    # журнале. Файлы источника не трогаем - недописанный хвост пропускается
+    Journal(json_path + ".wal").replay(data, data.get("meta", {}).get("journal_seq", 0), truncate=False)
+    sellers = data.get("sellers", {})
+    tickets = data.get("tickets", {})
+
+    store = SQLiteDatabase(sqlite_path)
+    conn = store.conn
+    with conn:
+        # Продавцы по умолчанию, созданные новой базой, заменяются продавцами из JSON
+        placeholders = ", ".join("?" * len(sellers))
+        conn.execute(f"DELETE FROM keys WHERE seller_id NOT IN ({placeholders})", list(sellers))
+        conn.execute(f"DELETE FROM sellers WHERE id NOT IN ({placeholders})", list(sellers))
+        for uid, u in data.get("users", {}).items():
+            conn.execute(
+                "INSERT INTO users (id, username, language, joined) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET username = excluded.username, language = excluded.language",
+                (int(uid), u.get("username"), u.get("language", "ru"), u.get("joined") or datetime.now().isoformat())
+            )
+            for p in u.get("purchases", []):
+                _insert_missing_purchase(conn, int(uid), p)
+        # Журнал покупок (bot_data.json.purchases.jsonl): только сохранённые
+        # покупки. В базе до отметок commit покупка по платежу считалась по
+        # статусу платежа, а подтверждённые платежи лежали в pending_payments
+        meta = data.get("meta", {})
+        payments = dict(data.get("pending_payments", {}))
+        legacy = {pid for pid, p in payments.items() if p["status"] == "confirmed"}
+        ledger = PurchaseLedger(json_path + ".purchases.jsonl")
+        for p in ledger.iter_records(also=legacy if "ledger_checked" not in meta else frozenset()):
+            _insert_missing_purchase(conn, p["user_id"], p)
+            if p.get("payment_id") and p["payment_id"] not in legacy:
+                payments[p["payment_id"]] = {
+                    "user_id": p["user_id"], "seller_id": p["seller_id"], "amount": p["amount"],
+                    "quantity": len(p["keys"]), "status": "confirmed", "created": p["date"]
+                }
+        # Подтверждённые без выдачи ключей (confirm_payment) - в архиве платежей
+        if os.path.exists(json_path + ".payments_archive.jsonl"):
+            with open(json_path + ".payments_archive.jsonl", 'r', encoding='utf-8') as f:
+                for line in f:
+                    p = json.loads(line)
+                    if p["status"] == "confirmed":
+                        payments.setdefault(p["id"], p)
+        conn.execute("UPDATE users SET purchase_count = (SELECT COUNT(*) FROM purchases WHERE user_id = users.id)")
+        for sid, s in sellers.items():
+            conn.execute(
+                "INSERT INTO sellers (id, name, price) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET name = excluded.name, price = excluded.price",
+                (sid, s["name"], s["price"])
+            )
+            # Склад переносится целиком - в JSON он и есть источник истины
+            conn.execute("DELETE FROM keys WHERE seller_id = ?", (sid,))
+            conn.executemany("INSERT INTO keys (seller_id, key) VALUES (?, ?)", [(sid, k) for k in s.get("keys", [])])
+        for r in data.get("reviews", []):
+            if r.get("deleted"):
+                continue
+            conn.execute(
+                "INSERT INTO reviews (id, user_id, username, text, date, edited) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET text = excluded.text, edited = excluded.edited",
+                (r["id"], r.get("user_id"), r.get("username"), r["text"], r["date"], r.get("edited"))
+            )
+        for tid, t in tickets.items():
+            conn.execute(
+                "INSERT INTO tickets (id, user_id, message, status, created) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET status = excluded.status",
+                (int(tid), t["user_id"], t.get("message"), t["status"], t["created"])
+            )
+            conn.execute("DELETE FROM ticket_responses WHERE ticket_id = ?", (int(tid),))
+            conn.executemany(
+                "INSERT INTO ticket_responses (ticket_id, admin_id, text, date) VALUES (?, ?, ?, ?)",
+                [(int(tid), r["admin_id"], r["text"], r["date"]) for r in t.get("responses", [])]
+            )
+        for pid, p in payments.items():
+            conn.execute(
+                "INSERT INTO payments (id, user_id, seller_id, amount, quantity, status, created, paid_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET status = excluded.status, paid_at = excluded.paid_at",
+                (pid, p["user_id"], p["seller_id"], p["amount"], p["quantity"], p["status"], p["created"],
+                 p.get("paid_at"))
+            )
+        for bid, b in data.get("broadcasts", {}).items():
+            conn.execute(
+                "INSERT INTO broadcasts (id, text, status, cursor, sent, failed, created, finished) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET status = excluded.status, cursor = excluded.cursor, "
+                "sent = excluded.sent, failed = excluded.failed, finished = excluded.finished",
+                (int(bid), b["text"], b["status"], b.get("cursor", 0), b.get("sent", 0), b.get("failed", 0),
+                 b["created"], b.get("finished"))
+            )
+        for letter in data.get("dead_letters", []):
+            conn.execute(
+                "INSERT INTO dead_letters (chat_id, text, kwargs, error, attempts, date) "
+                "SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS "
+                "(SELECT 1 FROM dead_letters WHERE chat_id = ? AND date = ? AND text = ?)",
+                (letter["chat_id"], letter["text"], json.dumps(letter.get("kwargs", {})), letter.get("error"),
+                 letter.get("attempts", 0), letter["date"], letter["chat_id"], letter["date"], letter["text"])
+            )
+        # ID не должны повторно выдаваться после удалённых в JSON отзывов и тикетов
+        for table, seq in (("reviews", "review_seq"), ("tickets", "ticket_seq"), ("broadcasts", "broadcast_seq")):
+            if meta.get(seq):
+                conn.execute("DELETE FROM sqlite_sequence WHERE name = ? AND seq < ?", (table, meta[seq]))
+                conn.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? "
+                    "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+                    (table, meta[seq], table)
+                )
+    # Склад и платежи перезалиты целиком - счётчики проще пересчитать
+    store._rebuild_stats()
+    store._register_keys()
+    with conn:
+        for key, revoked in data.get("revoked_keys", {}).items():
+            conn.execute(
+                "INSERT INTO key_registry (key, seller_id, revoked_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET revoked_at = excluded.revoked_at",
+                (key, revoked["seller_id"], revoked["revoked_at"])
+            )
+    store.close()
+
+
+def _insert_missing_purchase(conn, user_id: int, p: Dict):
+    """Покупка без ID: вставляется, только если такой ещё нет"""
+    keys = json.dumps(p["keys"])
+    conn.execute(
+        "INSERT INTO purchases (user_id, seller_id, keys, amount, date, payment_id) SELECT ?, ?, ?, ?, ?, ? "
+        "WHERE NOT EXISTS (SELECT 1 FROM purchases WHERE user_id = ? AND date = ? AND keys = ?)",
+        (user_id, p["seller_id"], keys, p["amount"], p["date"], p.get("payment_id"),
+         user_id, p["date"], keys)
+    )
+
+
+if __name__ == "__main__":
+    # python sqlite_db.py [bot_data.json] [bot_data.sqlite3]
+    src = sys.argv[1] if len(sys.argv) > 1 else "bot_data.json"
+    dst = sys.argv[2] if len(sys.argv) > 2 else cfg.SQLITE_FILE
+    migrate_from_json(src, dst)
+    print(f"Данные перенесены: {src} -> {dst}")
@@ -0,0 +1,30 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# config читает окружение при импорте, а database при импорте открывает
+# bot_data.json в текущей папке - до импорта уходим во временную
+os.environ.setdefault("BOT_TOKEN", "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA")
+os.environ.setdefault("ADMIN_ID", "999")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="p2ebot-tests-"))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    """Каждый тест работает со своими файлами базы"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def compact_every(monkeypatch):
+    """Меняет порог свёртки журнала (cfg заморожен - подменяется целиком)"""
+    import dataclasses
+    import database
+
+    def set_threshold(records: int):
+        monkeypatch.setattr(database, "cfg", dataclasses.replace(database.cfg, JOURNAL_COMPACT_EVERY=records))
+    return set_threshold
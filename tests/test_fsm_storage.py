@@ -0,0 +1,95 @@
+import asyncio
+import sqlite3
+
+import pytest
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+import fsm_storage
+from fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+OTHER = StorageKey(bot_id=1, chat_id=20, user_id=20)
+
+
+class Form(StatesGroup):
+    text = State()
+
+
+def rows(path: str) -> int:
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM fsm").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_state_survives_restart():
+    async def main():
+        storage = SQLiteStorage("fsm.sqlite3", ttl=60)
+        await storage.set_state(KEY, Form.text)
+        await storage.update_data(KEY, {"seller_id": "seller_1"})
+        await storage.close()
+
+        storage = SQLiteStorage("fsm.sqlite3", ttl=60)
+        assert await storage.get_state(KEY) == Form.text.state
+        assert await storage.get_data(KEY) == {"seller_id": "seller_1"}
+        assert await storage.get_state(OTHER) is None
+        await storage.close()
+    asyncio.run(main())
+
+
+def test_cleared_record_is_deleted():
+    async def main():
+        storage = SQLiteStorage("fsm.sqlite3", ttl=60)
+        await storage.set_state(KEY, Form.text)
+        await storage.set_data(KEY, {"a": 1})
+        assert rows("fsm.sqlite3") == 1
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        assert rows("fsm.sqlite3") == 0
+        with pytest.raises(DataNotDictLikeError):
+            await storage.set_data(KEY, [1])
+        await storage.close()
+    asyncio.run(main())
+
+
+def test_returned_data_is_a_copy():
+    async def main():
+        storage = SQLiteStorage("fsm.sqlite3", ttl=60)
+        data = {"a": 1}
+        await storage.set_data(KEY, data)
+        data["a"] = 2
+        (await storage.get_data(KEY))["a"] = 3
+        assert await storage.get_data(KEY) == {"a": 1}
+        await storage.close()
+    asyncio.run(main())
+
+
+def test_cleanup_drops_abandoned_states(monkeypatch):
+    async def main():
+        storage = SQLiteStorage("fsm.sqlite3", ttl=60)
+        now = 1000.0
+        monkeypatch.setattr(fsm_storage.time, "time", lambda: now)
+        await storage.set_state(KEY, Form.text)
+        now += 50
+        await storage.set_state(OTHER, Form.text)
+        now += 20
+        assert storage.cleanup() == 1
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_state(OTHER) == Form.text.state
+        await storage.close()
+    asyncio.run(main())
+
+
+def test_without_cache_sees_other_process():
+    async def main():
+        first = SQLiteStorage("fsm.sqlite3", ttl=60, cache=False)
+        second = SQLiteStorage("fsm.sqlite3", ttl=60, cache=False)
+        assert await first.get_state(KEY) is None
+        await second.set_state(KEY, Form.text)
+        assert await first.get_state(KEY) == Form.text.state
+        await first.close()
+        await second.close()
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+from database import Database
+
+
+def reviews(db: Database) -> dict:
+    return {review["id"]: review["text"] for review in db.get_reviews(1000)}
+
+
+def test_replay_after_crash(workdir):
+    db = Database("shop.json", "journal")
+    db.add_user(1, "alice")
+    keys = db.generate_keys("seller_1", 5)
+    db.take_keys("seller_1", 2)
+    db.add_review(1, "hello")
+    db.journal.close()  # процесс умер без close()
+
+    db = Database("shop.json", "journal")
+    assert db.get_user(1)["username"] == "alice"
+    assert db.get_keys_count("seller_1") == 3
+    assert db.take_keys("seller_1", 3) == keys[2:]
+    assert list(reviews(db).values()) == ["hello"]
+    db.close()
+
+
+def test_crash_during_compaction(compact_every):
+    """Свёртка журнала не дописала снимок: удаления и правки отзывов не теряются, id не повторяются"""
+    compact_every(50)
+    db = Database("shop.json", "journal")
+    ids = [db.add_review(1, f"r{i}") for i in range(300)]
+    # Фоновая свёртка "падает" до записи снимка
+    db._finish_compaction = lambda sections: None
+    for review_id in ids[:150]:
+        db.delete_review(review_id)
+    for review_id in ids[150:200]:
+        db.edit_review(review_id, f"edited {review_id}")
+    expected = reviews(db)
+    db.journal.close()
+
+    db = Database("shop.json", "journal")
+    assert reviews(db) == expected
+    alive = [review["id"] for review in db.data["reviews"] if not review.get("deleted")]
+    assert len(alive) == len(set(alive)) == 150
+    assert db.add_review(1, "new") not in ids
+    db.close()
+
+
+def test_leftover_journal_after_mode_switch(workdir):
+    """Журнал, оставшийся от режима "journal", накатывается и в режиме "snapshot" """
+    db = Database("shop.json", "journal")
+    db.add_user(1, "alice")
+    db.journal.close()
+
+    db = Database("shop.json", "snapshot")
+    assert db.get_user(1)["username"] == "alice"
+    db.close()
+    # Записи журнала перенесены в снимок, сам журнал очищен
+    wal = workdir / "shop.json.wal"
+    assert not wal.exists() or wal.stat().st_size == 0
+
+    db = Database("shop.json", "journal")
+    assert db.get_user(1)["username"] == "alice"
+    db.close()
+
+
+def test_failed_compaction_keeps_journal(compact_every):
+    """Снимок свёртки не записался: следующая свёртка не затирает отложенный журнал"""
+    compact_every(10)
+    db = Database("shop.json", "journal")
+
+    def disk_full(sections):
+        raise OSError(28, "No space left on device")
+    db._write_snapshot = disk_full
+    for user_id in range(1, 21):
+        db.add_user(user_id, f"user{user_id}")
+        if db._compactor:
+            db._compactor.join()
+    db.journal.close()  # процесс умер до записи второго снимка
+
+    db = Database("shop.json", "journal")
+    assert db.get_users_count() == 20
+    assert db.get_user(1)["username"] == "user1"
+    db.close()
@@ -0,0 +1,49 @@
+import asyncio
+
+from database import Database
+from key_import import import_file, iter_chunks
+from keygen import generate_key_batch
+
+
+def stats() -> dict:
+    return {"lines": 0, "added": 0, "duplicates": 0, "invalid": 0}
+
+
+def test_iter_chunks_parses_lines():
+    keys = generate_key_batch(5)
+    lines = [
+        "key\n",
+        f"{keys[0]}\n",
+        "\n",
+        "# комментарий\n",
+        f"{keys[1]},seller_1,2026-01-01\n",
+        f'"{keys[2]}";x\n',
+        f"  {keys[3]}\t\n",
+        "too-short\n",
+        f"{keys[4]}x\n",
+        keys[4]
+    ]
+    counters = stats()
+    chunks = list(iter_chunks(lines, counters, chunk_size=2))
+    assert chunks == [keys[:2], keys[2:4], keys[4:]]
+    assert counters["lines"] == len(lines)
+    assert counters["invalid"] == 2
+
+
+def test_header_only_on_first_line():
+    counters = stats()
+    assert list(iter_chunks(["KEY\n", "key\n"], counters)) == []
+    assert counters["invalid"] == 1
+
+
+def test_import_file(workdir):
+    keys = generate_key_batch(5)
+    db = Database("shop.json", "snapshot")
+    issued = db.generate_keys("seller_1", 1)
+    (workdir / "keys.csv").write_text(
+        "key,comment\n" + "".join(f"{key},x\n" for key in keys + keys[:2] + issued) + "bad\n", encoding="utf-8-sig"
+    )
+    result = asyncio.run(import_file(db, "seller_1", "keys.csv", chunk_size=3))
+    assert result == {"lines": 10, "added": 5, "duplicates": 3, "invalid": 1}
+    assert db.take_keys("seller_1", 6) == issued + keys
+    db.close()
@@ -0,0 +1,87 @@
+import pytest
+
+from database import Database
+
+
+class Crash(Exception):
+    pass
+
+
+def crash(*args):
+    raise Crash
+
+
+def paid_order(mode: str) -> str:
+    db = Database("shop.json", mode)
+    db.add_user(1, "alice")
+    db.generate_keys("seller_1", 3)
+    payment_id = db.create_payment(1, "seller_1", 2.0, 1)
+    db.close()
+    return payment_id
+
+
+def abandon(db: Database):
+    """Процесс умер: close() не вызывается"""
+    if db.journal:
+        db.journal.close()
+
+
+@pytest.mark.parametrize("mode", ["snapshot", "journal", "shared"])
+def test_crash_before_save(mode):
+    """Покупка записана в журнал покупок, база не сохранилась: повторное подтверждение выдаёт ключ один раз"""
+    payment_id = paid_order(mode)
+    db = Database("shop.json", mode)
+    db._commit = crash
+    with pytest.raises(Crash):
+        db.fulfill_payment(payment_id)
+    abandon(db)
+
+    db = Database("shop.json", mode)
+    assert db.get_purchases(1) == []
+    result = db.fulfill_payment(payment_id)
+    assert result["status"] == "confirmed"
+    assert len(db.get_purchases(1)) == 1
+    assert db.get_keys_count("seller_1") == 2
+    assert db.get_stats()["revenue"] == {"seller_1": 2.0}
+    db.close()
+
+
+@pytest.mark.parametrize("mode", ["snapshot", "journal", "shared"])
+def test_crash_before_commit_mark(mode):
+    """База сохранилась, отметка commit нет: после запуска покупка считается, платёж не повторяется"""
+    payment_id = paid_order(mode)
+    db = Database("shop.json", mode)
+    db.ledger.commit = crash
+    with pytest.raises(Crash):
+        db.fulfill_payment(payment_id)
+    abandon(db)
+
+    db = Database("shop.json", mode)
+    purchases = db.get_purchases(1)
+    assert len(purchases) == 1
+    result = db.fulfill_payment(payment_id)
+    assert result["status"] == "already_confirmed"
+    assert result["keys"] == purchases[0]["keys"]
+    assert db.get_keys_count("seller_1") == 2
+    assert db.get_stats()["revenue"] == {"seller_1": 2.0}
+    db.close()
+
+
+@pytest.mark.parametrize("mode", ["snapshot", "journal", "shared"])
+def test_torn_last_line(mode):
+    """Недописанная при сбое строка отрезается, следующая покупка читается"""
+    first = paid_order(mode)
+    db = Database("shop.json", mode)
+    db.fulfill_payment(first)
+    second = db.create_payment(1, "seller_1", 2.0, 1)
+    db.close()
+    with open("shop.json.purchases.jsonl", "ab") as f:
+        f.write(b'{"user_id":1,"seller_id":"seller_1","ke')
+
+    db = Database("shop.json", mode)
+    assert db.fulfill_payment(second)["status"] == "confirmed"
+    assert len(db.get_purchases(1)) == 2
+    assert len(db.generate_keys("seller_1", 2)) == 2
+    db.close()
+    with open("shop.json.purchases.jsonl", "rb") as f:
+        assert all(line.endswith(b"}\n") for line in f)
@@ -0,0 +1,90 @@
+import asyncio
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from database import Database
+from outbox import Outbox
+from ratelimit import TokenBucket
+
+
+class FakeBot:
+    """send_message, который падает заданное число раз для заданных текстов"""
+
+    def __init__(self, network=None, forbidden=(), retry_after=()):
+        self.sent = []
+        self.network = dict(network or {})
+        self.forbidden = set(forbidden)
+        self.retry_after = set(retry_after)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        method = SendMessage(chat_id=chat_id, text=text)
+        if text in self.retry_after:
+            self.retry_after.discard(text)
+            raise TelegramRetryAfter(method, "flood", 0)
+        if self.network.get(text):
+            self.network[text] -= 1
+            raise TelegramNetworkError(method, "network")
+        if text in self.forbidden:
+            raise TelegramForbiddenError(method, "bot was blocked by the user")
+        self.sent.append((chat_id, text))
+
+
+def run(bot: FakeBot, db, messages, retries: int = 3, workers: int = 1):
+    async def main():
+        outbox = Outbox(bot, db, workers, retries, 0.01, TokenBucket(1000))
+        outbox.start()
+        for chat_id, text, on_fail in messages:
+            outbox.send(chat_id, text, on_fail=on_fail)
+        await outbox.close(5)
+        assert outbox.pending() == 0
+    asyncio.run(main())
+
+
+def test_retry_keeps_chat_order():
+    """Сообщение ждёт повтора - следующие в тот же чат за ним, другие чаты не ждут"""
+    db = Database("shop.json", "snapshot")
+    bot = FakeBot(network={"a1": 2}, retry_after={"b2"})
+    run(bot, db, [(1, "a1", None), (1, "a2", None), (2, "b1", None), (2, "b2", None), (1, "a3", None)])
+    assert [text for chat_id, text in bot.sent if chat_id == 1] == ["a1", "a2", "a3"]
+    assert [text for chat_id, text in bot.sent if chat_id == 2] == ["b1", "b2"]
+    assert bot.sent[0] == (2, "b1")
+    assert db.get_dead_letters() == []
+    db.close()
+
+
+def test_undelivered_go_to_dead_letters():
+    db = Database("shop.json", "snapshot")
+    errors = []
+
+    async def on_fail(error: str):
+        errors.append(error)
+
+    bot = FakeBot(network={"lost": 10}, forbidden={"blocked"})
+    run(bot, db, [(1, "lost", None), (2, "blocked", on_fail), (2, "after", None)], retries=2)
+    letters = {letter["text"]: letter for letter in db.get_dead_letters()}
+    assert letters.keys() == {"lost", "blocked"}
+    # Сетевые сбои повторяются retries раз, блокировка - нет
+    assert letters["lost"]["attempts"] == 3
+    assert letters["blocked"]["attempts"] == 1
+    assert len(errors) == 1 and "blocked" in errors[0]
+    assert bot.sent == [(2, "after")]
+    db.close()
+
+
+def test_requeue_dead_letters():
+    db = Database("shop.json", "snapshot")
+    run(FakeBot(forbidden={"hello"}), db, [(1, "hello", None)])
+    assert len(db.get_dead_letters()) == 1
+
+    bot = FakeBot()
+
+    async def main():
+        outbox = Outbox(bot, db, 1, 3, 0.01, TokenBucket(1000))
+        outbox.start()
+        assert outbox.requeue_dead() == 1
+        await outbox.close(5)
+    asyncio.run(main())
+    assert bot.sent == [(1, "hello")]
+    assert db.get_dead_letters() == []
+    db.close()
@@ -0,0 +1,95 @@
+import copy
+import random
+
+import pytest
+
+from database import Database
+
+INDEXES = ("_users_by_id", "_user_ids_by_name", "_user_ids", "_review_pos", "_review_tombstones",
+           "_open_tickets", "_tickets_by_user", "_pending")
+
+
+def indexes(db: Database) -> dict:
+    return {name: copy.deepcopy(db.__dict__.get(name)) for name in INDEXES}
+
+
+def random_step(db: Database, rng: random.Random, keys: list):
+    user_id = rng.randint(1, 30)
+    roll = rng.random()
+    if roll < 0.15:
+        db.add_user(user_id, f"user{user_id}_{rng.randint(1, 3)}")
+    elif roll < 0.2:
+        db.update_username(user_id, f"user{user_id}_{rng.randint(1, 3)}")
+    elif roll < 0.3:
+        db.add_review(user_id, "text")
+    elif roll < 0.4:
+        reviews = db.get_reviews(50)
+        if reviews:
+            review_id = rng.choice(reviews)["id"]
+            if roll < 0.35:
+                db.delete_review(review_id)
+            else:
+                db.edit_review(review_id, "edited")
+    elif roll < 0.5:
+        db.create_ticket(user_id, "help")
+    elif roll < 0.6:
+        db.create_payment(user_id, "seller_1", 1.0, rng.randint(1, 2))
+    elif roll < 0.75:
+        payments = list(db.get_pending_payments())
+        if payments:
+            if roll < 0.7:
+                db.fulfill_payment(rng.choice(payments))
+            else:
+                db.mark_payment_paid(rng.choice(payments))
+    elif roll < 0.85:
+        keys += db.generate_keys("seller_1", rng.randint(1, 5))
+    elif roll < 0.88:
+        info = db.get_key_info(rng.choice(keys)) if keys else None
+        if info:
+            db.revoke_key(info["key"])
+    elif roll < 0.9:
+        db.take_keys("seller_1", 1)
+    else:
+        db.expire_payments(0, 3)
+
+
+@pytest.mark.parametrize("seed", range(4))
+@pytest.mark.parametrize("threshold", [40, 100000])
+def test_peer_changes_match_rebuild(seed, threshold, compact_every):
+    """Индексы, поправленные по чужим записям журнала, совпадают с построенными заново"""
+    compact_every(threshold)
+    rng = random.Random(seed)
+    first = Database("shop.json", "shared")
+    second = Database("shop.json", "shared")
+    keys = ["NOPE"]
+    for step in range(200):
+        db, other = (first, second) if rng.random() < 0.5 else (second, first)
+        random_step(db, rng, keys)
+        other.refresh()
+        got = indexes(other)
+        got_keys = {key: other.get_key_info(key) for key in keys}
+        other._build_indexes()
+        assert indexes(other) == got, step
+        assert {key: other.get_key_info(key) for key in keys} == got_keys, step
+        assert {key: db.get_key_info(key) for key in keys} == got_keys, step
+    first.close()
+    second.close()
+
+
+def test_writes_of_both_processes_survive(compact_every):
+    compact_every(10)
+    first = Database("shop.json", "shared")
+    second = Database("shop.json", "shared")
+    for user_id in range(50):
+        (first if user_id % 2 else second).add_user(user_id, f"user{user_id}")
+    keys = first.generate_keys("seller_1", 10) + second.generate_keys("seller_1", 10)
+    assert len(set(keys)) == 20
+    assert first.take_keys("seller_1", 5) == keys[:5]
+    assert second.take_keys("seller_1", 5) == keys[5:10]
+    first.close()
+    second.close()
+
+    db = Database("shop.json", "snapshot")
+    assert db.get_users_count() == 50
+    assert db.take_keys("seller_1", 10) == keys[10:]
+    db.close()
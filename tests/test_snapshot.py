@@ -0,0 +1,163 @@
+import asyncio
+import dataclasses
+import os
+import threading
+
+import pytest
+
+import database
+from database import Database
+from inventory import KeyInventory
+from snapshot import CODECS, load_snapshot
+
+
+def corrupt(path):
+    """Портит байт в середине файла - контрольная сумма не сойдётся"""
+    with open(path, "r+b") as f:
+        f.seek(os.path.getsize(path) // 2)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+
+def test_recover_from_previous_generation(workdir):
+    db = Database("shop.json", "snapshot")
+    db.add_user(1, "alice")
+    db.add_user(2, "bob")
+    db.close()
+    corrupt("shop.json")
+
+    db = Database("shop.json", "snapshot")
+    # Последнее изменение было только в испорченном снимке
+    assert db.get_user(1)["username"] == "alice"
+    assert db.get_user(2) is None
+    db.close()
+    assert (workdir / "shop.json.corrupt").exists()
+    # Основной снимок переписан и снова читается
+    assert load_snapshot("shop.json")["users"].keys() == {"1"}
+
+    db = Database("shop.json", "snapshot")
+    assert not db._restored
+    assert db.get_user(1)["username"] == "alice"
+    db.close()
+
+
+def test_startup_does_not_write_unchanged_snapshot(workdir):
+    db = Database("shop.json", "snapshot")
+    db.add_user(1, "alice")
+    db.close()
+    before = os.stat("shop.json")
+    files = sorted(os.listdir(workdir))
+
+    db = Database("shop.json", "snapshot")
+    db.get_user(1)
+    db.close()
+    after = os.stat("shop.json")
+    assert (after.st_ino, after.st_mtime_ns) == (before.st_ino, before.st_mtime_ns)
+    assert sorted(os.listdir(workdir)) == files
+
+
+@pytest.mark.parametrize("codec", list(CODECS))
+def test_switch_codec(codec):
+    db = Database("shop.json", "snapshot", codec="json")
+    db.add_user(1, "alice")
+    keys = db.generate_keys("seller_1", 3)
+    db.close()
+
+    db = Database("shop.json", "snapshot", codec=codec)
+    db.add_user(2, "bob")
+    db.close()
+
+    db = Database("shop.json", "snapshot", codec="json")
+    assert db.get_user(1)["username"] == "alice"
+    assert db.get_user(2)["username"] == "bob"
+    assert db.take_keys("seller_1", 3) == keys
+    db.close()
+
+
+def test_sectioned_data_sees_unloaded_sections():
+    db = Database("shop.json", "snapshot")
+    db.add_user(1, "alice")
+    db.close()
+
+    db = Database("shop.json", "snapshot")
+    data = db.data
+    assert not data.is_loaded("users")
+    assert "users" in data.keys() and "users" in list(data)
+    assert len(data) == len(load_snapshot("shop.json"))
+    assert not data.is_loaded("users")
+    assert dict(data.items())["users"]["1"]["username"] == "alice"
+    copy = data.copy()
+    assert copy.keys() == load_snapshot("shop.json").keys()
+    assert copy["users"] == load_snapshot("shop.json")["users"]
+    db.close()
+
+
+def test_recover_from_previous_generation_with_journal(workdir):
+    """Журнал поверх повреждённого снимка не накатывается на старое поколение"""
+    db = Database("shop.json", "journal")
+    db._save()
+    for text in ("a", "b", "c"):
+        db.add_review(1, text)
+    db._save()
+    db.delete_review(3)
+    db.journal.close()
+    corrupt("shop.json")
+
+    db = Database("shop.json", "journal")
+    assert db.get_reviews() == []
+    assert (workdir / "shop.json.wal.orphaned").exists()
+    db.add_review(1, "d")
+    db.journal.close()
+
+    db = Database("shop.json", "journal")
+    assert [review["text"] for review in db.get_reviews()] == ["d"]
+    db.close()
+
+
+def test_deferred_flush_encodes_stock_in_writer(monkeypatch):
+    """Отложенная запись: event loop только копирует склад, ключи кодирует поток записи"""
+    monkeypatch.setattr(database, "cfg", dataclasses.replace(database.cfg, FLUSH_DELAY=0))
+    threads = []
+    to_list = KeyInventory.to_list
+    monkeypatch.setattr(KeyInventory, "to_list",
+                        lambda self: threads.append(threading.current_thread()) or to_list(self))
+
+    async def flushed(db: Database):
+        await asyncio.sleep(0)
+        while db._flush_handle or db._flush_future:
+            await asyncio.sleep(0.01)
+
+    async def main():
+        db = Database("shop.json", "deferred")
+        # Первый снимок пишется при открытии - синхронно
+        threads.clear()
+        keys = db.generate_keys("seller_1", 5)
+        await flushed(db)
+        assert db.take_keys("seller_1", 1) == keys[:1]
+        await flushed(db)
+        db.close()
+        return keys
+
+    keys = asyncio.run(main())
+    assert threads and threading.main_thread() not in threads
+    db = Database("shop.json", "snapshot")
+    assert db.take_keys("seller_1", 4) == keys[1:]
+    db.close()
+
+
+def test_chunked_generation_writes_snapshot_once(monkeypatch):
+    """Генерация частями в режиме snapshot: снимок пишет только последняя часть"""
+    db = Database("shop.json", "snapshot")
+    writes = []
+    write = db._write_snapshot
+    monkeypatch.setattr(db, "_write_snapshot", lambda sections: writes.append(sections) or write(sections))
+    keys = db.generate_keys("seller_1", 3, save=False) + db.generate_keys("seller_1", 3, save=False)
+    assert writes == []
+    keys += db.generate_keys("seller_1", 3)
+    assert len(writes) == 1
+    db.close()
+
+    db = Database("shop.json", "snapshot")
+    assert db.take_keys("seller_1", 9) == keys
+    db.close()
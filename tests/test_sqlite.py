@@ -0,0 +1,67 @@
+import pytest
+
+from database import Database
+from sqlite_db import SQLiteDatabase, migrate_from_json
+
+
+def fill(db):
+    """Одинаковые действия для любого хранилища: (ключи склада, оплаченный платёж)"""
+    for user_id in range(1, 6):
+        db.add_user(user_id, f"user{user_id}")
+    keys = db.generate_keys("seller_1", 10)
+    payment_id = db.create_payment(1, "seller_1", 5.0, 2)
+    assert db.fulfill_payment(payment_id)["keys"] == keys[:2]
+    db.create_payment(2, "seller_1", 5.0, 1)
+    db.add_review(1, "a")
+    db.delete_review(db.add_review(2, "b"))
+    db.add_response(db.create_ticket(1, "help"), 999, "ok")
+    db.revoke_key(keys[-1])
+    db.add_dead_letter({"chat_id": 1, "text": "x", "kwargs": {}, "error": "e", "attempts": 3, "date": "2026-01-01"})
+    return keys, payment_id
+
+
+def summary(db, keys: list, payment_id: str) -> dict:
+    """То, что видят бот и админка, без дат и случайных значений"""
+    repeat = db.fulfill_payment(payment_id)
+    return {
+        "stats": db.get_stats(),
+        "users": [db.get_user(user_id)["username"] for user_id in range(1, 6)],
+        "reviews": [review["text"] for review in db.get_reviews()],
+        "purchases": [purchase["keys"] == keys[:2] for purchase in db.get_purchases(1)],
+        "repeat": (repeat["status"], repeat["keys"] == keys[:2]),
+        "statuses": [db.get_key_info(key)["status"] for key in (keys[0], keys[2], keys[-1])],
+        "tickets": [ticket["status"] for ticket in db.get_user_tickets(1).values()],
+        "dead_letters": [letter["error"] for letter in db.get_dead_letters()],
+        "stock": db.get_keys_count("seller_1")
+    }
+
+
+def test_same_results_as_json():
+    results = []
+    for db in (Database("shop.json", "snapshot"), SQLiteDatabase("shop.sqlite3")):
+        results.append(summary(db, *fill(db)))
+        db.close()
+    assert results[0] == results[1]
+    assert results[1]["statuses"] == ["sold", "in_stock", "revoked"]
+    assert results[1]["stock"] == 7
+
+
+@pytest.mark.parametrize("persist", ["snapshot", "journal"])
+def test_migrate_from_json(persist):
+    db = Database("shop.json", persist)
+    keys, payment_id = fill(db)
+    expected = summary(db, keys, payment_id)
+    db.close()
+
+    # Повторный перенос ничего не дублирует
+    for _ in range(2):
+        migrate_from_json("shop.json", "shop.sqlite3")
+        store = SQLiteDatabase("shop.sqlite3")
+        assert summary(store, keys, payment_id) == expected
+        store.close()
+
+    store = SQLiteDatabase("shop.sqlite3")
+    assert store.take_keys("seller_1", 7) == keys[2:9]
+    assert store.get_key_info(keys[2])["status"] == "in_stock"
+    assert store.add_review(3, "c") > max(review["id"] for review in store.get_reviews() if review["text"] != "c")
+    store.close()
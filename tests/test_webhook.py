@@ -0,0 +1,103 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import SECRET_HEADER, WebhookServer
+
+TOKEN = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+SECRET = "s3cret"
+
+
+def update(update_id: int, text: str = "/start") -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": 77, "type": "private"},
+            "from": {"id": 77, "is_bot": False, "first_name": "x"}
+        }
+    }
+
+
+async def fake_telegram(sent: list) -> TestServer:
+    """Локальный Bot API: принимает sendMessage и запоминает тексты"""
+    async def send_message(request: web.Request) -> web.Response:
+        data = await request.post()
+        sent.append(data["text"])
+        chat = {"id": int(data["chat_id"]), "type": "private"}
+        return web.json_response({"ok": True, "result": {
+            "message_id": len(sent), "date": 0, "text": data["text"], "chat": chat
+        }})
+
+    app = web.Application()
+    app.router.add_post(f"/bot{TOKEN}/sendMessage", send_message)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+async def start(release: asyncio.Event):
+    """(клиент webhook-сервера, WebhookServer, фейковый Telegram, отправленные ботом тексты)"""
+    sent = []
+    telegram = await fake_telegram(sent)
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(str(telegram.make_url("")).rstrip("/"))))
+    dp = Dispatcher()
+
+    @dp.message()
+    async def echo(message: Message):
+        await release.wait()
+        await message.answer(f"echo {message.text}")
+
+    server = WebhookServer(dp, bot, SECRET, max_concurrency=4)
+    client = TestClient(TestServer(server.make_app("/webhook")))
+    await client.start_server()
+    return client, server, telegram, sent
+
+
+async def stop(client: TestClient, server: WebhookServer, telegram: TestServer):
+    await client.close()
+    await server.bot.session.close()
+    await telegram.close()
+
+
+def post(client: TestClient, body, secret: str = SECRET, **kwargs):
+    return client.post("/webhook", json=body, headers={SECRET_HEADER: secret} if secret else {}, **kwargs)
+
+
+def test_secret_and_bad_body():
+    async def main():
+        release = asyncio.Event()
+        release.set()
+        client, server, telegram, sent = await start(release)
+        assert (await post(client, update(1), secret="")).status == 401
+        assert (await post(client, update(2), secret="wrong")).status == 401
+        assert (await client.post("/webhook", data=b"{not json", headers={SECRET_HEADER: SECRET})).status == 400
+        assert (await post(client, {"update_id": "x"})).status == 400
+        assert (await post(client, update(3, "hi"))).status == 200
+        await server.drain(5)
+        assert sent == ["echo hi"]
+        await stop(client, server, telegram)
+    asyncio.run(main())
+
+
+def test_drain_waits_for_accepted_updates():
+    async def main():
+        release = asyncio.Event()
+        client, server, telegram, sent = await start(release)
+        # Апдейт подтверждается сразу, обработка ждёт release
+        assert (await post(client, update(1, "first"))).status == 200
+        draining = asyncio.create_task(server.drain(5))
+        await asyncio.sleep(0)
+        # После начала остановки новые апдейты не принимаются - Telegram их повторит
+        assert (await post(client, update(2, "second"))).status == 503
+        assert not draining.done()
+        release.set()
+        await draining
+        assert sent == ["echo first"]
+        await stop(client, server, telegram)
+    asyncio.run(main())
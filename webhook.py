@@ -0,0 +1,101 @@
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import cfg
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """Приём апдейтов Telegram по webhook (aiohttp).
+
+    Апдейт подтверждается сразу, обработка идёт в фоне. Одновременно
+    обрабатывается не больше max_concurrency апдейтов; когда все слоты
+    заняты, ответ Telegram задерживается, и он сам притормаживает отправку.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str = "", max_concurrency: int = 64):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks = set()
+        self._accepting = True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        if not self._accepting:
+            # Telegram повторит доставку после перезапуска
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError:
+            return web.Response(status=400)
+
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception:
+            logging.exception("Ошибка обработки апдейта %s", update.update_id)
+        finally:
+            self._slots.release()
+
+    async def drain(self, timeout: float):
+        """Перестаёт принимать апдейты и дожидается уже принятых"""
+        self._accepting = False
+        if self._tasks:
+            done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            if pending:
+                logging.warning("Не дождались %d апдейтов при остановке", len(pending))
+
+    def make_app(self, path: str) -> web.Application:
+        app = web.Application()
+        app.router.add_post(path, self.handle)
+        return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Запускает webhook-сервер и работает до SIGTERM/SIGINT"""
+    server = WebhookServer(dp, bot, cfg.WEBHOOK_SECRET, cfg.WEBHOOK_MAX_CONCURRENCY)
+    runner = web.AppRunner(server.make_app(cfg.WEBHOOK_PATH))
+    await runner.setup()
+    site = web.TCPSite(runner, cfg.WEBHOOK_HOST, cfg.WEBHOOK_PORT, reuse_port=cfg.WORKERS > 1 or None)
+    await site.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        if cfg.WEBHOOK_URL and cfg.WORKER_ID == 0:
+            await bot.set_webhook(
+                cfg.WEBHOOK_URL.rstrip("/") + cfg.WEBHOOK_PATH,
+                secret_token=cfg.WEBHOOK_SECRET or None,
+                max_connections=min(cfg.WEBHOOK_MAX_CONCURRENCY, 100),
+                allowed_updates=dp.resolve_used_update_types()
+            )
+        logging.info("Webhook слушает %s:%s%s", cfg.WEBHOOK_HOST, cfg.WEBHOOK_PORT, cfg.WEBHOOK_PATH)
+        await stop.wait()
+    finally:
+        await server.drain(cfg.WEBHOOK_DRAIN_TIMEOUT)
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()